@@ -26,6 +26,13 @@ def add_common_args(psr):
                      help="feature vocabulary")
     psr.add_argument("--quiet", action="store_true",
                      help="Supress all feedback")
+    psr.add_argument("--cache-dir", metavar="DIR",
+                     help="read (and save) compiled versions of the "
+                     "input files in this directory")
+    psr.add_argument("--load-jobs", metavar="N",
+                     type=int, default=1,
+                     help="number of processes to read the features "
+                     "file with (default 1, -1 for all CPUs)")
 
 
 def add_fold_choice_args(psr):
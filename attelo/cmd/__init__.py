@@ -7,13 +7,15 @@ attelo subcommands
 
 # pylint: disable=import-self
 from . import\
-    (enfold,
+    (compile_mpack,
+     enfold,
      inspect,
      graph,
      rewrite,
      report)
 
-SUBCOMMANDS = [enfold,
+SUBCOMMANDS = [compile_mpack,
+               enfold,
                inspect,
                graph,
                rewrite,
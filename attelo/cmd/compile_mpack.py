@@ -0,0 +1,34 @@
+"compile input files into a faster to load binary format"
+
+from __future__ import print_function
+import sys
+
+from ..args import (add_common_args)
+from ..io import (compile_multipack)
+
+NAME = 'compile'
+
+
+def config_argparser(psr):
+    "add subcommand arguments to subparser"
+
+    add_common_args(psr)
+    psr.set_defaults(func=main)
+    psr.add_argument("--output", metavar="DIR",
+                     help="cache directory to save the compiled data in "
+                     "(default: --cache-dir)")
+
+
+def main(args):
+    "subcommand main (called from mother script)"
+    cache_dir = args.output or args.cache_dir
+    if cache_dir is None:
+        sys.exit("arg error: one of --output or --cache-dir is required")
+    compiled_dir = compile_multipack(args.edus,
+                                     args.pairings,
+                                     args.features,
+                                     args.vocab,
+                                     cache_dir,
+                                     verbose=not args.quiet,
+                                     n_jobs=args.load_jobs)
+    print(compiled_dir)
@@ -86,7 +86,7 @@ def _validate_report_args(wrapped):
 def main(args):
     "subcommand main (invoked from outer script)"
     output_dir = get_output_dir(args)
-    mpack = load_args_multipack(args)
+    mpack = load_args_multipack(args, features=False)
     if args.fold is not None:
         fold_dict = load_fold_dict(args.fold_file)
         mpack = select_testing(mpack, fold_dict, args.fold)
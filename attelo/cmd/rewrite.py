@@ -39,7 +39,7 @@ def main_for_harness(args):
     (see `select_data`)
     """
     output_dir = get_output_dir(args)
-    mpack = load_args_multipack(args)
+    mpack = load_args_multipack(args, features=False)
     fold_dict = load_fold_dict(args.fold_file)
     for fold in set(fold_dict.values()):
         fpack = select_testing(mpack, fold_dict, fold)
@@ -11,15 +11,21 @@ import tempfile
 from attelo.io import load_multipack
 
 
-def load_args_multipack(args):
+def load_args_multipack(args, features=True):
     '''
     Load multipack specified via command line arguments
+
+    Set `features` to False if you only need the targets
+    (see `attelo.io.load_multipack`)
     '''
     return load_multipack(args.edus,
                           args.pairings,
                           args.features,
                           args.vocab,
-                          verbose=not args.quiet)
+                          verbose=not args.quiet,
+                          cache_dir=args.cache_dir,
+                          n_jobs=args.load_jobs,
+                          features=features)
 
 
 def get_output_dir(args):
@@ -13,18 +13,16 @@ TODO: unlabelled evaluation seems to bug on RF decoding (relation is of type ora
 """
 
 from __future__ import print_function
-import copy
+import itertools
 import sys
+import time
 import numpy
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from enum import Enum
 
 from attelo.optimisation.astar import State, Search, BeamSearch
 from .interface import Decoder
-from .util import (convert_prediction,
-                   get_sorted_edus,
-                   get_prob_map,
-                   simple_candidates)
+from .util import convert_prediction
 
 # pylint: disable=too-few-public-methods
 
@@ -127,78 +125,130 @@ class DiscData(object):
 
     RF: right frontier, = admissible attachment point of current discourse unit
 
+    States are never modified once built. The units to link are a tuple
+    shared by all states, of which we only keep the position of the next
+    unit to link. The right frontier is a persistent linked list of
+    `(edu, rest)` cells, rightmost unit first, so that a successor state
+    shares whatever part of the frontier it keeps with its parent.
+
     :param parent: parent state (previous decision)
 
-    :param link: current decision (a triplet: target edu, source edu, relation)
-    :type link: (string, string, string)
+    :param accessible: initial right frontier (in reading order)
+    :type accessible: [string]
 
     :param tolink: remaining unattached discourse units
     :type tolink: [string]
     """
+    __slots__ = ('parent', '_link', '_tolink', '_next', '_frontier')
+
     def __init__(self, parent=None, accessible=None, tolink=None):
-        self._accessible = accessible or []
         self.parent = parent
         self._link = None
-        self._tolink = tolink or []
+        self._tolink = tuple(tolink or [])
+        self._next = 0
+        self._frontier = None
+        for edu in accessible or []:
+            self._frontier = (edu, self._frontier)
+
+    def frontier_cells(self):
+        """iterate over the cells of the right frontier, from right to
+        left (see `link_cell`)"""
+        cell = self._frontier
+        while cell is not None:
+            yield cell
+            cell = cell[1]
 
     def accessible(self):
         """return the list of edus that are on the right frontier
 
         :rtype: [string]
         """
-        return self._accessible
+        res = [edu for edu, _ in self.frontier_cells()]
+        res.reverse()
+        return res
 
     def final(self):
         "return `True` if there are no more links to be made"
-        return self._tolink == []
+        return self._next == len(self._tolink)
 
     def tobedone(self):
-        """return the list of edus to be linked
+        """return the edus to be linked
 
-        :rtype: [string]
+        :rtype: (string)
         """
-        return self._tolink
+        return self._tolink[self._next:]
+
+    def next_edu(self):
+        "return the next edu to be linked"
+        return self._tolink[self._next]
+
+    def position(self):
+        "return the number of edus linked so far"
+        return self._next
+
+    def signature(self):
+        """return what determines the future of the parse from here on:
+        the position of the next edu to link, and the right frontier
+
+        :rtype: (int, (string))
+        """
+        return (self._next, tuple(edu for edu, _ in self.frontier_cells()))
 
     def last_link(self):
         "return the link that was made to get to this state, if any"
         return self._link
 
-    def link(self, to_edu, from_edu, relation,
-             rfc=RfcConstraint.full):
+    def link(self, to_edu, relation, rfc=RfcConstraint.full):
+        """
+        Return the state we get by attaching the next edu to link to
+        `to_edu` (which must be on the right frontier) with the given
+        relation (see `link_cell`)
+        """
+        for cell in self.frontier_cells():
+            if cell[0] == to_edu:
+                return self.link_cell(cell, relation, rfc=rfc)
+        raise ValueError("{} is not on the right frontier".format(to_edu))
+
+    def link_cell(self, cell, relation, rfc=RfcConstraint.full):
         """
+        Return the state we get by attaching the next edu to link to
+        the right frontier unit in the given cell (see `frontier_cells`)
+
         rfc = "full": use the distinction coord/subord
         rfc = "simple": consider everything as subord
         rfc = "none" no constraint on attachment
         """
-        #if to_edu not in self.accessible():
-        #    print("error: unreachable node", to_edu, "(ignored)", file= sys.stderr)
-        if True:
-            index = self.accessible().index(to_edu)
-            self._link = (to_edu, from_edu, relation)
-            # update the right frontier -- coord relations replace their
-            # attachment points, subord are appended, and evrything below
-            # disappear from the RF
-            # unknown relations are subord
-            #print(type(relation), file= sys.stderr)
-            #print(map(type, SUBORD_COORD.values()), file= sys.stderr)
-            if rfc == RfcConstraint.full and\
-                SUBORD_COORD.get(relation, "subord") == "coord":
-                self._accessible = self._accessible[:index]
-            elif rfc == RfcConstraint.simple:
-                self._accessible = self._accessible[:index + 1]
-            elif rfc == RfcConstraint.none:
-                pass
+        # update the right frontier -- coord relations replace their
+        # attachment points, subord are appended, and evrything below
+        # disappear from the RF
+        # unknown relations are subord
+        if rfc == RfcConstraint.full:
+            if SUBORD_COORD.get(relation, "subord") == "coord":
+                kept = cell[1]
             else:
-                raise Exception("Unknown RFC: {}".format(rfc))
-            self._accessible.append(from_edu)
+                kept = cell
+        elif rfc == RfcConstraint.simple:
+            kept = cell
+        elif rfc == RfcConstraint.none:
+            kept = self._frontier
+        else:
+            raise Exception("Unknown RFC: {}".format(rfc))
+        from_edu = self.next_edu()
+        new = DiscData.__new__(DiscData)
+        new.parent = self
+        new._link = (cell[0], from_edu, relation)
+        new._tolink = self._tolink
+        new._next = self._next + 1
+        new._frontier = (from_edu, kept)
+        return new
 
     def __str__(self):
         template = ("{link}/ "
                     "accessibility={accessibility}/ "
                     "to attach={to_attach}")
         return template.format(link=self._link,
-                               accessibility=self._accessible,
-                               to_attach=[str(x) for x in self._tolink])
+                               accessibility=self.accessible(),
+                               to_attach=[str(x) for x in self.tobedone()])
 
     def __repr__(self):
         return str(self)
@@ -255,6 +305,9 @@ class DiscourseState(State):
     def is_solution(self):
         return self.data().final()
 
+    def signature(self):
+        return self.data().signature()
+
     def _mk_score_transform(self):
         """return a function that converts scores depending on our
         configuration"""
@@ -270,18 +323,16 @@ class DiscourseState(State):
         TODO: adapt to disc parse, according to choice made for data -> especially update to RFC
         """
         res = []
-        one = self.data().tobedone()[0]
+        data = self.data()
+        one = data.next_edu()
         transform = self._mk_score_transform()
-        #print ">> taking care of node ", one
-        for attachmt in self.data().accessible():
-            new = copy.deepcopy(self.data())
-            new.tobedone().pop(0)
-            relation, prob = self.proba((attachmt, one))
+        for cell in data.frontier_cells():
+            relation, prob = self.proba((cell[0], one))
             if prob is not None:
-                new.link(attachmt, one, relation, rfc=self.strategy())
-                new.parent = self.data()
-                score = transform(prob)
-                res.append((new, score))
+                new = data.link_cell(cell, relation, rfc=self.strategy())
+                res.append((new, transform(prob)))
+        # in reading order, as the attachment points used to be
+        res.reverse()
         return res
 
     def __str__(self):
@@ -300,110 +351,22 @@ class DiscourseState(State):
     # pylint: enable=no-self-use
 
     def h_average(self):
-        """return the average probability possible when n nodes still need to be attached
-        assuming the best overall prob in the distrib"""
-        missing_links = self.data().tobedone()
-        transform = self._mk_score_transform()
-        return sum(transform(self.shared()["heuristics"]["average"][x])
-                   for x in missing_links)
+        """return the cost of attaching the nodes that still need to be
+        attached, each with the average probability of its incoming
+        links (NB: not admissible)"""
+        return self.shared()["heuristics"]["average"][self.data().position()]
 
     def h_best_overall(self):
-        """return the best probability possible when n nodes still need to be attached
-        assuming the best overall prob in the distrib"""
-        missing_links = len(self.data().tobedone())
-        transform = self._mk_score_transform()
-        prob = self.shared()["heuristics"]["best_overall"]
-        return transform(prob) * missing_links
+        """return the cost of attaching the nodes that still need to be
+        attached, assuming the best overall prob in the distrib"""
+        heuristics = self.shared()["heuristics"]
+        return heuristics["best_overall"][self.data().position()]
 
     def h_best(self):
-        """return the best probability possible when n nodes still need to be attached
-        assuming the best overall prob in the distrib"""
-        missing_links = self.data().tobedone()
-        transform = self._mk_score_transform()
-        return sum(transform(self.shared()["heuristics"]["best_attach"][x])
-                   for x in missing_links)
-
-#########################################
-
-class TwoStageNROData(DiscData):
-    """similar as above with different handling of inter-sentence and intra-sentence relations
-
-    accessible is list of starting edus (only one for now)
-    """
-
-    def __init__(self, parent=None, accessible=None, tolink=None):
-        super(TwoStageNROData, self).__init__(parent=parent,
-                                              accessible=accessible,
-                                              tolink=tolink)
-        self._accessible_global = accessible or []
-        self._accessible_sentence = accessible or []
-        self._intra = True
-        self._current_sentence = 1
-
-    def accessible(self):
-        """
-        wip:
-        """
-        if self._intra:
-            return self._accessible_sentence
-        else:
-            return self._accessible_global
-
-    def update_mode(self):
-        "switch between intra/inter-sentential parsing mode"
-        self._intra = not self._intra
-
-    def link(self, to_edu, from_edu, relation):
-        """WIP
-
-        """
-        index = self.accessible().index(to_edu)
-        self._link = (to_edu, from_edu, relation)
-        if self._intra: # simple RFC for now
-            self._accessible_global = self._accessible_sentence[: index + 1]
-            self._accessible_global.append(from_edu)
-        else:
-            self._accessible_sentence = self._accessible_sentence[:index + 1]
-            self._accessible_global.append(from_edu)
-
-
-
-class TwoStageNRO(DiscourseState):
-    """similar as above with different handling of inter-sentence and intra-sentence relations"""
-    def __init__(self):
-        pass
-
-    def same_sentence(self, edu1, edu2):
-        """not implemented: will always return False
-        TODO: this should go in preprocessing before launching astar
-        ?? would it be easier to have access to all edu pair features ??
-        (certainly for that one)
-        """
-        return self.shared().get("same_sentence", lambda x: False)(edu1, edu2)
-
-    def next_states(self):
-        """must return a state and a cost
-        """
-        # TODO: decode differently on intra/inter sentence
-        res = []
-        one = self.data().tobedone()[0]
-        # inter/intra
-        # if intra shared.sentence([one]) != current
-        #      current += 1 / intra = False
-        # else:
-        #      intra = True
-
-
-        for attachmt in self.data().accessible():
-            new = copy.deepcopy(self.data())
-            new.tobedone().pop(0)
-            relation, prob = self.proba((attachmt, one))
-            transform = self._mk_score_transform()
-            if prob is not None:
-                new.link(attachmt, one, relation)
-                new.parent = self.data()
-                res.append((new, transform(prob)))
-        return res
+        """return the cost of attaching the nodes that still need to be
+        attached, each with the best probability of its incoming links"""
+        heuristics = self.shared()["heuristics"]
+        return heuristics["best_attach"][self.data().position()]
 
 ###################################
 
@@ -463,7 +426,9 @@ class AstarArgs(namedtuple('AstarArgs',
                            ['heuristics',
                             'rfc',
                             'beam',
-                            'use_prob'])):
+                            'use_prob',
+                            'max_expansions',
+                            'deadline_ms'])):
     """
     Configuration options for the A* decoder
 
@@ -475,39 +440,112 @@ class AstarArgs(namedtuple('AstarArgs',
                      (to be mapped to -log) or arbitrary scores (untouched)
     :type use_prob: bool
 
-    :param beam: size of the beam-search (if None: vanilla astar)
+    :param beam: beam width, ie. maximum number of states waiting to be
+                 explored (if None: vanilla astar)
     :type beam: int or None
 
     :param rfc: what sort of right frontier constraint to apply
     :type rfc: RfcConstraint
+
+    :param max_expansions: if set, give up on finding the optimal
+                           solution after expanding this many states,
+                           and complete the most promising partial
+                           solution greedily instead
+    :type max_expansions: int or None
+
+    :param deadline_ms: same as `max_expansions`, but after spending
+                        this many milliseconds on a document
+    :type deadline_ms: float or None
     """
-    pass
+    def __new__(cls, heuristics, rfc, beam, use_prob,
+                max_expansions=None, deadline_ms=None):
+        return super(AstarArgs, cls).__new__(cls, heuristics, rfc, beam,
+                                             use_prob, max_expansions,
+                                             deadline_ms)
 # pylint: enable=too-many-arguments
 
 
+class AstarStats(namedtuple('AstarStats',
+                            ['expanded',
+                             'optimal'])):
+    """
+    What happened during an A* decoding run
+
+    :param expanded: number of search states expanded
+    :type expanded: int
+
+    :param optimal: if the solution is known to be optimal, ie. the
+                    search was neither cut short by the time/expansion
+                    budget nor by the beam (assuming an admissible
+                    heuristic, see `DiscourseState.h_average`)
+    :type optimal: bool
+    """
+    pass
+
+
+
+def preprocess_heuristics(cands, tolink, use_prob=True):
+    """precompute the estimated cost of linking each suffix of the edus
+    to link, for each heuristic:
+
+             - best_overall: best probability in the distribution
+             - best_attach: best probability of a link to each node
+             - average: average probability of the links to each node
+
+    Nodes without any incoming link have probability 0 (infinite cost
+    if `use_prob`).
+
+    :type cands: Candidates
 
-def preprocess_heuristics(cands):
-    """precompute a set of useful information used by heuristics, such as
-             - best probability
-             - table of best probability when attaching a node, indexed on that node
+    :param tolink: ids of the edus to link, in the order they are linked
+    :type tolink: [string]
+
+    :param use_prob: see `AstarArgs`
 
-    format of cands is format given in main decoder: a list of
-    (arg1,arg2,proba,best_relation)
+    :returns: dictionary from heuristic to a list giving the cost of
+              linking `tolink[i:]` for each i (ie. with `len(tolink)+1`
+              items)
+    :rtype: dict(string, [float])
     """
+    rows = {edu.id: i for i, edu in enumerate(cands.edus)}
+    order = numpy.array([rows[x] for x in tolink], dtype=numpy.int64)
+    attach = cands.attach.astype(numpy.float64)
+    num_edus = len(cands.edus)
+    best = numpy.zeros(num_edus)
+    numpy.maximum.at(best, cands.tgt, attach)
+    counts = numpy.bincount(cands.tgt, minlength=num_edus)
+    totals = numpy.bincount(cands.tgt, weights=attach, minlength=num_edus)
+    average = numpy.zeros(num_edus)
+    numpy.divide(totals, counts, out=average, where=counts > 0)
+    probs = {"best_overall": numpy.repeat(attach.max(), len(order)),
+             "best_attach": best[order],
+             "average": average[order]}
     result = {}
-    result["best_overall"] = max([x[2] for x in cands])
-    result["best_attach"] = defaultdict(float)
-    result["average"] = defaultdict(list)
-    for du1, du2, score, label in cands:
-        result["best_attach"][du2.id] = max(result["best_attach"][du2.id], score)
-        result["average"][du2.id].append(score)
-
-    for one in result["average"]:
-        result["average"][one] = sum(result["average"][one])/len(result["average"][one])
-    #print(result, file= sys.stderr)
+    for key, prob in probs.items():
+        if use_prob:
+            with numpy.errstate(divide='ignore'):
+                cost = -numpy.log(prob)
+        else:
+            cost = prob
+        suffix_sums = numpy.zeros(len(cost) + 1)
+        suffix_sums[:-1] = numpy.cumsum(cost[::-1])[::-1]
+        result[key] = suffix_sums.tolist()
     return result
 
 
+def _prob_map(dpack):
+    """
+    Dictionary from EDU id pairs to (relation, probability) tuples
+    for the candidate links of a datapack (see `get_prob_map`)
+    """
+    cands = dpack.candidates
+    ids = [edu.id for edu in cands.edus]
+    labels = dpack.get_labels(cands.label)
+    return {(ids[src], ids[tgt]): (lbl, prob)
+            for src, tgt, lbl, prob
+            in zip(cands.src, cands.tgt, labels, cands.attach)}
+
+
 # TODO: order function should be a method parameter
 # - root should be specified ? or a fake root ? for now, it is the first edu
 # - should allow for (at least local) argument inversion (eg background), for more expressivity
@@ -521,16 +559,23 @@ class AstarDecoder(Decoder):
         self._heuristic = astar_args.heuristics
         self._args = astar_args
 
-    def decode(self, dpack):
-        cands = simple_candidates(dpack)
-        probs = get_prob_map(cands)
-        edus = [x.id for x in get_sorted_edus(cands)]
-        print("\t %s nodes to attach"%(len(edus)-1), file=sys.stderr)
+    def _launch(self, dpack, nbest=1):
+        """
+        Set up the search for the `nbest` best solutions for a document
+        and launch it
+
+        :rtype: (DiscourseSearch, generator of DiscourseState)
+        """
+        start = time.time()
+        cands = dpack.candidates
+        probs = _prob_map(dpack)
+        edus = [cands.edus[i].id for i in cands.sorted_edus()]
 
         heuristic = HEURISTICS[self._heuristic]
         search_shared = {"probs": probs,
                          "use_prob": self._args.use_prob,
-                         "heuristics": preprocess_heuristics(cands),
+                         "heuristics": preprocess_heuristics(
+                             cands, edus[1:], use_prob=self._args.use_prob),
                          "RFC": self._args.rfc}
         if self._args.beam:
             astar = DiscourseBeamSearch(heuristic=heuristic,
@@ -539,8 +584,47 @@ class AstarDecoder(Decoder):
         else:
             astar = DiscourseSearch(heuristic=heuristic,
                                     shared=search_shared)
-            genall = astar.launch(DiscData(accessible=[edus[0]], tolink=edus[1:]),
-                                  norepeat=True, verbose=False)
+        if self._args.deadline_ms is None:
+            deadline = None
+        else:
+            deadline = start + self._args.deadline_ms / 1000.
+        genall = astar.launch(DiscData(accessible=[edus[0]], tolink=edus[1:]),
+                              norepeat=False, verbose=False,
+                              max_expansions=self._args.max_expansions,
+                              deadline=deadline,
+                              visits=nbest)
+        return astar, genall
+
+    def decode_with_stats(self, dpack):
+        """
+        Return the best prediction we could find for the document,
+        and the search statistics (notably whether it is known to be
+        optimal)
+
+        :rtype: (DataPack, AstarStats)
+        """
+        astar, genall = self._launch(dpack)
         endstate = genall.next()
+        stats = AstarStats(expanded=astar.expanded,
+                           optimal=astar.optimal)
+        print("\t %s nodes to attach, %s states expanded%s" %
+              (endstate.data().position(), stats.expanded,
+               "" if stats.optimal else " (not optimal)"),
+              file=sys.stderr)
         sol = astar.recover_solution(endstate)
-        return convert_prediction(dpack, sol)
+        return convert_prediction(dpack, sol), stats
+
+    def decode(self, dpack):
+        return self.decode_with_stats(dpack)[0]
+
+    def decode_nbest(self, dpack, nbest):
+        """
+        Return the `nbest` best predictions for the document, best
+        first, all from the same search (we may find fewer if there
+        are not so many, or if the search is cut short by a budget)
+
+        :rtype: [DataPack]
+        """
+        astar, genall = self._launch(dpack, nbest=nbest)
+        return [convert_prediction(dpack, astar.recover_solution(endstate))
+                for endstate in itertools.islice(genall, nbest)]
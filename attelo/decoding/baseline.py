@@ -2,12 +2,11 @@
 Baseline decoders
 """
 
+import numpy as np
+
 from .interface import Decoder
-from .util import (convert_prediction,
-                   get_sorted_edus,
-                   get_prob_map,
-                   DecoderException,
-                   simple_candidates)
+from .util import (convert_prediction_pairings,
+                   DecoderException)
 
 # pylint: disable=too-few-public-methods
 
@@ -19,10 +18,8 @@ class LocalBaseline(Decoder):
 
     def decode(self, dpack, nonfixed_pairs=None):
         # TODO integrate nonfixed_pairs, maybe?
-        cands = simple_candidates(dpack)
-        results = [(e1.id, e2.id, lab) for e1, e2, w, lab in cands
-                   if w > self._threshold]
-        return convert_prediction(dpack, results)
+        attached = np.where(dpack.graph.attach > self._threshold)[0]
+        return convert_prediction_pairings(dpack, attached)
 
 
 class LastBaseline(Decoder):
@@ -30,29 +27,13 @@ class LastBaseline(Decoder):
 
     def decode(self, dpack, nonfixed_pairs=None):
         # TODO integrate nonfixed_pairs, maybe?
-        cands = simple_candidates(dpack)
-        labels_probs = get_prob_map(cands)
-
-        def get_prediction(edu1, edu2):
-            """Return triple of EDU ids and label from the probability
-            distribution (or None if no attachment)"""
-            span1 = edu1.span()
-            span2 = edu2.span()
-            id_pair = (edu1.id, edu2.id)
-            if id_pair in labels_probs:
-                label, _ = labels_probs[id_pair]
-                return (edu1.id, edu2.id, label)
-            elif span1 == span2:
-                return None
-            else:
+        cands = dpack.candidates
+        rows = cands.sorted_edus()
+        found = cands.lookup(rows[:-1], rows[1:])
+        for src, tgt in zip(rows[:-1][found < 0], rows[1:][found < 0]):
+            edu1 = cands.edus[src]
+            edu2 = cands.edus[tgt]
+            if edu1.span() != edu2.span():
                 raise DecoderException("Could not find row with EDU pairs "
                                        "%s and %s: " % (edu1.id, edu2.id))
-
-        edus = get_sorted_edus(cands)
-        ordered_pairs = zip(edus[:-1], edus[1:])
-        results = []
-        for edu1, edu2 in ordered_pairs:
-            prediction = get_prediction(edu1, edu2)
-            if prediction:
-                results.append(prediction)
-        return convert_prediction(dpack, results)
+        return convert_prediction_pairings(dpack, found[found >= 0])
@@ -1,13 +1,410 @@
 """Eisner decoder
 """
 
+import heapq
+
 import numpy as np
 
 from .interface import Decoder
 # temporary? imports
-from ..table import _edu_positions
-from .util import (cap_score, convert_prediction, simple_candidates,
-                   MIN_SCORE)
+from ..table import _edu_position_array, UNRELATED
+from .util import (convert_prediction_idxes, MAX_SCORE, MIN_SCORE)
+
+
+def _score_matrices(dpack, use_prob, use_labels=False):
+    """Dense versions of the datapack attachment scores and best
+    labels, indexed by EDU position in the document
+
+    Parameters
+    ----------
+    dpack: DataPack
+        Weighted datapack
+
+    use_prob: boolean
+        If True, attachment scores are probabilities which should
+        be moved to log space
+
+    use_labels: boolean, optional
+        If True, score each attachment jointly with its best label,
+        ie. add the label score to the attachment score (in log space
+        if `use_prob`)
+
+    Returns
+    -------
+    rows: array(int)
+        Row in `dpack.edu_table` of the EDU at each position
+
+    score: array(float) of shape (n, n)
+        Score of the attachment from the EDU at position `i` to the
+        EDU at position `j` (`MIN_SCORE` for missing pairings and
+        for attachments to the fake root)
+
+    label: array(int) of shape (n, n)
+        Number of the best label for each attachment (unrelated for
+        missing pairings)
+    """
+    nb_edus = len(dpack.edus)
+    position = _edu_position_array(dpack)
+    # reverse mapping, preferring the fake root at position 0
+    rows = np.zeros(nb_edus, dtype=np.int64)
+    rows[position[::-1]] = np.arange(len(position))[::-1]
+    rows[position[dpack.edu_table.fake_root]] = \
+        np.where(dpack.edu_table.fake_root)[0]
+
+    cands = dpack.candidates
+    srcs = position[cands.src]
+    tgts = position[cands.tgt]
+    attach = cands.attach.astype(np.float64)
+    if use_labels:
+        # the best label is also the one that maximises the joint score
+        label_score = np.ravel(np.amax(dpack.graph.label, axis=1))
+        label_score = label_score.astype(np.float64)
+    # FIXME scores (probabilities or discriminative scores) should
+    # be adapted before this point
+    if use_prob:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            attach = np.log(attach)
+            if use_labels:
+                attach += np.log(label_score)
+        attach = np.clip(attach, MIN_SCORE, MAX_SCORE)
+        attach[np.isnan(attach)] = MIN_SCORE
+    elif use_labels:
+        attach += label_score
+    score = np.empty((nb_edus, nb_edus), dtype=np.float64)
+    score.fill(MIN_SCORE)
+    score[srcs, tgts] = attach
+    # no attachment to the fake root
+    score[:, 0] = MIN_SCORE
+
+    label = np.empty((nb_edus, nb_edus), dtype=np.int64)
+    label.fill(dpack.label_number(UNRELATED))
+    label[srcs, tgts] = cands.label
+    return rows, score, label
+
+
+def _best_splits(cands, offsets):
+    """Row-wise max and first argmax of an array of candidate scores,
+    ignoring NaNs. Rows with only NaN candidates pick their first
+    split point.
+
+    Parameters
+    ----------
+    cands: array(float) of shape (m, w)
+        Candidate scores, one row per span
+
+    offsets: array(int) of shape (m,)
+        Split point of the first candidate of each row
+
+    Returns
+    -------
+    best: array(float) of shape (m,)
+
+    splits: array(int) of shape (m,)
+    """
+    best = np.fmax.reduce(cands, axis=1)
+    firsts = np.argmax(cands == best[:, np.newaxis], axis=1)
+    return best, offsets + firsts
+
+
+def eisner_chart(score, unique_real_root=True):
+    """Fill the Eisner chart for a dense score matrix.
+
+    All spans of a given width are processed at once, with their
+    split points along the second axis of a candidate array.
+
+    Parameters
+    ----------
+    score: array(float) of shape (n, n)
+        Score of each attachment, from head to dependent
+
+    unique_real_root: boolean, optional
+        If True, the fake root node (position 0) has a unique child
+
+    Returns
+    -------
+    cscores: array(float) of shape (n, n, 2, 2)
+        Best score of each substructure, indexed by
+        [start][end][dir][complete]
+
+    csplits: array(int) of shape (n, n, 2, 2)
+        Backpointers: split point of each substructure
+    """
+    nb_edus = len(score)
+    cscores = np.zeros((nb_edus, nb_edus, 2, 2), dtype=np.float64)
+    csplits = np.zeros((nb_edus, nb_edus, 2, 2), dtype=np.int32)
+
+    # iterate over all possible spans of increasing size
+    for span in range(1, nb_edus):
+        starts = np.arange(nb_edus - span)
+        ends = starts + span
+        # split points, one row per span
+        splits = starts[:, np.newaxis] + np.arange(span)
+        col_starts = starts[:, np.newaxis]
+        col_ends = ends[:, np.newaxis]
+
+        # incomplete structures: combine two complete ones and an arc
+        inner = (cscores[col_starts, splits, 0, 1] +
+                 cscores[splits + 1, col_ends, 1, 1])
+        # left open
+        cands = inner + score[ends, starts][:, np.newaxis]
+        best, best_k = _best_splits(cands, starts)
+        cscores[starts, ends, 1, 0] = best
+        csplits[starts, ends, 1, 0] = best_k
+        # right open
+        cands = inner + score[starts, ends][:, np.newaxis]
+        if unique_real_root:
+            # if start == 0, restricting the split points to [0]
+            # enforces that the tree has a unique real root
+            cands[0, 1:] = np.nan
+        best, best_k = _best_splits(cands, starts)
+        cscores[starts, ends, 0, 0] = best
+        csplits[starts, ends, 0, 0] = best_k
+
+        # left closed
+        cands = (cscores[col_starts, splits, 1, 1] +
+                 cscores[splits, col_ends, 1, 0])
+        best, best_k = _best_splits(cands, starts)
+        cscores[starts, ends, 1, 1] = best
+        csplits[starts, ends, 1, 1] = best_k
+
+        # right closed
+        cands = (cscores[col_starts, splits + 1, 0, 0] +
+                 cscores[splits + 1, col_ends, 0, 1])
+        best, best_k = _best_splits(cands, starts + 1)
+        cscores[starts, ends, 0, 1] = best
+        csplits[starts, ends, 0, 1] = best_k
+
+    return cscores, csplits
+
+
+def eisner_backtrack(csplits):
+    """Read the best tree off the backpointers of an Eisner chart
+
+    Returns
+    -------
+    edges: [(int, int)]
+        Head and dependent positions of each attachment in the
+        tree
+    """
+    nb_edus = len(csplits)
+    edges = []
+    # solution: C[0][n][->][1]
+    backpointers = [(0, nb_edus - 1, 0, 1)]
+    while backpointers:
+        start, end, dir_la, complete = backpointers.pop()
+        if start == end:
+            continue
+        k = csplits[start][end][dir_la][complete]
+        if complete:
+            # queue backpointers
+            if dir_la:
+                backpointers.extend([(start, k, dir_la, 1),
+                                     (k, end, dir_la, 0)])
+            else:
+                backpointers.extend([(start, k, dir_la, 0),
+                                     (k, end, dir_la, 1)])
+        else:
+            # add the underlying edge to the set of predictions
+            if dir_la:
+                edges.append((end, start))
+            else:
+                edges.append((start, end))
+            # queue backpointers
+            backpointers.extend([(start, k, 0, 1),
+                                 (k + 1, end, 1, 1)])
+    return edges
+
+
+class _KBestEisner(object):
+    """Lazy k-best derivations over a filled Eisner chart
+
+    This follows algorithm 3 of (Huang and Chiang 2005, Better k-best
+    parsing): each chart item keeps the list of its derivations found
+    so far, and a heap of candidate derivations which is only
+    extended when the next best derivation is requested.
+
+    A derivation of an item is a tuple `(score, k, j1, j2)`, where `k`
+    is the split point, and `j1` and `j2` are the ranks of the
+    derivations of the two sub-items.
+
+    Parameters
+    ----------
+    score: array(float) of shape (n, n)
+        Attachment scores, as for `eisner_chart` (NaN scores are not
+        supported)
+
+    cscores: array(float) of shape (n, n, 2, 2)
+        Best score of each item, from `eisner_chart`
+
+    unique_real_root: boolean
+        Must be the same as for `eisner_chart`
+    """
+    def __init__(self, score, cscores, unique_real_root):
+        self._score = score
+        self._cscores = cscores
+        self._unique_real_root = unique_real_root
+        self._derivs = {}
+        self._cands = {}
+        self._pending = {}
+        self._seen = {}
+
+    def _splits(self, item):
+        """Split points of the hyperedges leading to an item"""
+        start, end, dir_la, complete = item
+        if complete and not dir_la:
+            return range(start + 1, end + 1)
+        elif (not complete and not dir_la and
+              self._unique_real_root and start == 0):
+            return [0]
+        else:
+            return range(start, end)
+
+    def _tails(self, item, k):
+        """Sub-items and arc score of the hyperedge with split point
+        `k` leading to an item"""
+        start, end, dir_la, complete = item
+        if not complete:
+            arc = (self._score[end, start] if dir_la
+                   else self._score[start, end])
+            return (start, k, 0, 1), (k + 1, end, 1, 1), arc
+        elif dir_la:
+            return (start, k, 1, 1), (k, end, 1, 0), 0.
+        else:
+            return (start, k, 0, 0), (k, end, 0, 1), 0.
+
+    def _init(self, item):
+        """Start the candidate heap of an item with the best derivation
+        along each of its hyperedges"""
+        self._derivs[item] = []
+        self._pending[item] = []
+        splits = np.asarray(self._splits(item), dtype=np.int64)
+        start, end, dir_la, complete = item
+        # the chart gives us the best score of each sub-item
+        if not complete:
+            arc = (self._score[end, start] if dir_la
+                   else self._score[start, end])
+            scores = (self._cscores[start, splits, 0, 1] +
+                      self._cscores[splits + 1, end, 1, 1]) + arc
+        elif dir_la:
+            scores = (self._cscores[start, splits, 1, 1] +
+                      self._cscores[splits, end, 1, 0])
+        else:
+            scores = (self._cscores[start, splits, 0, 0] +
+                      self._cscores[splits, end, 0, 1])
+        cands = [(-score, k, 0, 0)
+                 for score, k in zip(scores.tolist(), splits.tolist())]
+        heapq.heapify(cands)
+        self._cands[item] = cands
+        self._seen[item] = set((k, 0, 0) for _, k, _, _ in cands)
+
+    def _unresolved(self, item, j):
+        """True if we do not know yet whether an item has a `j`-th best
+        derivation"""
+        if item[0] == item[1]:
+            return False
+        elif item not in self._derivs:
+            return True
+        return (len(self._derivs[item]) <= j and
+                bool(self._cands[item] or self._pending[item]))
+
+    def kth(self, item, j):
+        """The `j`-th best derivation of an item (counting from 0),
+        or None if it has fewer derivations
+        """
+        # the requests for sub-derivations are kept on an explicit
+        # stack rather than by recursion, which would be too deep for
+        # long documents
+        stack = [(item, j)]
+        while stack:
+            cur, cur_j = stack[-1]
+            if cur not in self._derivs:
+                self._init(cur)
+            pending = self._pending[cur]
+            if pending:
+                # neighbours of the last derivation, which we can only
+                # score once we have the sub-derivations they use
+                k, j1, j2 = pending[-1]
+                left, right, arc = self._tails(cur, k)
+                if self._unresolved(left, j1):
+                    stack.append((left, j1))
+                elif self._unresolved(right, j2):
+                    stack.append((right, j2))
+                else:
+                    pending.pop()
+                    left_d = self._get(left, j1)
+                    right_d = self._get(right, j2)
+                    if (left_d is not None and right_d is not None and
+                            (k, j1, j2) not in self._seen[cur]):
+                        self._seen[cur].add((k, j1, j2))
+                        heapq.heappush(self._cands[cur],
+                                       (-(left_d[0] + right_d[0] + arc),
+                                        k, j1, j2))
+            elif len(self._derivs[cur]) > cur_j or not self._cands[cur]:
+                stack.pop()
+            else:
+                neg_score, k, j1, j2 = heapq.heappop(self._cands[cur])
+                self._derivs[cur].append((-neg_score, k, j1, j2))
+                pending.extend([(k, j1, j2 + 1), (k, j1 + 1, j2)])
+        return self._get(item, j)
+
+    def _get(self, item, j):
+        """The `j`-th best derivation of an item if it is already
+        known, None otherwise"""
+        if item[0] == item[1]:
+            return (0., None, 0, 0) if j == 0 else None
+        derivs = self._derivs.get(item, [])
+        return derivs[j] if j < len(derivs) else None
+
+    def edges(self, item, j):
+        """Head and dependent positions of the attachments in the
+        `j`-th best derivation of an item"""
+        edges = []
+        stack = [(item, j)]
+        while stack:
+            item, j = stack.pop()
+            start, end, dir_la, complete = item
+            if start == end:
+                continue
+            _, k, j1, j2 = self.kth(item, j)
+            if not complete:
+                edges.append((end, start) if dir_la else (start, end))
+            left, right, _ = self._tails(item, k)
+            stack.extend([(left, j1), (right, j2)])
+        return edges
+
+
+def eisner_kbest(score, k, unique_real_root=True):
+    """The `k` best projective trees for a dense score matrix
+
+    Parameters
+    ----------
+    score: array(float) of shape (n, n)
+        Score of each attachment, from head to dependent (NaN scores
+        are treated as `MIN_SCORE`)
+
+    k: int
+        Maximal number of trees to return
+
+    unique_real_root: boolean, optional
+        If True, the fake root node (position 0) has a unique child
+
+    Returns
+    -------
+    trees: [(float, [(int, int)])]
+        Score and edges (head and dependent positions) of each tree,
+        best first
+    """
+    score = np.where(np.isnan(score), MIN_SCORE, score)
+    cscores, _ = eisner_chart(score, unique_real_root)
+    kbest = _KBestEisner(score, cscores, unique_real_root)
+    top = (0, len(score) - 1, 0, 1)
+    trees = []
+    for j in range(k):
+        deriv = kbest.kth(top, j)
+        if deriv is None:
+            break
+        trees.append((deriv[0], kbest.edges(top, j)))
+    return trees
 
 
 class EisnerDecoder(Decoder):
@@ -25,11 +422,23 @@ class EisnerDecoder(Decoder):
         If True, each output tree will have a unique real root, i.e. the
         fake root node will have a unique child.
         Defaults to True.
+
+    use_labels: boolean, optional
+        If True, score each edge with its attachment score combined
+        with the score of its best label, rather than with the
+        attachment score alone. The scores are multiplied if `use_prob`
+        is True, and summed otherwise (eg. for discriminative scores,
+        which are not in [0,1]). With probabilities, this has the same
+        effect as an `AttachTimesBestLabel` step before the decoder,
+        but without copying the datapack.
+        Defaults to False.
     """
 
-    def __init__(self, unique_real_root=True, use_prob=True):
+    def __init__(self, unique_real_root=True, use_prob=True,
+                 use_labels=False):
         self._unique_real_root = unique_real_root
         self._use_prob = use_prob  # yerk
+        self._use_labels = use_labels
 
     def decode(self, dpack, nonfixed_pairs=None):
         """Decode
@@ -44,145 +453,43 @@ class EisnerDecoder(Decoder):
         dpack_pred: DataPack
             A copy of the argument DataPack with predictions set.
         """
-        # whether the output tree should contain a unique real root
-        unique_real_root = self._unique_real_root
-
-        # get number of EDUs and possible labels
-        nb_edus = len(dpack.edus)
-        # nb_lbls = dpack.graph.label.shape[0]
-
-        # map EDU ids to their index in the document
-        edu_id2idx = _edu_positions(dpack)
-        # we will need the reverse mapping to produce the result
-        edu_idx2id = {edu_idx: edu_id
-                      for edu_id, edu_idx in edu_id2idx.items()}
-        # build dict((src_idx, tgt_idx), (attach_score, lbl_scores))
-        simple_cands = simple_candidates(dpack)
-        # FIXME scores (probabilities or discriminative scores) should
-        # be adapted before this point ;
-        # should be (src, tgt): attach_score
-        score = {(edu_id2idx[src.id], edu_id2idx[tgt.id]):
-                 (cap_score(np.log(attach_score)) if self._use_prob
-                  else attach_score)
-                 for src, tgt, attach_score, best_lbl
-                 in simple_cands}
-        label = {(edu_id2idx[src.id], edu_id2idx[tgt.id]):
-                 dpack.label_number(best_lbl)
-                 for src, tgt, attach_score, best_lbl
-                 in simple_cands}
-        # end attelo-isms
-
-        # Eisner algorithm
-        # arrays of substructures for dynamic programming
-        # [start][end][dir][complete]
-        # scores
-        cscores = np.zeros((nb_edus, nb_edus, 2, 2), dtype=np.float64)
-        # backpointers: index of split point
-        csplits = np.zeros((nb_edus, nb_edus, 2, 2), dtype=np.int32)
-
-        # iterate over all possible spans of increasing size
-        for span in range(1, nb_edus):
-            for start in range(nb_edus - span):
-                end = start + span
-
-                # left open
-                range_k = range(start, end)
-                # find argmax and max on range_k
-                cands = [(cscores[start][k][0][1] +
-                          cscores[k + 1][end][1][1] +
-                          (score[(end, start)]
-                           if start > 0 and (end, start) in score
-                           else MIN_SCORE))
-                         for k in range_k]
-                max_cand = np.nanmax(cands)
-                argmax_cand = (range_k[cands.index(max_cand)]
-                               if not np.isnan(max_cand)
-                               else range_k[0])
-                # update tables
-                cscores[start][end][1][0] = max_cand
-                csplits[start][end][1][0] = argmax_cand
-
-                # right open
-                # if start == 0, restricting range_k to [0]
-                # enforces that the tree has a unique real root
-                range_k = ([0] if unique_real_root and start == 0
-                           else range(start, end))
-                # find argmax and max on range_k
-                cands = [(cscores[start][k][0][1] +
-                          cscores[k + 1][end][1][1] +
-                          (score[(start, end)]
-                           if (start, end) in score
-                           else MIN_SCORE))
-                         for k in range_k]
-                max_cand = np.nanmax(cands)
-                argmax_cand = (range_k[cands.index(max_cand)]
-                               if not np.isnan(max_cand)
-                               else range_k[0])
-                # update tables
-                cscores[start][end][0][0] = max_cand
-                csplits[start][end][0][0] = argmax_cand
-
-                # left closed
-                range_k = range(start, end)
-                # find argmax and max on range_k
-                cands = [(cscores[start][k][1][1] +
-                          cscores[k][end][1][0])
-                         for k in range_k]
-                max_cand = np.nanmax(cands)
-                argmax_cand = (range_k[cands.index(max_cand)]
-                               if not np.isnan(max_cand)
-                               else range_k[0])
-                # update tables
-                cscores[start][end][1][1] = max_cand
-                csplits[start][end][1][1] = argmax_cand
-
-                # right closed
-                range_k = range(start + 1, end + 1)
-                # find argmax and max on range_k
-                cands = [(cscores[start][k][0][0] +
-                          cscores[k][end][0][1])
-                         for k in range_k]
-                max_cand = np.nanmax(cands)
-                argmax_cand = (range_k[cands.index(max_cand)]
-                               if not np.isnan(max_cand)
-                               else range_k[0])
-                # update tables
-                cscores[start][end][0][1] = max_cand
-                csplits[start][end][0][1] = argmax_cand
-
-        # solution: C[0][n][->][1]
-        # use the backpointers in csplits to get the best tree
-        predictions = []
-        backpointers = [(0, nb_edus - 1, 0, 1)]
-        while backpointers:
-            start, end, dir_la, complete = backpointers.pop()
-            if start == end:
-                continue
-            k = csplits[start][end][dir_la][complete]
-            if complete:
-                # queue backpointers
-                if dir_la:
-                    backpointers.extend([(start, k, dir_la, 1),
-                                         (k, end, dir_la, 0)])
-                else:
-                    backpointers.extend([(start, k, dir_la, 0),
-                                         (k, end, dir_la, 1)])
-            else:
-                # add the underlying edge to the set of predictions
-                if dir_la:
-                    predictions.append((end, start, label[(end, start)]))
-                else:
-                    predictions.append((start, end, label[(start, end)]))
-                # queue backpointers
-                backpointers.extend([(start, k, 0, 1),
-                                     (k + 1, end, 1, 1)])
-
-        # resume attelo-isms
-        # transform predictions to the expected format
-        # back to EDU ids and relation labels as strings
-        att_preds = [(edu_idx2id[src], edu_idx2id[tgt], dpack.get_label(lbl))
-                     for src, tgt, lbl in predictions]
-        # and integrate predictions into the datapack
-        dpack_pred = convert_prediction(dpack, att_preds)
-
-        return dpack_pred
+        rows, score, label = _score_matrices(dpack, self._use_prob,
+                                             self._use_labels)
+        _, csplits = eisner_chart(score, self._unique_real_root)
+        edges = np.array(eisner_backtrack(csplits),
+                         dtype=np.int64).reshape(-1, 2)
+        srcs = edges[:, 0]
+        tgts = edges[:, 1]
+        return convert_prediction_idxes(dpack, rows[srcs], rows[tgts],
+                                        label[srcs, tgts])
+
+    def decode_kbest(self, dpack, k, nonfixed_pairs=None):
+        """Decode the k best trees
+
+        Parameters
+        ----------
+        dpack: DataPack
+            Datapack that describes the (sub)document to be parsed.
+
+        k: int
+            Number of trees to return
+
+        Returns
+        -------
+        dpack_preds: [DataPack]
+            Copies of the argument DataPack with predictions set,
+            from the best tree to the worst. There may be fewer
+            than `k` of them if the document has fewer possible
+            trees.
+        """
+        rows, score, label = _score_matrices(dpack, self._use_prob,
+                                             self._use_labels)
+        dpack_preds = []
+        for _, edges in eisner_kbest(score, k, self._unique_real_root):
+            edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+            srcs = edges[:, 0]
+            tgts = edges[:, 1]
+            dpack_preds.append(
+                convert_prediction_idxes(dpack, rows[srcs], rows[tgts],
+                                         label[srcs, tgts]))
+        return dpack_preds
@@ -9,13 +9,12 @@ July 2012
 '''
 
 from __future__ import print_function
-import sys
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import heapq
 
 from .interface import Decoder
-from .util import (convert_prediction,
-                   get_sorted_edus,
-                   get_prob_map,
-                   simple_candidates)
+from .util import convert_prediction_pairings
 
 # pylint: disable=too-few-public-methods
 
@@ -56,41 +55,121 @@ def is_embedded(one, two):
 
 def get_neighbours(edus):
     '''
-    Return a mapping from each EDU to its neighbours
+    Return a mapping from each EDU to its neighbours, ie. the EDUs that
+    are strictly adjacent to it (see `are_strictly_adjacent`) or that
+    embed or are embedded in it. Neighbours are listed in the same
+    order as the input.
+
+    We only look at the pairs of EDUs that could be neighbours, found
+    by bisection on sorted span boundaries: an EDU is strictly adjacent
+    to an EDU to its right only if that EDU owns the first boundary
+    after it; otherwise they must overlap or touch.
 
     :type edus: [Edu]
     :rtype: Dict Edu [Edu]
     '''
+    edus = list(edus)
+    # span boundaries, sorted by position
+    bounds = sorted((pos, i) for i, edu in enumerate(edus)
+                    for pos in (edu.start, edu.end))
+    positions = [pos for pos, _ in bounds]
+    by_start = sorted((edu.start, i) for i, edu in enumerate(edus))
+    starts = [pos for pos, _ in by_start]
+    same_id = defaultdict(list)
+    for i, edu in enumerate(edus):
+        same_id[edu.id].append(i)
+
+    def is_clean(low, high, one, two):
+        """no boundary between low and high (inclusive) belongs
+        to an EDU other than one and two"""
+        if low > high:
+            return True
+        total = bisect_right(positions, high) - bisect_left(positions, low)
+        own = sum(1 for i in same_id[one.id] + same_id[two.id]
+                  for pos in (edus[i].start, edus[i].end)
+                  if low <= pos <= high)
+        return total == own
+
+    def are_neighbours(one, two):
+        "see `are_strictly_adjacent` and `is_embedded`"
+        return one.id != two.id and (
+            is_embedded(one, two) or is_embedded(two, one) or
+            (is_clean(one.end, two.start, one, two) and
+             is_clean(two.end, one.start, one, two)))
+
+    found = defaultdict(set)
+    for i, one in enumerate(edus):
+        cands = set()
+        # overlapping, touching or embedded EDUs starting within this one
+        lo_idx = bisect_left(starts, one.start)
+        hi_idx = bisect_right(starts, one.end)
+        cands.update(j for _, j in by_start[lo_idx:hi_idx])
+        # owner of the first boundary after this EDU
+        idx = bisect_left(positions, one.end)
+        while idx < len(bounds) and edus[bounds[idx][1]].id == one.id:
+            idx += 1
+        if idx < len(bounds):
+            cands.add(bounds[idx][1])
+        for j in cands:
+            if are_neighbours(one, edus[j]):
+                found[i].add(j)
+                found[j].add(i)
 
     neighbours = dict()
-    for one in edus:
-        one_neighbours = []
-        one_neighbours_ids = set()
-        for two in edus:
-            if one.id != two.id:
-                if are_strictly_adjacent(one, two, edus):
-                    if two.id not in one_neighbours_ids:
-                        one_neighbours_ids.add(two.id)
-                        one_neighbours.append(two)
-                if is_embedded(one, two) or is_embedded(two, one):
-                    if two.id not in one_neighbours_ids:
-                        one_neighbours_ids.add(two.id)
-                        one_neighbours.append(two)
-
-        neighbours[one] = one_neighbours
-
+    for i, one in enumerate(edus):
+        neighbours[one] = [edus[j] for j in sorted(found[i])]
     return neighbours
 
 
 class LocallyGreedyState(object):
     '''
     the mutable parts of the locally greedy algorithm
+
+    Candidate links are kept in a priority queue, best first (ties are
+    broken by position of the source EDU, then of the target in its
+    neighbourhood). Links from EDUs that have already been attached
+    are not removed from the queue, just skipped when they come up.
+
+    :type cands: Candidates
     '''
-    def __init__(self, instances):
-        self._edus = get_sorted_edus(instances)
-        self._edu_ids = set(x.id for x in self._edus)
-        self._neighbours = get_neighbours(self._edus)
-        self._prob_dist = get_prob_map(instances)
+    def __init__(self, cands):
+        self._cands = cands
+        self._rows = cands.sorted_edus()
+        self._edus = [cands.edus[i] for i in self._rows]
+        self._alive = [True] * len(self._edus)
+        self._num_alive = len(self._edus)
+        edu_idx = {edu: i for i, edu in enumerate(self._edus)}
+        neighbours = get_neighbours(self._edus)
+        self._neighbours = [[edu_idx[x] for x in neighbours[edu]]
+                            for edu in self._edus]
+        self._seen = [set(x) for x in self._neighbours]
+        self._queue = []
+        self._queue_links([(source, rank, target)
+                           for source in range(len(self._edus))
+                           for rank, target
+                           in enumerate(self._neighbours[source])])
+        heapq.heapify(self._queue)
+
+    def _queue_links(self, links, push=False):
+        '''
+        Add candidate (source, rank, target) links to the queue (those
+        that the model gives a positive probability)
+        '''
+        if not links:
+            return
+        sources, _, targets = zip(*links)
+        pairings = self._cands.lookup(self._rows[list(sources)],
+                                      self._rows[list(targets)])
+        for (source, rank, target), pairing in zip(links, pairings):
+            if pairing < 0:
+                continue
+            prob = self._cands.attach[pairing]
+            if prob > 0:
+                entry = (-prob, source, rank, target, pairing)
+                if push:
+                    heapq.heappush(self._queue, entry)
+                else:
+                    self._queue.append(entry)
 
     def _remove_edu(self, original, target):
         '''
@@ -98,14 +177,19 @@ class LocallyGreedyState(object):
         (that the original in meant to point to): remove the original
         edu and merge its neighbourhood into that of the target
         '''
-        self._edus.remove(original)
-        self._edu_ids.remove(original.id)
+        self._alive[original] = False
+        self._num_alive -= 1
         # PM : added to propagate locality to percolated span heads
         tgt_neighbours = self._neighbours[target]
-        tgt_neighbours.extend(self._neighbours[original])
-        # print(neighbours[new_span], file=sys.stderr)
-        tgt_neighbours = [x for x in tgt_neighbours
-                          if x.id in self._edu_ids and x.id != target.id]
+        tgt_seen = self._seen[target]
+        links = []
+        for other in self._neighbours[original]:
+            if other not in tgt_seen:
+                tgt_seen.add(other)
+                tgt_neighbours.append(other)
+                links.append((target, len(tgt_neighbours) - 1, other))
+        if self._alive[target]:
+            self._queue_links(links, push=True)
 
     def _attach_best(self):
         '''
@@ -113,48 +197,28 @@ class LocallyGreedyState(object):
         highest probability link between any two neighbours.
         Remove the source EDU from future consideration.
 
-        :rtype: None
+        :rtype: int or None (pairing of the link)
         '''
-        highest = 0.0
-        to_remove = None
-        attachment = None
-        new_span = None
-
-        for source in self._edus:
-            for target in self._neighbours[source]:
-                if (source.id, target.id) in self._prob_dist:
-                    label, prob = self._prob_dist[(source.id, target.id)]
-                    if prob > highest:
-                        highest = prob
-                        to_remove = source
-                        new_span = target
-                        attachment = (source.id, target.id, label)
-
-        if to_remove is not None:
-            self._remove_edu(to_remove, new_span)
-            return attachment
-        else:  # stop if nothing to attach, but this is wrong
-            # print("warning: no attachment found", file=sys.stderr)
-            # print(edus)
-            # print(edus_id)
-            # print([neighbours[x] for x in edus])
-            # sys.exit(0)
-            self._edus = []
-            return None
+        while self._queue:
+            _, source, _, target, pairing = heapq.heappop(self._queue)
+            if self._alive[source]:
+                self._remove_edu(source, target)
+                return pairing
+        # stop if nothing to attach, but this is wrong
+        self._num_alive = 0
+        return None
 
     def decode(self):
         '''
         Run the decoder
 
-        :rtype [(EDU, EDU, string)]
+        :rtype [int] (pairings of the links to attach)
         '''
         attachments = []
-        while len(self._edus) > 1:
-            print(len(self._edus), end=' ', file=sys.stderr)
+        while self._num_alive > 1:
             attach = self._attach_best()
             if attach is not None:
                 attachments.append(attach)
-        print("", file=sys.stderr)
         return attachments
 
 
@@ -164,7 +228,6 @@ class LocallyGreedy(Decoder):
     The locally greedy decoder
     '''
     def decode(self, dpack):
-        cands = simple_candidates(dpack)
-        prediction = LocallyGreedyState(cands).decode()
-        return convert_prediction(dpack, prediction)
+        prediction = LocallyGreedyState(dpack.candidates).decode()
+        return convert_prediction_pairings(dpack, prediction)
 # pylint: enable=unused-argument
@@ -48,9 +48,28 @@ class Decoder(with_metaclass(ABCMeta, Parser)):
         '''
         raise NotImplementedError
 
+    def decode_batch(self, dpacks, nonfixed_pairs=None):
+        '''
+        Decode a sequence of (weighted) datapacks, returning the best
+        prediction for each.
+
+        By default this decodes one datapack at a time; decoders which
+        can share work across documents may override it. If set,
+        `nonfixed_pairs` has one entry per datapack, which is passed
+        on to `decode`.
+        '''
+        if nonfixed_pairs is None:
+            return [self.decode(dpack) for dpack in dpacks]
+        return [self.decode(dpack, nonfixed_pairs=nf_pairs)
+                for dpack, nf_pairs in zip(dpacks, nonfixed_pairs)]
+
     def fit(self, dpacks, targets, nonfixed_pairs=None, cache=None):
         return
 
     def transform(self, dpack, nonfixed_pairs=None):
         dpack = self.multiply(dpack) # default weights if not set
         return self.decode(dpack, nonfixed_pairs=nonfixed_pairs)
+
+    def transform_batch(self, dpacks, nonfixed_pairs=None):
+        dpacks = [self.multiply(dpack) for dpack in dpacks]
+        return self.decode_batch(dpacks, nonfixed_pairs=nonfixed_pairs)
@@ -2,9 +2,10 @@
 Local decoders make decisions for each edge independently.
 """
 
+import numpy as np
+
 from .interface import Decoder
-from .util import (convert_prediction,
-                   simple_candidates)
+from .util import (convert_prediction_pairings)
 
 
 class AsManyDecoder(Decoder):
@@ -18,15 +19,22 @@ class AsManyDecoder(Decoder):
     def decode(self, dpack):
         """Return the set of top N edges
         """
-        cands = simple_candidates(dpack)
+        scores = dpack.candidates.attach
         # number of real EDUs
         nb_edus = len(dpack.edus)
+        if nb_edus < len(scores):
+            # take the top N candidates, where N is the number of real
+            # EDUs ; ties are broken in favour of the earliest pairings
+            top = np.argpartition(-scores, nb_edus - 1)[:nb_edus]
+            threshold = scores[top].min()
+            above = np.where(scores > threshold)[0]
+            tied = np.where(scores == threshold)[0]
+            top = np.concatenate([above, tied[:nb_edus - len(above)]])
+        else:
+            top = np.arange(len(scores))
         # sort candidates by their scores (in reverse order)
-        sorted_cands = sorted(cands, key=lambda c: c[2], reverse=True)
-        # take the top N candidates, where N is the number of real EDUs
-        predicted = [(src.id, tgt.id, lbl)
-                     for src, tgt, _, lbl in sorted_cands[:nb_edus]]
-        return convert_prediction(dpack, predicted)
+        top = top[np.lexsort((top, -scores[top]))]
+        return convert_prediction_pairings(dpack, top)
 
 
 class BestIncomingDecoder(Decoder):
@@ -41,17 +49,9 @@ class BestIncomingDecoder(Decoder):
     def decode(self, dpack):
         """Return the best incoming edge for each EDU
         """
-        # best incoming edge for each EDU
-        inc_edges = {}
-        for cand in simple_candidates(dpack):
-            src, tgt, score, lbl = cand
-            if tgt.id in inc_edges:
-                cur_best = inc_edges[tgt.id][2]
-                if score > cur_best:
-                    inc_edges[tgt.id] = cand
-            else:
-                inc_edges[tgt.id] = cand
-
-        predicted = [(src.id, tgt.id, lbl)
-                     for src, tgt, score, lbl in inc_edges.values()]
-        return convert_prediction(dpack, predicted)
+        scores = dpack.candidates.attach
+        targets = dpack.candidates.tgt
+        # group by target, best (then earliest) pairing first
+        order = np.lexsort((np.arange(len(scores)), -scores, targets))
+        _, firsts = np.unique(targets[order], return_index=True)
+        return convert_prediction_pairings(dpack, order[firsts])
@@ -5,24 +5,249 @@ Created on Jun 27, 2012
 '''
 
 from __future__ import print_function
-from collections import defaultdict
+from collections import deque
 
-from depparse.graph import Digraph
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import breadth_first_order
 # pylint: disable=no-name-in-module
 from scipy.special import logit
 # pylint: enable=no-name-in-module
 
 from ..edu import FAKE_ROOT_ID
+from ..table import UNRELATED
 from ..util import ArgparserEnum
 from .interface import Decoder
 from .util import (DecoderException,
-                   cap_score,
-                   convert_prediction,
-                   simple_candidates)
+                   convert_prediction_idxes,
+                   MAX_SCORE,
+                   MIN_SCORE)
 
 # pylint: disable=too-few-public-methods
 
 
+class _LeftistHeaps(object):
+    '''
+    Mergeable max-heaps of edges (leftist trees), with a lazy offset
+    that can be added to all the keys of a heap at once.
+
+    Nodes are edge numbers; a heap is represented by its top node
+    (-1 for the empty heap).
+    '''
+    def __init__(self, keys):
+        self.key = list(keys)
+        self.left = [-1] * len(self.key)
+        self.right = [-1] * len(self.key)
+        self.rank = [1] * len(self.key)
+        self.delta = [0.] * len(self.key)
+
+    def chain(self, nodes):
+        '''
+        Heap made of nodes whose keys are in decreasing order
+        (built in linear time)
+        '''
+        for node, child in zip(nodes, nodes[1:]):
+            self.left[node] = child
+        return nodes[0] if nodes else -1
+
+    def _prop(self, node):
+        'push the lazy offset of a node down to its children'
+        delta = self.delta[node]
+        if delta:
+            self.key[node] += delta
+            if self.left[node] >= 0:
+                self.delta[self.left[node]] += delta
+            if self.right[node] >= 0:
+                self.delta[self.right[node]] += delta
+            self.delta[node] = 0.
+
+    def top(self, heap):
+        '''
+        Top node and key of a (non-empty) heap
+        '''
+        self._prop(heap)
+        return heap, self.key[heap]
+
+    def add(self, heap, delta):
+        '''
+        Add a value to all the keys of a heap
+        '''
+        self.delta[heap] += delta
+
+    def merge(self, heap1, heap2):
+        '''
+        Merge two heaps (the recursion only follows right spines,
+        so its depth is logarithmic)
+        '''
+        if heap1 < 0:
+            return heap2
+        if heap2 < 0:
+            return heap1
+        self._prop(heap1)
+        self._prop(heap2)
+        if self.key[heap1] < self.key[heap2]:
+            heap1, heap2 = heap2, heap1
+        left = self.left[heap1]
+        right = self.merge(self.right[heap1], heap2)
+        rank_left = self.rank[left] if left >= 0 else 0
+        if rank_left < self.rank[right]:
+            left, right = right, left
+        self.left[heap1] = left
+        self.right[heap1] = right
+        self.rank[heap1] = (self.rank[right] if right >= 0 else 0) + 1
+        return heap1
+
+    def pop(self, heap):
+        '''
+        Heap without its top node
+        '''
+        self._prop(heap)
+        return self.merge(self.left[heap], self.right[heap])
+
+
+class _RollbackUnionFind(object):
+    '''
+    Union-find structure (union by size without path compression)
+    whose unions can be undone
+    '''
+    def __init__(self, size):
+        self._parent = list(range(size))
+        self._size = [1] * size
+        self._history = []
+
+    def find(self, node):
+        'representative of the set containing a node'
+        parent = self._parent
+        while parent[node] != node:
+            node = parent[node]
+        return node
+
+    def time(self):
+        'number of unions so far'
+        return len(self._history)
+
+    def join(self, node1, node2):
+        '''
+        Merge the sets of two nodes; return False if they were
+        already in the same set
+        '''
+        node1 = self.find(node1)
+        node2 = self.find(node2)
+        if node1 == node2:
+            return False
+        if self._size[node1] < self._size[node2]:
+            node1, node2 = node2, node1
+        self._parent[node2] = node1
+        self._size[node1] += self._size[node2]
+        self._history.append(node2)
+        return True
+
+    def rollback(self, time):
+        'undo the unions made after the given time'
+        while len(self._history) > time:
+            node = self._history.pop()
+            self._size[self._parent[node]] -= self._size[node]
+            self._parent[node] = node
+
+
+def max_spanning_tree(score, root):
+    '''
+    Maximum spanning arborescence of a directed graph, with the
+    Chu-Liu-Edmonds algorithm as implemented by Tarjan (1977), in
+    O(m log n) for m edges and n nodes.
+
+    Nodes which cannot be reached from the root are left out of the
+    tree.
+
+    Parameters
+    ----------
+    score: array(float) of shape (n, n)
+        Score of the edge from node `i` to node `j`, or NaN if there
+        is no such edge. Edges to the root are ignored.
+
+    root: int
+        Root node
+
+    Returns
+    -------
+    heads: array(int) of shape (n,)
+        Parent of each node in the tree (-1 for the root and the
+        nodes left out)
+    '''
+    nb_nodes = len(score)
+    heads = np.empty(nb_nodes, dtype=np.int64)
+    heads.fill(-1)
+    present = ~np.isnan(score)
+    present[:, root] = False
+    np.fill_diagonal(present, False)
+    reached = np.zeros(nb_nodes, dtype=bool)
+    reached[breadth_first_order(scipy.sparse.csr_matrix(present), root,
+                                return_predecessors=False)] = True
+    srcs, tgts = np.nonzero(present & reached[:, np.newaxis])
+    weights = score[srcs, tgts]
+
+    # one heap of incoming edges per node, built from the edges
+    # sorted by decreasing weight
+    heaps = _LeftistHeaps(weights.tolist())
+    order = np.lexsort((-weights, tgts))
+    bounds = np.searchsorted(tgts[order], np.arange(nb_nodes + 1))
+    order = order.tolist()
+    heap = [heaps.chain(order[bounds[i]:bounds[i + 1]])
+            for i in range(nb_nodes)]
+    srcs = srcs.tolist()
+    tgts = tgts.tolist()
+
+    ufind = _RollbackUnionFind(nb_nodes)
+    # unreached nodes are never visited
+    seen = [-1 if r else nb_nodes for r in reached.tolist()]
+    seen[root] = root
+    incoming = [-1] * nb_nodes
+    cycles = deque()
+    for start in range(nb_nodes):
+        node = start
+        path = []
+        queue = []
+        while seen[node] < 0:
+            # best incoming edge, relative to the others
+            edge, weight = heaps.top(heap[node])
+            heaps.add(heap[node], -weight)
+            heap[node] = heaps.pop(heap[node])
+            queue.append(edge)
+            path.append(node)
+            seen[node] = start
+            node = ufind.find(srcs[edge])
+            if seen[node] == start:
+                # contract the cycle into a single node
+                cycle = -1
+                end = len(queue)
+                time = ufind.time()
+                while True:
+                    other = path.pop()
+                    cycle = heaps.merge(cycle, heap[other])
+                    if not ufind.join(node, other):
+                        break
+                node = ufind.find(node)
+                heap[node] = cycle
+                seen[node] = -1
+                cycles.appendleft((node, time, queue[len(path):end]))
+                del queue[len(path):]
+        for edge in queue:
+            incoming[ufind.find(tgts[edge])] = edge
+
+    # expand the contracted cycles, last one first
+    for node, time, cycle in cycles:
+        ufind.rollback(time)
+        in_edge = incoming[node]
+        for edge in cycle:
+            incoming[ufind.find(tgts[edge])] = edge
+        incoming[ufind.find(tgts[in_edge])] = in_edge
+
+    for node, edge in enumerate(incoming):
+        if edge >= 0 and node != root:
+            heads[node] = srcs[edge]
+    return heads
+
+
 def _leftmost_edu(edus):
     """ Returns the default root node for MST/MSDAG algorithm
 
@@ -31,37 +256,55 @@ def _leftmost_edu(edus):
         The Chu-Liu-Edmonds algorithm used for MST/MSDAG requires a
         root node (with no incoming edges). We ensure there is one.
     """
-    return sorted(edus, key=lambda e: e.span)[0]
-
+    return sorted(edus, key=lambda e: e.span()[0])[0]
 
-def _msdag(graph):
-    """ Returns a subgraph of graph (a Digraph) corresponding to its
-        Maximum Spanning Directed Acyclic Graph
 
-        Algorithm is semi-greedy-MSDAG as described in Schluter_:
+def max_spanning_dag(score, root):
+    """ Maximum spanning directed acyclic graph, with the
+        semi-greedy-MSDAG algorithm described in Schluter_:
         .. _Schluter (2014): http://aclweb.org/anthology/W14-2412
-    """
-    tree = graph.mst()
-    # Sort edges in orginal graph by decreasing score
-    edges = sorted(graph.iteredges(), key=lambda p: -graph.get_score(*p))
-
-    for src, tgt in edges:
-        # Already in graph ?
-        if tgt in tree.successors[src]:
-            continue
-        # Add the edge, revert if cycle is created
-        tree.successors[src].append(tgt)
-        if tree.find_cycle():
-            tree.successors[src].remove(tgt)
-
-    # Update score and label functions
-    new_map = lambda f: dict(((s, t), f(s, t)) for s, t in tree.iteredges())
-    nscores = new_map(graph.get_score)
-    nlabels = new_map(graph.get_label)
 
-    return Digraph(tree.successors,
-                   lambda s, t: nscores[s, t],
-                   lambda s, t: nlabels[s, t])
+        Starting from the maximum spanning tree, the other edges are
+        added by decreasing score unless they would create a cycle.
+        We keep the transitive closure of the graph up to date as
+        edges are added, so that each edge is checked with a single
+        lookup.
+
+        :param score: (n, n) array of edge scores, as for
+                      `max_spanning_tree`
+        :param root: root node
+        :rtype (array(int), array(int)): sources and targets of the
+               edges in the graph
+    """
+    nb_nodes = len(score)
+    present = ~np.isnan(score)
+    present[:, root] = False
+    np.fill_diagonal(present, False)
+    chosen = np.zeros((nb_nodes, nb_nodes), dtype=bool)
+    # reach[x, y]: there is a (non-empty) path from x to y
+    reach = np.zeros((nb_nodes, nb_nodes), dtype=bool)
+
+    def add_edge(src, tgt):
+        "add an edge that does not close a cycle"
+        chosen[src, tgt] = True
+        if not reach[src, tgt]:
+            ancestors = reach[:, src].copy()
+            ancestors[src] = True
+            descendants = reach[tgt].copy()
+            descendants[tgt] = True
+            reach[ancestors] |= descendants
+
+    heads = max_spanning_tree(score, root)
+    for tgt in np.where(heads >= 0)[0].tolist():
+        add_edge(heads[tgt], tgt)
+
+    srcs, tgts = np.nonzero(present & ~chosen)
+    # stable sort, so that ties are broken in a predictable way
+    order = np.argsort(-score[srcs, tgts], kind='mergesort')
+    for src, tgt in zip(srcs[order].tolist(), tgts[order].tolist()):
+        if not reach[tgt, src]:
+            add_edge(src, tgt)
+    return np.nonzero(chosen)
 
 
 class MstRootStrategy(ArgparserEnum):
@@ -80,53 +323,58 @@ class MstDecoder(Decoder):
         self._use_prob = use_prob
         self._root_strategy = root_strategy
 
-    def _graph(self, instances):
-        """ Builds a directed graph for instances
-
-            instances are quadruplets of the form:
-                edu_source, edu_target, probability_of_attachment, relation
+    def _root(self, dpack):
+        """ Identifier of the root node
 
-            :rtype Digraph
+            (with the fake root strategy, falls back to the leftmost
+            EDU if the datapack has no fake root)
         """
-
-        if self._root_strategy == MstRootStrategy.leftmost:
-            root_id = _leftmost_edu(set(e for s, t, _, _ in instances
-                                        for e in (s, t))).id
+        table = dpack.edu_table
+        if (self._root_strategy == MstRootStrategy.leftmost or
+                (self._root_strategy == MstRootStrategy.fake_root and
+                 FAKE_ROOT_ID not in table.index)):
+            # the root is chosen among the EDUs in the pairings
+            in_pairings = np.unique(dpack.pairing_idxes)
+            return _leftmost_edu(table.edus[i] for i in in_pairings).id
         elif self._root_strategy == MstRootStrategy.fake_root:
-            root_id = FAKE_ROOT_ID
+            return FAKE_ROOT_ID
         else:
             raise DecoderException('Unknown root finding strategy: ' +
                                    str(self._root_strategy))
 
-        targets = defaultdict(list)
-        labels = dict()
-        scores = dict()
-
-        for source, target, prob, rel in instances:
-            src, tgt = source.id, target.id
-
-            # Ignore all edges directed to the root
-            if tgt == root_id:
-                continue
+    def _score_matrix(self, dpack):
+        """ Dense attachment scores and best labels for a datapack,
+            indexed by rows of its EDU table
 
-            if self._use_prob:
-                scores[src, tgt] = cap_score(logit(prob))
-            else:
-                scores[src, tgt] = prob
-            labels[src, tgt] = rel
-            targets[src].append(tgt)
-
-        return Digraph(targets,
-                       lambda s, t: scores[s, t],
-                       lambda s, t: labels[s, t])
+            :rtype (array(float), array(int)); missing edges have
+            a NaN score
+        """
+        cands = dpack.candidates
+        nb_edus = len(cands.edus)
+        srcs = cands.src
+        tgts = cands.tgt
+        attach = cands.attach.astype(np.float64)
+        if self._use_prob:
+            with np.errstate(divide='ignore'):
+                attach = np.clip(logit(attach), MIN_SCORE, MAX_SCORE)
+        attach[np.isnan(attach)] = MIN_SCORE
+        score = np.empty((nb_edus, nb_edus), dtype=np.float64)
+        score.fill(np.nan)
+        score[srcs, tgts] = attach
+        label = np.empty((nb_edus, nb_edus), dtype=np.int64)
+        label.fill(dpack.label_number(UNRELATED))
+        label[srcs, tgts] = cands.label
+        return score, label
 
     def decode(self, dpack, nonfixed_pairs=None):
         # TODO integrate nonfixed_pairs, maybe?
-        graph = self._graph(simple_candidates(dpack))
-        subgraph = graph.mst()
-        predictions = [(src, tgt, subgraph.get_label(src, tgt))
-                       for src, tgt in subgraph.iteredges()]
-        return convert_prediction(dpack, predictions)
+        root = dpack.edu_table.index[self._root(dpack)]
+        score, label = self._score_matrix(dpack)
+        heads = max_spanning_tree(score, root)
+        tgts = np.where(heads >= 0)[0]
+        srcs = heads[tgts]
+        return convert_prediction_idxes(dpack, srcs, tgts,
+                                        label[srcs, tgts])
 
 
 class MsdagDecoder(MstDecoder):
@@ -134,8 +382,8 @@ class MsdagDecoder(MstDecoder):
 
     def decode(self, dpack, nonfixed_pairs=None):
         # TODO integrate nonfixed_pairs, maybe?
-        graph = self._graph(simple_candidates(dpack))
-        subgraph = _msdag(graph)
-        predictions = [(src, tgt, subgraph.get_label(src, tgt))
-                       for src, tgt in subgraph.iteredges()]
-        return convert_prediction(dpack, predictions)
+        root = dpack.edu_table.index[self._root(dpack)]
+        score, label = self._score_matrix(dpack)
+        srcs, tgts = max_spanning_dag(score, root)
+        return convert_prediction_idxes(dpack, srcs, tgts,
+                                        label[srcs, tgts])
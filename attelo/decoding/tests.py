@@ -10,10 +10,17 @@ from scipy.sparse import csr_matrix
 
 from ..table import (DataPack, Graph)
 from ..edu import EDU
+from ..parser.full import AttachTimesBestLabel
 from . import astar, greedy, mst
+from .baseline import LocalBaseline
+from .local import (AsManyDecoder, BestIncomingDecoder)
 from .astar import (AstarArgs, Heuristic, RfcConstraint)
-from .eisner import EisnerDecoder
-from .util import (prediction_to_triples, simple_candidates)
+from .eisner import (EisnerDecoder, eisner_backtrack, eisner_chart,
+                     eisner_kbest)
+from .util import (convert_prediction,
+                   prediction_to_triples,
+                   simple_candidates,
+                   MIN_SCORE)
 
 # pylint: disable=too-few-public-methods
 
@@ -80,23 +87,50 @@ class DecoderTest(unittest.TestCase):
                      vocab=None)
 
 
+class UtilTest(DecoderTest):
+    """ Tests for the decoding utilities """
+
+    def test_convert_prediction(self):
+        'triples to prediction array and back'
+        triples = [('x0', 'x1', 'elaboration'),
+                   ('x1', 'x3', 'narration'),
+                   ('x0', 'x3', 'narration'),
+                   ('x0', 'x3', 'elaboration'),  # last one wins
+                   ('x3', 'x0', 'narration')]  # not a pairing
+        dpack = convert_prediction(self.dpack, triples)
+        self.assertEqual([2, 1, 1, 2, 3, 1],
+                         list(dpack.graph.prediction))
+        self.assertEqual([('x0', 'x1', 'elaboration'),
+                          ('x0', 'x3', 'elaboration'),
+                          ('x1', 'x3', 'narration')],
+                         prediction_to_triples(dpack))
+
+
 class AstarTest(DecoderTest):
     '''tests for the A* decoder'''
+    def _search_config(self, tolink):
+        '''
+        Shared configuration for an A* search over our datapack
+        '''
+        cands = simple_candidates(self.dpack)
+        prob = {(a1.id, a2.id): (l, p) for a1, a2, p, l in cands}
+        pre_heurist = astar.preprocess_heuristics(self.dpack.candidates,
+                                                  [x.id for x in tolink])
+        return {"probs": prob,
+                "heuristics": pre_heurist,
+                "use_prob": True,
+                "RFC": astar.RfcConstraint.full}
+
     def _test_heuristic(self, heuristic):
         '''
         Run an A* search with the given heuristic
         '''
-        cands = simple_candidates(self.dpack)
-        prob = {(a1, a2): (l, p) for a1, a2, p, l in cands}
-        pre_heurist = astar.preprocess_heuristics(cands)
-        config = {"probs": prob,
-                  "heuristics": pre_heurist,
-                  "use_prob": True,
-                  "RFC": astar.RfcConstraint.full}
+        config = self._search_config(self.edus[2:])
         search = astar.DiscourseSearch(heuristic=heuristic,
                                        shared=config)
-        genall = search.launch(astar.DiscData(accessible=[self.edus[1]],
-                                              tolink=self.edus[2:]),
+        genall = search.launch(astar.DiscData(accessible=[self.edus[1].id],
+                                              tolink=[x.id for x in
+                                                      self.edus[2:]]),
                                norepeat=True,
                                verbose=True)
         endstate = genall.next()
@@ -105,6 +139,35 @@ class AstarTest(DecoderTest):
         # print "cost:", endstate.cost()
         # print search.iterations
 
+    def test_admissible(self):
+        'heuristics never overestimate the cost of finishing a parse'
+        config = self._search_config(self.edus[1:])
+
+        def best_cost(data):
+            'cost of the cheapest solution reachable from this data'
+            if data.final():
+                return 0.
+            state = astar.DiscourseState(data, astar.DiscourseState.h_zero,
+                                         config)
+            return min([cost + best_cost(new)
+                        for new, cost in state.next_states()] +
+                       [float('inf')])
+
+        def check(data, heuristic):
+            'check the heuristic on this data and its successors'
+            state = astar.DiscourseState(data, heuristic, config)
+            self.assertTrue(state.future_cost() <= best_cost(data) + 1e-9)
+            if not data.final():
+                for new, _ in state.next_states():
+                    check(new, heuristic)
+
+        root = astar.DiscData(accessible=[self.edus[0].id],
+                              tolink=[x.id for x in self.edus[1:]])
+        for heuristic in [astar.Heuristic.zero,
+                          astar.Heuristic.max,
+                          astar.Heuristic.best]:
+            check(root, astar.HEURISTICS[heuristic])
+
     def test_search(self):
         'n-best A* search'
         astar_args = astar.AstarArgs(heuristics=DEFAULT_ASTAR_ARGS.heuristics,
@@ -115,6 +178,96 @@ class AstarTest(DecoderTest):
         decoder = astar.AstarDecoder(astar_args)
         return decoder.decode(self.dpack)
 
+    def test_right_frontier(self):
+        'successor states share their right frontier'
+        data = astar.DiscData(accessible=['a'], tolink=['b', 'c', 'd'])
+        data_b = data.link('a', 'elaboration', rfc=astar.RfcConstraint.full)
+        data_c = data_b.link('b', 'narration', rfc=astar.RfcConstraint.full)
+        data_d = data_b.link('a', 'elaboration',
+                             rfc=astar.RfcConstraint.simple)
+        self.assertEqual(['a'], data.accessible())
+        self.assertEqual(['a', 'b'], data_b.accessible())
+        self.assertEqual(('c', 'd'), data_b.tobedone())
+        # coordinating relations take the place of their attachment point
+        self.assertEqual(['a', 'c'], data_c.accessible())
+        self.assertEqual(['a', 'c'], data_d.accessible())
+        self.assertEqual(('b', 'c', 'narration'), data_c.last_link())
+        self.assertTrue(data_c.parent is data_b)
+
+    def test_full_right_frontier(self):
+        'the full right frontier after coordinating and subordinating links'
+        full = astar.RfcConstraint.full
+        data = astar.DiscData(accessible=['a'], tolink=['b', 'c', 'd'])
+        data_b = data.link('a', 'elaboration', rfc=full)
+        # subordinating: the new EDU goes on top of its attachment point
+        self.assertEqual(['a', 'b', 'c'],
+                         data_b.link('b', 'elaboration', rfc=full)
+                         .accessible())
+        self.assertEqual(['a', 'c'],
+                         data_b.link('a', 'elaboration', rfc=full)
+                         .accessible())
+        # coordinating: the new EDU replaces its attachment point
+        self.assertEqual(['a', 'c'],
+                         data_b.link('b', 'narration', rfc=full)
+                         .accessible())
+        self.assertEqual(['c'],
+                         data_b.link('a', 'continuation', rfc=full)
+                         .accessible())
+        # and the next link sees the updated frontier
+        data_c = data_b.link('a', 'narration', rfc=full)
+        self.assertEqual(['c', 'd'],
+                         data_c.link('c', 'elaboration', rfc=full)
+                         .accessible())
+
+    def test_budget(self):
+        'decoding on a budget gives a tree, but maybe not the best one'
+        astar_args = astar.AstarArgs(heuristics=astar.Heuristic.best,
+                                     rfc=astar.RfcConstraint.simple,
+                                     beam=None,
+                                     use_prob=True)
+        decoder = astar.AstarDecoder(astar_args)
+        best, stats = decoder.decode_with_stats(self.dpack)
+        self.assertTrue(stats.optimal)
+        decoder = astar.AstarDecoder(astar_args._replace(max_expansions=1))
+        dpack, stats = decoder.decode_with_stats(self.dpack)
+        self.assertFalse(stats.optimal)
+        self.assertEqual(1, stats.expanded)
+        self.assertEqual(len(self.edus) - 1,
+                         len(prediction_to_triples(dpack)))
+        decoder = astar.AstarDecoder(astar_args._replace(deadline_ms=0))
+        dpack, stats = decoder.decode_with_stats(self.dpack)
+        self.assertFalse(stats.optimal)
+        self.assertEqual(len(self.edus) - 1,
+                         len(prediction_to_triples(dpack)))
+
+    def test_nbest(self):
+        'n-best decoding gives distinct parses, best first'
+        astar_args = astar.AstarArgs(heuristics=astar.Heuristic.best,
+                                     rfc=astar.RfcConstraint.simple,
+                                     beam=None,
+                                     use_prob=True)
+        decoder = astar.AstarDecoder(astar_args)
+        nbest = decoder.decode_nbest(self.dpack, 3)
+        self.assertEqual(3, len(nbest))
+        self.assertEqual(prediction_to_triples(decoder.decode(self.dpack)),
+                         prediction_to_triples(nbest[0]))
+        unrelated = self.dpack.label_number('UNRELATED')
+        costs = [-np.log(self.graph.attach[x.graph.prediction != unrelated])
+                 .sum() for x in nbest]
+        self.assertEqual(sorted(costs), costs)
+        self.assertEqual(3, len(set(tuple(x.graph.prediction)
+                                    for x in nbest)))
+
+    def test_beam(self):
+        'beam search finds a tree'
+        astar_args = astar.AstarArgs(heuristics=DEFAULT_ASTAR_ARGS.heuristics,
+                                     rfc=astar.RfcConstraint.simple,
+                                     beam=2,
+                                     use_prob=DEFAULT_ASTAR_ARGS.use_prob)
+        decoder = astar.AstarDecoder(astar_args)
+        edges = prediction_to_triples(decoder.decode(self.dpack))
+        self.assertEqual(len(self.edus) - 1, len(edges))
+
     # FAILS: it's something to do with the initial state not having
     # any to do links..., would need to check with PM about this
     # def test_h_average(self):
@@ -129,6 +282,78 @@ class LocallyGreedyTest(DecoderTest):
         decoder = greedy.LocallyGreedy()
         decoder.decode(self.dpack)
 
+    def test_neighbours(self):
+        'adjacent and embedded EDUs are neighbours'
+        edus = [mk_fake_edu(0, 10),  # embeds the next two
+                mk_fake_edu(2, 4),
+                mk_fake_edu(5, 6),
+                mk_fake_edu(12, 14),
+                mk_fake_edu(20, 22)]
+        neighbours = greedy.get_neighbours(edus)
+        self.assertEqual([edus[1], edus[2], edus[3]], neighbours[edus[0]])
+        self.assertEqual([edus[0], edus[2]], neighbours[edus[1]])
+        self.assertEqual([edus[0], edus[4]], neighbours[edus[3]])
+
+
+class LocalTest(DecoderTest):
+    """ Tests for the local decoders (and the local baseline)"""
+
+    def _with_attach(self, attach):
+        'our datapack with the given attachment scores'
+        graph = self.graph.tweak(attach=np.array(attach))
+        return self.dpack.set_graph(graph)
+
+    def test_as_many(self):
+        'top N edges, ties broken in favour of the earliest pairings'
+        # the cut falls inside the run of 0.5s
+        dpack = self._with_attach([0.8, 0.5, 0.5, 0.5, 0.2, 0.9])
+        self.assertEqual([('x0', 'x1', 'elaboration'),
+                          ('x1', 'x2', 'narration'),
+                          ('x0', 'x2', 'acknowledgement'),
+                          ('x2', 'x3', 'acknowledgement')],
+                         prediction_to_triples(
+                             AsManyDecoder().decode(dpack)))
+        dpack = self._with_attach([0.5, 0.5, 0.1, 0.5, 0.5, 0.5])
+        self.assertEqual([('x0', 'x1', 'elaboration'),
+                          ('x1', 'x2', 'narration'),
+                          ('x0', 'x3', 'acknowledgement'),
+                          ('x1', 'x3', 'acknowledgement')],
+                         prediction_to_triples(
+                             AsManyDecoder().decode(dpack)))
+
+    def test_best_incoming(self):
+        'best incoming edge for each EDU, the earliest one on ties'
+        # x1 and x0 are tied as sources for x2
+        dpack = self._with_attach([0.8, 0.5, 0.5, 0.5, 0.2, 0.9])
+        self.assertEqual([('x0', 'x1', 'elaboration'),
+                          ('x1', 'x2', 'narration'),
+                          ('x2', 'x3', 'acknowledgement')],
+                         prediction_to_triples(
+                             BestIncomingDecoder().decode(dpack)))
+        dpack = self._with_attach([0.8, 0.5, 0.6, 0.5, 0.7, 0.2])
+        self.assertEqual([('x0', 'x1', 'elaboration'),
+                          ('x0', 'x2', 'acknowledgement'),
+                          ('x1', 'x3', 'acknowledgement')],
+                         prediction_to_triples(
+                             BestIncomingDecoder().decode(dpack)))
+
+    def test_local_baseline(self):
+        'edges strictly above the threshold'
+        dpack = self._with_attach([0.8, 0.5, 0.5, 0.6, 0.2, 0.9])
+        self.assertEqual([('x0', 'x1', 'elaboration'),
+                          ('x0', 'x3', 'acknowledgement'),
+                          ('x2', 'x3', 'acknowledgement')],
+                         prediction_to_triples(
+                             LocalBaseline(0.5).decode(dpack)))
+        # scores rather than probabilities: the threshold is zero
+        dpack = self._with_attach([1.5, -0.5, 0.0, 0.6, -2.0, 3.0])
+        self.assertEqual([('x0', 'x1', 'elaboration'),
+                          ('x0', 'x3', 'acknowledgement'),
+                          ('x2', 'x3', 'acknowledgement')],
+                         prediction_to_triples(
+                             LocalBaseline(0.5, use_prob=False)
+                             .decode(dpack)))
+
 
 class MstTest(DecoderTest):
     """ Tests for MST and MSDAG decoders """
@@ -145,6 +370,50 @@ class MstTest(DecoderTest):
         # Is it a tree ? (One edge less than number of vertices)
         self.assertEqual(len(edges), len(self.edus) - 1)
 
+    def test_decode_batch(self):
+        'batch decoding gives the same results as one at a time'
+        decoder = mst.MstDecoder(mst.MstRootStrategy.fake_root)
+        expected = prediction_to_triples(decoder.decode(self.dpack))
+        results = decoder.decode_batch([self.dpack, self.dpack])
+        self.assertEqual([expected, expected],
+                         [prediction_to_triples(x) for x in results])
+
+    def test_max_spanning_tree(self):
+        'check that cycles of best incoming edges are broken'
+        nan = np.nan
+        # 1 and 2 prefer each other, 3 is only reachable from 2
+        score = np.array([[nan, 1.0, 2.0, nan],
+                          [nan, nan, 8.0, nan],
+                          [nan, 9.0, nan, 1.0],
+                          [nan, 5.0, 5.0, nan]])
+        heads = mst.max_spanning_tree(score, 0)
+        self.assertEqual([-1, 2, 0, 2], list(heads))
+        # 3 cannot be reached from the root
+        score[2, 3] = nan
+        heads = mst.max_spanning_tree(score, 0)
+        self.assertEqual([-1, 2, 0, -1], list(heads))
+
+    def test_max_spanning_dag(self):
+        'check that edges closing a cycle are left out of the MSDAG'
+        nan = np.nan
+        score = np.empty((5, 5))
+        score.fill(nan)
+        # the spanning tree: 0 -> 1 -> 2 -> 3, 0 -> 4
+        score[0, 1] = score[1, 2] = score[2, 3] = score[0, 4] = 9.0
+        # closing cycles with tree edges (rejected)
+        score[3, 1] = 8.0
+        score[3, 2] = 7.0
+        # accepted, then closes a cycle with 3 -> 4 (rejected)
+        score[4, 3] = 6.0
+        score[3, 4] = 5.0
+        # lower scoring, but acyclic (accepted)
+        score[0, 3] = 4.0
+        score[0, 2] = 3.0
+        score[1, 3] = 2.0
+        srcs, tgts = mst.max_spanning_dag(score, 0)
+        self.assertEqual([0, 0, 0, 0, 1, 1, 2, 4], list(srcs))
+        self.assertEqual([1, 2, 3, 4, 2, 3, 3, 3], list(tgts))
+
     def test_msdag(self):
         'check MSDAG decoder'
         decoder = mst.MsdagDecoder(mst.MstRootStrategy.fake_root)
@@ -160,3 +429,129 @@ class EisnerTest(DecoderTest):
         'check that the Eisner decoder works'
         decoder = EisnerDecoder()
         decoder.decode(self.dpack)
+
+    def test_eisner_kbest(self):
+        'check that the k-best Eisner decoder enumerates trees in order'
+        # number of projective trees over 5 EDUs plus the fake root,
+        # with a unique or any number of real roots
+        for unique_real_root, nb_trees in [(True, 30), (False, 55)]:
+            matrix = np.log(np.random.RandomState(0).rand(5, 5))
+            matrix[:, 0] = MIN_SCORE
+            trees = eisner_kbest(matrix, 100, unique_real_root)
+            self.assertEqual(nb_trees, len(trees))
+            self.assertEqual(nb_trees,
+                             len(set(frozenset(e) for _, e in trees)))
+            scores = [s for s, _ in trees]
+            self.assertEqual(sorted(scores, reverse=True), scores)
+            _, csplits = eisner_chart(matrix, unique_real_root)
+            self.assertEqual(sorted(eisner_backtrack(csplits)),
+                             sorted(trees[0][1]))
+
+        decoder = EisnerDecoder()
+        dpacks = decoder.decode_kbest(self.dpack, 3)
+        self.assertEqual(3, len(dpacks))
+        self.assertEqual(list(decoder.decode(self.dpack).graph.prediction),
+                         list(dpacks[0].graph.prediction))
+
+    def test_eisner_labels(self):
+        'joint attachment and label scores, same as AttachTimesBestLabel'
+        rng = np.random.RandomState(1)
+        premultiply = AttachTimesBestLabel()
+        decoder = EisnerDecoder()
+        joint_decoder = EisnerDecoder(use_labels=True)
+        for _ in range(10):
+            graph = Graph(prediction=self.graph.prediction,
+                          attach=rng.rand(len(self.pairings)),
+                          label=rng.rand(*self.graph.label.shape))
+            dpack = self.dpack.set_graph(graph)
+            self.assertEqual(
+                prediction_to_triples(
+                    decoder.decode(premultiply.transform(dpack))),
+                prediction_to_triples(joint_decoder.decode(dpack)))
+
+    def test_eisner_labels_scores(self):
+        'joint non-probabilistic scores are the sum of both scores'
+        rng = np.random.RandomState(2)
+        decoder = EisnerDecoder(use_prob=False)
+        joint_decoder = EisnerDecoder(use_prob=False, use_labels=True)
+        for _ in range(10):
+            attach = rng.randn(len(self.pairings))
+            label = rng.randn(*self.graph.label.shape)
+            dpack = self.dpack.set_graph(
+                Graph(prediction=self.graph.prediction,
+                      attach=attach,
+                      label=label))
+            summed = self.dpack.set_graph(
+                Graph(prediction=self.graph.prediction,
+                      attach=attach + np.amax(label, axis=1),
+                      label=label))
+            self.assertEqual(
+                prediction_to_triples(decoder.decode(summed)),
+                prediction_to_triples(joint_decoder.decode(dpack)))
+
+    @staticmethod
+    def _reference_eisner(score, nb_edus, unique_real_root):
+        """
+        Straightforward (and slow) Eisner decoder on a dictionary
+        of scores, as it was written before vectorisation
+        """
+        def best(cands, range_k):
+            'max and argmax ignoring NaNs, as lists'
+            max_cand = np.nanmax(cands)
+            return max_cand, (range_k[cands.index(max_cand)]
+                              if not np.isnan(max_cand)
+                              else range_k[0])
+
+        cscores = np.zeros((nb_edus, nb_edus, 2, 2), dtype=np.float64)
+        csplits = np.zeros((nb_edus, nb_edus, 2, 2), dtype=np.int32)
+        for span in range(1, nb_edus):
+            for start in range(nb_edus - span):
+                end = start + span
+                range_k = range(start, end)
+                cands = [(cscores[start][k][0][1] +
+                          cscores[k + 1][end][1][1] +
+                          (score[(end, start)]
+                           if start > 0 and (end, start) in score
+                           else MIN_SCORE))
+                         for k in range_k]
+                cscores[start][end][1][0], csplits[start][end][1][0] =\
+                    best(cands, range_k)
+                range_k = ([0] if unique_real_root and start == 0
+                           else range(start, end))
+                cands = [(cscores[start][k][0][1] +
+                          cscores[k + 1][end][1][1] +
+                          score.get((start, end), MIN_SCORE))
+                         for k in range_k]
+                cscores[start][end][0][0], csplits[start][end][0][0] =\
+                    best(cands, range_k)
+                range_k = range(start, end)
+                cands = [(cscores[start][k][1][1] +
+                          cscores[k][end][1][0])
+                         for k in range_k]
+                cscores[start][end][1][1], csplits[start][end][1][1] =\
+                    best(cands, range_k)
+                range_k = range(start + 1, end + 1)
+                cands = [(cscores[start][k][0][0] +
+                          cscores[k][end][0][1])
+                         for k in range_k]
+                cscores[start][end][0][1], csplits[start][end][0][1] =\
+                    best(cands, range_k)
+        return cscores, csplits
+
+    def test_eisner_vectorised(self):
+        'the vectorised chart matches the reference decoder'
+        rng = np.random.RandomState(0)
+        for nb_edus in range(1, 12):
+            for unique_real_root in [True, False]:
+                matrix = np.log(rng.rand(nb_edus, nb_edus))
+                matrix[rng.rand(nb_edus, nb_edus) < 0.3] = MIN_SCORE
+                matrix[:, 0] = MIN_SCORE
+                score = {(i, j): matrix[i, j]
+                         for i in range(nb_edus) for j in range(nb_edus)
+                         if matrix[i, j] != MIN_SCORE}
+                ref_scores, ref_splits =\
+                    self._reference_eisner(score, nb_edus, unique_real_root)
+                cscores, csplits = eisner_chart(matrix, unique_real_root)
+                self.assertTrue(np.array_equal(ref_scores, cscores))
+                self.assertEqual(sorted(eisner_backtrack(ref_splits)),
+                                 sorted(eisner_backtrack(csplits)))
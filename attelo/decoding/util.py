@@ -19,10 +19,10 @@ def cap_score(score):
 
     The current default values for `MIN_SCORE` and `MAX_SCORE` follow the
     requirements from the decoders:
-    * The MST decoder uses the depparse package whose MST implementation
-    has a hardcoded minimum score of `-1e100` ; Feeding it lower weights
-    crashes the algorithm. Combined scores can't reach the limit unless
-    we have more than 1e10 nodes.
+    * The MST and MSDAG decoders need finite scores (the original
+    depparse implementation had a hardcoded minimum score of `-1e100`).
+    Combined scores can't reach the limit unless we have more than 1e10
+    nodes.
     * The Eisner decoder internally uses float64 scores.
 
     Parameters
@@ -86,28 +86,99 @@ def convert_prediction(dpack, triples):
 
         List of EDU id, EDU id, label triples
 
+    Returns
+    -------
+    dpack: DataPack
+        A copy of the original DataPack with predictions
+        set
+
+    See also
+    --------
+    `convert_prediction_idxes`
+    """
+    index = dpack.edu_table.index
+    triples = [(index[id1], index[id2], lab) for id1, id2, lab in triples
+               if id1 in index and id2 in index]
+    parents = np.fromiter((x[0] for x in triples), dtype=np.int64,
+                          count=len(triples))
+    children = np.fromiter((x[1] for x in triples), dtype=np.int64,
+                           count=len(triples))
+    labels = dpack.label_numbers([x[2] for x in triples])
+    return convert_prediction_idxes(dpack, parents, children, labels)
+
+
+def convert_prediction_idxes(dpack, parents, children, labels):
+    """Populate a datapack prediction array from arrays of
+    links, given as EDU and label numbers.
+
+    Pairings which do not correspond to any of the links are
+    predicted as unrelated. Links for which there is no pairing
+    are ignored. If the same link appears more than once, the
+    last occurrence wins.
+
+    Parameters
+    ----------
+    parents: array(int)
+        Row of the parent EDU of each link in `dpack.edu_table`
+
+    children: array(int)
+        Row of the child EDU of each link in `dpack.edu_table`
+
+    labels: array(int)
+        Label number of each link
+
     Returns
     -------
     dpack: DataPack
         A copy of the original DataPack with predictions
         set
     """
-    link_map = {(id1, id2): lab for id1, id2, lab in triples}
-
-    def get_lbl(pair):
-        'from edu pair to label number'
-        edu1, edu2 = pair
-        key = edu1.id, edu2.id
-        lbl = link_map.get(key, UNRELATED)
-        return dpack.label_number(lbl)
-    prediction = np.fromiter((get_lbl(pair) for pair in dpack.pairings),
-                             dtype=np.dtype(np.int16))
+    num_edus = len(dpack.edu_table)
+    pairings = dpack.pairing_idxes.astype(np.int64)
+    pair_keys = pairings[:, 0] * num_edus + pairings[:, 1]
+    link_keys = (np.asarray(parents, dtype=np.int64) * num_edus +
+                 np.asarray(children, dtype=np.int64))
+    # keep the last occurrence of each link
+    rev_keys = link_keys[::-1]
+    uniq_keys, rev_pos = np.unique(rev_keys, return_index=True)
+    uniq_labels = np.asarray(labels)[::-1][rev_pos]
+
+    prediction = np.empty(len(pair_keys), dtype=np.dtype(np.int16))
+    prediction.fill(dpack.label_number(UNRELATED))
+    if len(uniq_keys):
+        pos = np.searchsorted(uniq_keys, pair_keys)
+        pos[pos == len(uniq_keys)] = 0
+        found = uniq_keys[pos] == pair_keys
+        prediction[found] = uniq_labels[pos[found]]
     graph = Graph(prediction=prediction,
                   attach=dpack.graph.attach,
                   label=dpack.graph.label)
     return dpack.set_graph(graph)
 
 
+def convert_prediction_pairings(dpack, idxes):
+    """Populate a datapack prediction array by attaching the
+    given pairings, each with its best label.
+
+    Parameters
+    ----------
+    idxes: array(int)
+        Indices of the pairings to attach. If some EDU pair appears
+        more than once in the datapack, the last index given for it
+        determines its label.
+
+    Returns
+    -------
+    dpack: DataPack
+        A copy of the original DataPack with predictions
+        set
+    """
+    cands = dpack.candidates
+    idxes = np.asarray(idxes, dtype=np.int64)
+    return convert_prediction_idxes(dpack, cands.src[idxes],
+                                    cands.tgt[idxes], cands.label[idxes])
+
+
 def simple_candidates(dpack):
     '''
     Translate the links into a list of (EDU, EDU, float, string)
@@ -115,14 +186,36 @@ def simple_candidates(dpack):
     the best label for each EDU pair.  This is often good enough
     for simplistic decoders
     '''
-    if dpack.graph is None:
-        raise ValueError("Tried to extract weights from an "
-                         "unweighted datapack")
-    wts = dpack.graph
-    best_lbls = np.ravel(np.argmax(wts.label, axis=1))
-    return [(pair[0], pair[1], score, dpack.get_label(lbl))
+    cands = dpack.candidates
+    best_lbls = dpack.get_labels(cands.label)
+    return [(pair[0], pair[1], score, lbl)
             for pair, score, lbl
-            in zip(dpack.pairings, wts.attach, best_lbls)]
+            in zip(dpack.pairings, cands.attach, best_lbls)]
+
+
+def prediction_to_idxes(dpack):
+    """Inverse of `convert_prediction_idxes`
+
+    Returns
+    -------
+    parents: array(int)
+        Row of the parent EDU of each predicted link in
+        `dpack.edu_table`
+
+    children: array(int)
+        Row of the child EDU of each predicted link
+
+    labels: array(int)
+        Label number of each predicted link (omitting the
+        unrelated links)
+    """
+    if dpack.graph is None:
+        raise ValueError("Not a weighted datapack")
+    unrelated = dpack.label_number(UNRELATED)
+    prediction = dpack.graph.prediction
+    linked = np.where(prediction != unrelated)[0]
+    pairings = dpack.pairing_idxes[linked]
+    return pairings[:, 0], pairings[:, 1], prediction[linked]
 
 
 def prediction_to_triples(dpack):
@@ -134,10 +227,7 @@ def prediction_to_triples(dpack):
         List of EDU id, EDU id, label triples
         omitting the unrelated triples
     """
-    if dpack.graph is None:
-        raise ValueError("Not a weighted datapack")
-    unrelated = dpack.label_number(UNRELATED)
-    return [(edu1.id, edu2.id, dpack.get_label(lbl))
-            for (edu1, edu2), lbl in
-            zip(dpack.pairings, dpack.graph.prediction)
-            if lbl != unrelated]
+    parents, children, labels = prediction_to_idxes(dpack)
+    edus = dpack.edu_table.edus
+    return [(edus[i].id, edus[j].id, lbl)
+            for i, j, lbl in zip(parents, children, dpack.get_labels(labels))]
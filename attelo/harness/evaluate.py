@@ -209,10 +209,10 @@ def do_global_decode(hconf, dconf):
 def _load_harness_multipack(hconf, test_data=False):
     """Load the multipack for our current configuration.
 
-    Load the stripped features file if we don't actually need to
-    use the features (this would only make sense on the cluster
-    where evaluation is broken up into separate stages that we
-    can fire on different nodes)
+    Only read the targets if we don't actually need to use the
+    features (this would only make sense on the cluster where
+    evaluation is broken up into separate stages that we can fire
+    on different nodes)
 
     Parameters
     ----------
@@ -224,18 +224,18 @@ def _load_harness_multipack(hconf, test_data=False):
     mpack : Multipack
         Multipack loaded from the harness' configuration.
     """
-    stripped_paths = hconf.mpack_paths(test_data, stripped=True)
-    if (hconf.runcfg.stage in [ClusterStage.end, ClusterStage.start] and
-        fp.exists(stripped_paths['features'])):
-        paths = stripped_paths
-    else:
-        paths = hconf.mpack_paths(test_data, stripped=False)
+    features = hconf.runcfg.stage not in [ClusterStage.end,
+                                          ClusterStage.start]
+    paths = hconf.mpack_paths(test_data)
     mpack = load_multipack(paths['edu_input'],
                            paths['pairings'],
                            paths['features'],
                            paths['vocab'],
                            corpus_path=paths.get('corpus', None),  # WIP
-                           verbose=True)
+                           verbose=True,
+                           cache_dir=paths.get('cache', None),
+                           n_jobs=hconf.runcfg.n_jobs,
+                           features=features)
     return mpack
 
 
@@ -165,6 +165,17 @@ class Harness(with_metaclass(ABCMeta, object)):
         List of document names for which we would like to generate graphs
         """
         return []
+
+    @property
+    def batches_per_worker(self):
+        """Number of decoding jobs to give each parallel worker.
+
+        If set, documents are grouped into this many batches per
+        worker, of roughly equal size (in EDU pairs), which saves us
+        from sending each document to a worker on its own. None to
+        decode each document in a separate job.
+        """
+        return None
     # pylint: enable=no-self-use
 
     @abstractmethod
@@ -204,6 +215,11 @@ class Harness(with_metaclass(ABCMeta, object)):
         * features
         * vocab
 
+        Optional keys are:
+        * corpus (WIP)
+        * cache: directory for compiled versions of the above
+          (see `attelo.io.load_multipack`)
+
         Parameters
         ----------
         test_data : bool
@@ -211,7 +227,9 @@ class Harness(with_metaclass(ABCMeta, object)):
 
         stripped : bool, defaults to False
             If True, return path for a "stripped" version of the data
-            (faster loading, but only useful for scoring).
+            (faster loading, but only useful for scoring). Attelo no
+            longer asks for this: it reads only the targets when it
+            does not need the features.
 
         Returns
         -------
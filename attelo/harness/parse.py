@@ -4,16 +4,18 @@ Control over attelo parsers as might be needed for a test harness
 
 from __future__ import print_function
 from os import path as fp
+import heapq
 import os
 import sys
 
 from joblib import (delayed)
 
-from attelo.io import Torpor, write_predictions_output
+from attelo.io import (Torpor, write_predictions_output)
 from attelo.decoding.util import (prediction_to_triples)
 from attelo.fold import (select_training,
                          select_testing)
 from attelo.harness.util import (makedirs)
+from attelo.util import (effective_n_jobs)
 
 
 def _eval_banner(econf, hconf, fold):
@@ -67,7 +69,44 @@ def _parse_group(dpack, parser, output_path):
     write_predictions_output(dpack, prediction, output_path)
 
 
-def jobs(mpack, parser, output_path):
+def _parse_batch(dpacks, parser, output_paths):
+    '''
+    parse a batch of groups and write their outputs (see
+    `_parse_group`)
+    '''
+    dpacks = parser.transform_batch(dpacks)
+    for dpack, output_path in zip(dpacks, output_paths):
+        prediction = prediction_to_triples(dpack)
+        write_predictions_output(dpack, prediction, output_path)
+
+
+def balanced_batches(mpack, num_batches):
+    """Split the documents of a multipack into batches of roughly
+    equal size.
+
+    Documents are handed out biggest first, each to the batch which
+    is smallest so far (size being the number of EDU pairs).
+
+    Parameters
+    ----------
+    mpack : dict(string, DataPack)
+    num_batches : int
+
+    Returns
+    -------
+    batches : list of lists of document names
+        Non-empty batches only, documents in each sorted by name
+    """
+    heap = [(0, i, []) for i in range(max(1, num_batches))]
+    for onedoc in sorted(mpack, key=lambda d: (-len(mpack[d]), d)):
+        size, i, batch = heapq.heappop(heap)
+        batch.append(onedoc)
+        heapq.heappush(heap, (size + len(mpack[onedoc]), i, batch))
+    return [sorted(batch) for _, _, batch in sorted(heap, key=lambda x: x[1])
+            if batch]
+
+
+def jobs(mpack, parser, output_path, num_batches=None):
     """Get a list of delayed decoding jobs for the documents in this group.
 
     Parameters
@@ -78,6 +117,10 @@ def jobs(mpack, parser, output_path):
         TODO
     output_path : string
         Output path
+    num_batches : int, optional
+        If set, group the documents into (at most) this many jobs of
+        roughly equal size (see `balanced_batches`) rather than
+        having one job per document
 
     Returns
     -------
@@ -90,9 +133,16 @@ def jobs(mpack, parser, output_path):
         if fp.exists(tmpfile):
             os.remove(tmpfile)
     # * generate delayed decoding jobs
-    res = [delayed(_parse_group)(dpack, parser,
-                                 _tmp_output_filename(output_path, onedoc))
-           for onedoc, dpack in mpack.items()]
+    if num_batches is None:
+        res = [delayed(_parse_group)(dpack, parser,
+                                     _tmp_output_filename(output_path,
+                                                          onedoc))
+               for onedoc, dpack in mpack.items()]
+    else:
+        res = [delayed(_parse_batch)([mpack[d] for d in batch], parser,
+                                     [_tmp_output_filename(output_path, d)
+                                      for d in batch])
+               for batch in balanced_batches(mpack, num_batches)]
     return res
 
 
@@ -136,7 +186,12 @@ def delayed_decode(hconf, dconf, econf, fold):
 
     parser = econf.parser.payload
 
-    res = jobs(subpack, parser, output_path)
+    if hconf.batches_per_worker is None:
+        num_batches = None
+    else:
+        num_batches = (effective_n_jobs(hconf.runcfg.n_jobs) *
+                       hconf.batches_per_worker)
+    res = jobs(subpack, parser, output_path, num_batches=num_batches)
     return res
 
 
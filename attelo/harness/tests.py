@@ -5,10 +5,19 @@ attelo.harness tests
 import unittest
 
 from .example import TinyHarness
+from .parse import balanced_batches
 
 
 # pylint: disable=too-few-public-methods
 
+class BatchedTinyHarness(TinyHarness):
+    """Example harness which decodes documents in batches
+    """
+    @property
+    def batches_per_worker(self):
+        return 2
+
+
 # pylint: disable=no-self-use
 class HarnessTest(unittest.TestCase):
     """
@@ -18,3 +27,20 @@ class HarnessTest(unittest.TestCase):
         """Check that the harness does not crash on example data
         """
         TinyHarness().run()
+
+    def test_run_harness_batched(self):
+        """Check that the harness does not crash when decoding in batches
+        """
+        BatchedTinyHarness().run()
+
+    def test_balanced_batches(self):
+        """Documents are spread evenly over batches
+        """
+        # only the length of the datapacks matters here
+        mpack = {'a': [0] * 9, 'b': [0] * 5, 'c': [0] * 4,
+                 'd': [0] * 3, 'e': [0] * 2}
+        self.assertEqual([['a'], ['b', 'e'], ['c', 'd']],
+                         balanced_batches(mpack, 3))
+        self.assertEqual([['a', 'b', 'c', 'd', 'e']],
+                         balanced_batches(mpack, 1))
+        self.assertEqual(5, len(balanced_batches(mpack, 8)))
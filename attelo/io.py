@@ -4,23 +4,34 @@ Saving and loading data or models
 
 from __future__ import print_function
 from itertools import chain
+from os import path as fp
 import codecs
 import copy
 import csv
+import hashlib
 import json
+import os
+import re
+import shutil
 import sys
+import tempfile
 import time
 import traceback
 
+from joblib import (Parallel, delayed)
 from sklearn.datasets import load_svmlight_file
+import numpy as np
+import scipy.sparse
+import six
 
 import educe  # WIP
 
 from .edu import (EDU, FAKE_ROOT_ID, FAKE_ROOT)
-from .table import (DataPack, DataPackException,
+from .table import (DataPack, DataPackException, EduTable,
                     UNKNOWN, UNRELATED,
-                    get_label_string, groupings)
-from .util import truncate
+                    get_label_string, groupings,
+                    _pairing_grouping)
+from .util import (effective_n_jobs, truncate)
 
 # pylint: disable=too-few-public-methods
 
@@ -143,6 +154,22 @@ def load_edus(edu_file):
         return [read_edu(r) for r in reader if r]
 
 
+def _read_pair(pairings_file, row):
+    """
+    Interpret a single row of a pairings file
+    (see :py:func:`load_pairings`)
+
+    :rtype: (string, string)
+    """
+    if len(row) < 2 or len(row) > 3:
+        oops = ('This row in the pairings file {efile} has '
+                '{num} elements instead of the expected 2 or 3')
+        raise IoException(oops.format(efile=pairings_file,
+                                      num=len(row),
+                                      row=row))
+    return tuple(row[:2])
+
+
 def load_pairings(edu_file):
     """
     Read and return EDU pairings (see :doc:`../input`).
@@ -152,19 +179,9 @@ def load_pairings(edu_file):
 
     .. _format: https://github.com/kowey/attelo/doc/inputs.rst
     """
-    def read_pair(row):
-        'interpret a single row'
-        if len(row) < 2 or len(row) > 3:
-            oops = ('This row in the pairings file {efile} has '
-                    '{num} elements instead of the expected 2 or 3')
-            raise IoException(oops.format(efile=edu_file,
-                                          num=len(row),
-                                          row=row))
-        return tuple(row[:2])
-
     with open(edu_file, 'rb') as instream:
         reader = csv.reader(instream, dialect=csv.excel_tab)
-        return [read_pair(r) for r in reader if r]
+        return [_read_pair(edu_file, r) for r in reader if r]
 
 
 def load_labels(feature_file):
@@ -212,9 +229,43 @@ def _process_edu_links(edus, pairings):
     return edus2, pairings2
 
 
+def _load_ctargets(corpus_path):
+    """
+    Read the gold structures for each grouping in the corpus
+    (see `load_multipack`)
+
+    :rtype: dict(string, object)
+    """
+    # WIP augment DataPack with the gold structure for each grouping
+    if corpus_path is None:
+        return {}
+    corpus_reader = educe.rst_dt.corpus.Reader(corpus_path)
+    # TODO modify educe.rst_dt.corpus.Reader.slurp_subcorpus() to
+    # convert fine-grained to coarse-grained relations by default,
+    # e.g. add kwarg coarse_rels=True, then find all current callers
+    # but this one and call slurp* with coarse_rels=False
+    # FIXME should be [v] so that it is adapted to forests (lists)
+    # of structures, e.g. produced by for_intra()
+    return {k.doc: v for k, v in corpus_reader.slurp().items()}
+    # end WIP
+
+
+def _split_multipack(dpack):
+    """
+    Break a datapack up into a multipack, one datapack per grouping
+
+    :rtype: Multipack
+    """
+    return {grp_name: dpack.selected(idxs)
+            for grp_name, idxs in groupings(dpack.pairings).items()}
+
+
 def load_multipack(edu_file, pairings_file, feature_file, vocab_file,
                    corpus_path=None,  # WIP
-                   verbose=False):
+                   verbose=False,
+                   cache_dir=None,
+                   n_jobs=1,
+                   features=True):
     """Read EDUs and features for edu pairs.
 
     Perform some basic sanity checks, raising
@@ -229,45 +280,196 @@ def load_multipack(edu_file, pairings_file, feature_file, vocab_file,
         structures ; at the moment, only works with the RST corpus to
         access gold RST constituency trees.
 
+    cache_dir : string, optional
+        Directory of compiled multipacks (see `compile_multipack`).
+        If the input files have already been compiled there, we load
+        the compiled version instead of parsing them; otherwise we
+        parse them and compile the result for next time.
+        This is ignored if `features` is False: we do not read the
+        compiled version then, nor create one.
+
+    n_jobs : int, optional
+        Number of processes to read the feature file with (see
+        `load_features`)
+
+    features : boolean, optional
+        If False, only read the targets from the feature file
+        (see `load_targets`), and give each datapack an empty
+        feature matrix (with no columns). This is much faster, and
+        is enough for scoring and reporting.
+
     Returns
     -------
     mpack: Multipack
         Multipack (= dict) from grouping to DataPack.
     """
+    if cache_dir is not None and features:
+        compiled_dir = compile_multipack(edu_file, pairings_file,
+                                         feature_file, vocab_file,
+                                         cache_dir, verbose=verbose,
+                                         n_jobs=n_jobs)
+        with Torpor("Reading compiled data pack", quiet=not verbose):
+            dpack = load_compiled_datapack(
+                compiled_dir, ctarget=_load_ctargets(corpus_path))
+    else:
+        dpack = _load_datapack(edu_file, pairings_file, feature_file,
+                               vocab_file,
+                               corpus_path=corpus_path,
+                               verbose=verbose,
+                               n_jobs=n_jobs,
+                               features=features)
+    return _split_multipack(dpack)
+
+
+def iter_multipack(edu_file, pairings_file, feature_file, vocab_file,
+                   zero_based=None,
+                   verbose=False):
+    """Read EDUs and features for edu pairs, one grouping at a time.
+
+    This is a streaming alternative to :py:func:`load_multipack`:
+    rather than reading the whole feature file and slicing it up,
+    we read the pairings and features files in lockstep, and yield
+    a datapack as soon as we have seen all the rows for its grouping.
+    Memory use is thus bounded by the largest document rather than
+    by the whole corpus (EDUs are still all read up front, but they
+    are comparatively small).
+
+    The pairings (and features) must be sorted by grouping, ie. all
+    the rows for any one grouping must be contiguous; we raise an
+    :py:class:`IoException` if not.
+
+    Parameters
+    ----------
+    zero_based : boolean, optional
+        If the feature indices in the feature file start from zero.
+        By default we guess this the same way as `load_multipack`
+        (one-based unless the index 0 is used anywhere in the file);
+        as each document is parsed separately, this means making an
+        extra pass over the feature file up front.
+
+    Yields
+    ------
+    grouping: string
+
+    dpack: DataPack
+        Datapack for the pairings in that grouping
+    """
+    vocab = load_vocab(vocab_file)
+    if zero_based is None:
+        zero_based = _svmlight_zero_based(feature_file)
+    labels = [UNKNOWN] + load_labels(feature_file)
+    edus = load_edus(edu_file)
+    edumap = {e.id: e for e in edus}
+    edumap[FAKE_ROOT_ID] = FAKE_ROOT
+    edu_order = {e.id: i for i, e in enumerate([FAKE_ROOT] + edus)}
+
+    def mk_dpack(pairings, lines):
+        "build the datapack for a single grouping"
+        # pylint: disable=unbalanced-tuple-unpacking
+        data, targets = load_svmlight_file(six.BytesIO(b''.join(lines)),
+                                           n_features=len(vocab),
+                                           zero_based=zero_based)
+        # pylint: enable=unbalanced-tuple-unpacking
+        enames = frozenset(e.id for e in chain.from_iterable(pairings))
+        doc_edus = sorted((edumap[x] for x in enames),
+                          key=lambda e: edu_order[e.id])
+        return DataPack.load(doc_edus, pairings, data, targets, {},
+                             labels, vocab)
+
+    def read_rows(pstream, fstream):
+        "pairs of EDUs and the corresponding feature line"
+        preader = (r for r in csv.reader(pstream, dialect=csv.excel_tab)
+                   if r)
+        flines = (l for l in fstream
+                  if l.strip() and not l.startswith(b'#'))
+        for row in preader:
+            names = _read_pair(pairings_file, row)
+            naughty = [x for x in names if x not in edumap]
+            if naughty:
+                oops = ('The pairings file mentions the following EDUs '
+                        'but the EDU file does not actually include EDUs '
+                        'to go with them: {}')
+                raise DataPackException(oops.format(', '.join(naughty)))
+            line = next(flines, None)
+            if line is None:
+                oops = ('The pairings file {pfile} has more rows than '
+                        'there are feature instances in {ffile}')
+                raise DataPackException(oops.format(pfile=pairings_file,
+                                                    ffile=feature_file))
+            yield (edumap[names[0]], edumap[names[1]]), line
+        if next(flines, None) is not None:
+            oops = ('The feature file {ffile} has more instances than '
+                    'there are rows in the pairings file {pfile}')
+            raise DataPackException(oops.format(pfile=pairings_file,
+                                                ffile=feature_file))
+
+    done = set()
+    current = None
+    pairings = []
+    lines = []
+    with open(pairings_file, 'rb') as pstream:
+        with open(feature_file, 'rb') as fstream:
+            for pair, line in read_rows(pstream, fstream):
+                grp = _pairing_grouping(*pair)
+                if grp != current:
+                    if pairings:
+                        with Torpor("Reading " + current,
+                                    quiet=not verbose):
+                            dpack = mk_dpack(pairings, lines)
+                        yield current, dpack
+                        done.add(current)
+                    if grp in done:
+                        oops = ('The rows for grouping {grp} are not '
+                                'contiguous in {pfile}; sort it by '
+                                'grouping or use load_multipack')
+                        raise IoException(oops.format(grp=grp,
+                                                      pfile=pairings_file))
+                    current = grp
+                    pairings = []
+                    lines = []
+                pairings.append(pair)
+                lines.append(line)
+    if pairings:
+        with Torpor("Reading " + current, quiet=not verbose):
+            dpack = mk_dpack(pairings, lines)
+        yield current, dpack
+
+
+def _load_datapack(edu_file, pairings_file, feature_file, vocab_file,
+                   corpus_path=None,
+                   verbose=False,
+                   n_jobs=1,
+                   features=True):
+    """
+    Read a single (stacked) datapack covering all the groupings
+    in the input files (see `load_multipack`)
+
+    :rtype: DataPack
+    """
     vocab = load_vocab(vocab_file)
 
     with Torpor("Reading edus and pairings", quiet=not verbose):
         edus, pairings = _process_edu_links(load_edus(edu_file),
                                             load_pairings(pairings_file))
 
-    with Torpor("Reading features", quiet=not verbose):
-        labels = [UNKNOWN] + load_labels(feature_file)
-        # pylint: disable=unbalanced-tuple-unpacking
-        data, targets = load_svmlight_file(feature_file,
-                                           n_features=len(vocab))
-        # pylint: enable=unbalanced-tuple-unpacking
-
-    # WIP augment DataPack with the gold structure for each grouping
-    if corpus_path is None:
-        ctargets = {}
+    if features:
+        with Torpor("Reading features", quiet=not verbose):
+            labels = [UNKNOWN] + load_labels(feature_file)
+            data, targets = load_features(feature_file,
+                                          n_features=len(vocab),
+                                          n_jobs=n_jobs)
     else:
-        corpus_reader = educe.rst_dt.corpus.Reader(corpus_path)
-        # FIXME should be [v] so that it is adapted to forests (lists)
-        # of structures, e.g. produced by for_intra()
-        ctargets = {k.doc: v for k, v in corpus_reader.slurp().items()}
-        # TODO modify educe.rst_dt.corpus.Reader.slurp_subcorpus() to
-        # convert fine-grained to coarse-grained relations by default,
-        # e.g. add kwarg coarse_rels=True, then find all current callers
-        # but this one and call slurp* with coarse_rels=False
-    # end WIP
+        with Torpor("Reading targets", quiet=not verbose):
+            labels = [UNKNOWN] + load_labels(feature_file)
+            targets = load_targets(feature_file)
+            data = scipy.sparse.csr_matrix((len(targets), 0))
+
+    ctargets = _load_ctargets(corpus_path)
 
     with Torpor("Build data packs", quiet=not verbose):
         dpack = DataPack.load(edus, pairings, data, targets, ctargets,
                               labels, vocab)
-
-    mpack = {grp_name: dpack.selected(idxs)
-             for grp_name, idxs in groupings(pairings).items()}
-    return mpack
+    return dpack
 
 
 def load_vocab(filename):
@@ -278,6 +480,355 @@ def load_vocab(filename):
             features.append(line.split('\t')[0])
     return features
 
+
+# ---------------------------------------------------------------------
+# features
+# ---------------------------------------------------------------------
+
+
+def _chunk_offsets(filename, num_chunks):
+    """
+    Split a file into (at most) `num_chunks` byte ranges of roughly
+    equal size, each starting at the beginning of a line
+
+    :rtype: [(int, int)]
+    """
+    size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, 'rb') as stream:
+        for i in range(1, num_chunks):
+            stream.seek(max(size * i // num_chunks, starts[-1]))
+            stream.readline()
+            pos = stream.tell()
+            if pos >= size:
+                break
+            if pos > starts[-1]:
+                starts.append(pos)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _svmlight_zero_based(filename):
+    """
+    True if the feature index 0 is used anywhere in an svmlight file,
+    which is how `load_svmlight_file` guesses that the indices are
+    zero-based rather than one-based (see `load_features`)
+    """
+    index_zero = re.compile(br'\s0:')
+    with open(filename, 'rb') as stream:
+        for line in stream:
+            if index_zero.search(line.split(b'#', 1)[0]):
+                return True
+    return False
+
+
+def _load_svmlight_chunk(filename, start, end):
+    """
+    Read the lines in the given byte range of an svmlight file,
+    treating the feature indices as zero-based
+
+    :rtype: (csr_matrix, array(float))
+    """
+    with open(filename, 'rb') as stream:
+        stream.seek(start)
+        chunk = stream.read(end - start)
+    return load_svmlight_file(six.BytesIO(chunk), zero_based=True)
+
+
+def load_targets(feature_file):
+    """Read only the targets (first column) of an svmlight feature
+    file, without parsing the features themselves.
+
+    :rtype: array(float)
+    """
+    targets = []
+    with open(feature_file, 'rb') as stream:
+        for line in stream:
+            line = line.split(b'#', 1)[0]
+            if line.strip():
+                targets.append(float(line.split(None, 1)[0]))
+    return np.array(targets)
+
+
+def load_features(feature_file, n_features=None, n_jobs=1):
+    """Read an svmlight feature file (see :doc:`../input`).
+
+    This is `sklearn.datasets.load_svmlight_file`, but with the
+    option of splitting the file into chunks (on line boundaries)
+    and parsing them in parallel.
+
+    As with `load_svmlight_file`, we guess if the feature indices are
+    zero- or one-based: they are one-based unless the index zero is
+    used anywhere in the file.
+
+    Parameters
+    ----------
+    feature_file: string
+
+    n_features: int, optional
+        Number of columns in the resulting matrix (guessed from the
+        file if unset)
+
+    n_jobs: int, optional
+        Number of processes to parse the file with (see `joblib`)
+
+    Returns
+    -------
+    data: csr_matrix
+        Feature matrix
+
+    targets: array(float)
+        First column of each line
+    """
+    chunks = _chunk_offsets(feature_file, effective_n_jobs(n_jobs))
+    if len(chunks) <= 1:
+        # pylint: disable=unbalanced-tuple-unpacking
+        return load_svmlight_file(feature_file, n_features=n_features)
+        # pylint: enable=unbalanced-tuple-unpacking
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_load_svmlight_chunk)(feature_file, start, end)
+        for start, end in chunks)
+    # the chunks only know about the features they use
+    num_cols = max(x.shape[1] for x, _ in results)
+    data = scipy.sparse.vstack([scipy.sparse.csr_matrix(
+        (x.data, x.indices, x.indptr), shape=(x.shape[0], num_cols))
+                                for x, _ in results],
+                               format='csr')
+    targets = np.concatenate([y for _, y in results])
+
+    indices = data.indices
+    if data.nnz and indices.min() > 0:
+        # one-based after all
+        indices = indices - 1
+        num_cols -= 1
+    if n_features is not None:
+        if num_cols > n_features:
+            oops = ('n_features was set to {}, but input file contains '
+                    '{} features')
+            raise ValueError(oops.format(n_features, num_cols))
+        num_cols = n_features
+    data = scipy.sparse.csr_matrix((data.data, indices, data.indptr),
+                                   shape=(data.shape[0], num_cols))
+    return data, targets
+
+
+# ---------------------------------------------------------------------
+# compiled multipacks
+# ---------------------------------------------------------------------
+
+COMPILED_FORMAT = 2
+"version of the compiled multipack layout (part of the cache key)"
+
+_COMPILED_ARRAYS = ['pairings', 'target', 'data', 'indices', 'indptr']
+
+
+def _file_stamp(path):
+    """
+    Cheap description of a file (absolute path, size and
+    modification time), which changes whenever the file is
+    rewritten
+
+    :rtype: [string]
+    """
+    stat = os.stat(path)
+    return [fp.abspath(path), str(stat.st_size), repr(stat.st_mtime)]
+
+
+def multipack_key(edu_file, pairings_file, feature_file, vocab_file):
+    """
+    Return a string that identifies the input files for a multipack,
+    so that we know when a compiled version of them is stale.
+
+    The key is built from the path, size and modification time of
+    each file, so computing it does not involve reading them.
+
+    :rtype: string
+    """
+    hasher = hashlib.md5()
+    hasher.update(str(COMPILED_FORMAT).encode('ascii'))
+    for path in [edu_file, pairings_file, feature_file, vocab_file]:
+        for field in _file_stamp(path):
+            if isinstance(field, six.text_type):
+                field = field.encode('utf-8')
+            hasher.update(b'\t' + field)
+    return hasher.hexdigest()
+
+
+def _save_edu_columns(edus, filename):
+    """
+    Save a list of EDUs as one numpy array per field
+    (see `_load_edu_columns`)
+    """
+    columns = {}
+    for i, name in enumerate(EDU._fields):
+        values = [edu[i] for edu in edus]
+        columns[name] = np.array(values) if values else np.array([], 'S')
+    np.savez(filename, **columns)
+
+
+def _load_edu_columns(filename):
+    """
+    Read back a list of EDUs saved with `_save_edu_columns`
+
+    :rtype: [EDU]
+    """
+    with np.load(filename) as columns:
+        fields = [columns[name].tolist() for name in EDU._fields]
+    return [EDU(*x) for x in zip(*fields)]
+
+
+def save_compiled_datapack(dpack, output_dir):
+    """
+    Save a (stacked) datapack to a directory of binary files which
+    can be memory-mapped back in by `load_compiled_datapack`.
+
+    The EDUs are saved column by column and the pairings as pairs of
+    EDU row numbers, alongside the features and targets, all in numpy
+    format. Structured targets are not saved.
+
+    We write into a temporary directory first and move it into place
+    at the end, so that an interrupted compilation does not leave a
+    half-written cache behind.
+    """
+    parent_dir = fp.dirname(fp.abspath(output_dir))
+    if not fp.exists(parent_dir):
+        os.makedirs(parent_dir)
+    tmp_dir = tempfile.mkdtemp(prefix='.compiling-', dir=parent_dir)
+    try:
+        table = dpack.edu_table
+        data = scipy.sparse.csr_matrix(dpack.data)
+        data.sort_indices()
+        arrays = {
+            'pairings': dpack.pairing_idxes,
+            'target': np.asarray(dpack.target),
+            'data': data.data,
+            'indices': data.indices,
+            'indptr': data.indptr,
+        }
+        for name in _COMPILED_ARRAYS:
+            np.save(fp.join(tmp_dir, name + '.npy'), arrays[name])
+        np.savez(fp.join(tmp_dir, 'edu_table.npz'),
+                 grouping=table.grouping,
+                 subgrouping=table.subgrouping,
+                 fake_root=table.fake_root)
+        _save_edu_columns([e for e in table.edus if e.id != FAKE_ROOT_ID],
+                          fp.join(tmp_dir, 'edus.npz'))
+        meta = {'format': COMPILED_FORMAT,
+                'num_listed_edus': dpack.num_listed_edus,
+                'grouping_names': table.grouping_names,
+                'shape': list(data.shape),
+                'labels': dpack.labels,
+                'vocab': dpack.vocab}
+        with codecs.open(fp.join(tmp_dir, 'meta.json'), 'w',
+                         'utf-8') as stream:
+            json.dump(meta, stream)
+        if not fp.exists(output_dir):
+            # (otherwise somebody else compiled the same inputs in the
+            # meantime and we just throw our copy away)
+            os.rename(tmp_dir, output_dir)
+    finally:
+        if fp.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+
+def load_compiled_datapack(compiled_dir, ctarget=None):
+    """
+    Read back a datapack saved with `save_compiled_datapack`.
+
+    The feature and target arrays are memory-mapped (read-only),
+    so this is cheap even for large corpora; the pages are only
+    actually read in when the datapack is sliced up. The EDU table
+    and pairing indices of the datapack are filled in from the saved
+    arrays rather than recomputed.
+
+    Parameters
+    ----------
+    compiled_dir: string
+        Directory written by `save_compiled_datapack`
+
+    ctarget: dict(string, object), optional
+        Structured targets to attach to the datapack
+
+    :rtype: DataPack
+    """
+    with codecs.open(fp.join(compiled_dir, 'meta.json'), 'r',
+                     'utf-8') as stream:
+        meta = json.load(stream)
+    if meta['format'] != COMPILED_FORMAT:
+        oops = ('The compiled data in {dir} uses format {got} but we can '
+                'only read format {want}; please recompile it')
+        raise IoException(oops.format(dir=compiled_dir,
+                                      got=meta['format'],
+                                      want=COMPILED_FORMAT))
+    arrays = {name: np.load(fp.join(compiled_dir, name + '.npy'),
+                            mmap_mode='r')
+              for name in _COMPILED_ARRAYS}
+    with np.load(fp.join(compiled_dir, 'edu_table.npz')) as stream:
+        codes = {name: stream[name] for name in stream.files}
+    table_edus = _load_edu_columns(fp.join(compiled_dir, 'edus.npz'))
+    for i in np.flatnonzero(codes['fake_root']).tolist():
+        table_edus.insert(i, FAKE_ROOT)
+    if len(table_edus) != len(codes['fake_root']):
+        oops = ('The compiled data in {dir} has {got} EDUs instead of '
+                'the expected {want}; please recompile it')
+        raise IoException(oops.format(dir=compiled_dir,
+                                      got=len(table_edus),
+                                      want=len(codes['fake_root'])))
+    table = EduTable(edus=table_edus,
+                     index={e.id: i for i, e in enumerate(table_edus)},
+                     grouping=codes['grouping'],
+                     grouping_names=meta['grouping_names'],
+                     subgrouping=codes['subgrouping'],
+                     fake_root=codes['fake_root'])
+    edus = table_edus[:meta['num_listed_edus']]
+    pairing_idxes = np.array(arrays['pairings'], dtype=np.int32)
+    pairings = [(table_edus[i1], table_edus[i2])
+                for i1, i2 in pairing_idxes.tolist()]
+    data = scipy.sparse.csr_matrix((arrays['data'],
+                                    arrays['indices'],
+                                    arrays['indptr']),
+                                   shape=tuple(meta['shape']))
+    dpack = DataPack(edus=edus,
+                     pairings=pairings,
+                     data=data,
+                     target=arrays['target'],
+                     ctarget={} if ctarget is None else ctarget,
+                     labels=meta['labels'],
+                     vocab=meta['vocab'],
+                     graph=None)
+    # seed the datapack caches rather than recomputing them from
+    # the EDU tuples
+    dpack.__dict__.update(edu_table=table,
+                          num_listed_edus=meta['num_listed_edus'],
+                          pairing_idxes=pairing_idxes)
+    return dpack
+
+
+def compile_multipack(edu_file, pairings_file, feature_file, vocab_file,
+                      cache_dir, verbose=False, n_jobs=1):
+    """
+    Parse the input files for a multipack and save a compiled
+    version of them in the cache directory (see `load_multipack`).
+    Do nothing if an up-to-date compiled version already exists.
+
+    The compiled version is looked up by `multipack_key`, so touching
+    or rewriting any of the input files causes it to be compiled
+    again (and the input files are only read when that happens).
+
+    Returns
+    -------
+    compiled_dir: string
+        Path to the compiled multipack
+    """
+    key = multipack_key(edu_file, pairings_file, feature_file, vocab_file)
+    compiled_dir = fp.join(cache_dir, key)
+    if not fp.exists(compiled_dir):
+        dpack = _load_datapack(edu_file, pairings_file, feature_file,
+                               vocab_file, verbose=verbose, n_jobs=n_jobs)
+        with Torpor("Compiling data pack", quiet=not verbose):
+            save_compiled_datapack(dpack, compiled_dir)
+    return compiled_dir
+
 # ---------------------------------------------------------------------
 # predictions
 # ---------------------------------------------------------------------
@@ -341,11 +892,9 @@ def load_gold_predictions(pairings_file, feature_file, verbose=False):
     :rtype: [(string, string, string)]
     """
     pairings = load_pairings(pairings_file)
-    with Torpor("Reading features", quiet=not verbose):
+    with Torpor("Reading targets", quiet=not verbose):
         labels = load_labels(feature_file)
-        # pylint: disable=unbalanced-tuple-unpacking
-        _, targets = load_svmlight_file(feature_file)
-        # pylint: enable=unbalanced-tuple-unpacking
+        targets = load_targets(feature_file)
     return [(x1, x2, get_label_string(labels, t))
             for ((x1, x2), t) in zip(pairings, targets)]
 
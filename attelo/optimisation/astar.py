@@ -18,8 +18,10 @@ Various search algorithms for combinatorial problems:
 from __future__ import print_function
 from abc import ABCMeta, abstractmethod
 from six import with_metaclass
+import bisect
 import heapq
 from pprint import pformat
+import time
 
 # pylint: disable=too-few-public-methods
 # pylint: disable=abstract-class-not-used, abstract-class-little-used
@@ -75,6 +77,14 @@ class State(with_metaclass(ABCMeta, object)):
     def __hash__(self):
         return hash(self.data())
 
+    def signature(self):
+        """
+        compact summary of the state for the search closed set: states
+        with the same signature must have the same successors (with
+        the same costs) and the same future cost. Defaults to `data()`
+        """
+        return self.data()
+
     @abstractmethod
     def is_solution(self):
         "return `True` if the state is a valid solution"
@@ -112,14 +122,20 @@ class Search(with_metaclass(ABCMeta, object)):
                  queue_size=None):
         self._todo = []
         self._seen = {}
+        self._closed = False
+        self._visits = 1
         self._h_func = heuristic
         self._shared = shared
         self._queue_size = queue_size
+        self._pruned = False
         self.iterations = 0
+        self.expanded = 0
+        self.optimal = True
 
     def reset_queue(self):
         "Clear out the search queue"
         self._todo = []
+        self._pruned = False
 
     def reset_seen(self):
         "Mark every state as not yet seen"
@@ -144,10 +160,9 @@ class Search(with_metaclass(ABCMeta, object)):
         for one, cost in items:
             succ = self.new_state(one)
             succ.update_cost(ancestor_cost+cost)
+            if self._closed and self.is_already_seen(succ):
+                continue
             heapq.heappush(self._todo, succ)
-        # if self._queue_size is not None:
-        #    new = heapq.nsmallest(self._queue_size, self._todo)
-        #    self._todo = new
 
     def pop_best(self):
         """
@@ -163,32 +178,107 @@ class Search(with_metaclass(ABCMeta, object)):
 
     def is_already_seen(self, state):
         """
-        Return `True` if the given search state has already been seen
+        Return `True` if states with the same signature have already
+        been expanded at no greater cost than the given one (as many
+        times as we allow, see `launch`)
         """
-        return hash(state) in self._seen
+        costs = self._seen.get(state.signature())
+        return costs is not None and len(costs) >= self._visits and\
+            costs[self._visits - 1] <= state.cost()
 
     def add_seen(self, state):
         """
-        Mark a state as seen
+        Mark a state as seen (we only remember its signature and the
+        lowest costs at which it was expanded)
+        """
+        costs = self._seen.setdefault(state.signature(), [])
+        bisect.insort(costs, state.cost())
+        del costs[self._visits:]
+
+    def complete_greedily(self, state):
+        """
+        Follow the best successor (by total cost) of the given state
+        until we reach a solution, or a state without successors
+
+        :rtype: State or None
+        """
+        while not state.is_solution():
+            nxt = state.next_states()
+            if not nxt:
+                return None
+            succs = []
+            for one, cost in nxt:
+                succ = self.new_state(one)
+                succ.update_cost(state.cost() + cost)
+                succs.append(succ)
+            state = min(succs)
+        return state
+
+    def _best_effort(self):
         """
-        self._seen[hash(state)] = state
+        Greedily complete the states left in the queue, best first,
+        and return the first solution we reach (None if we reach
+        none)
+        """
+        while not self.has_empty_queue():
+            soln = self.complete_greedily(self.pop_best())
+            if soln is not None:
+                return soln
+        return None
 
     def launch(self, init_state,
                verbose=False,
-               norepeat=False):
+               norepeat=False,
+               max_expansions=None,
+               deadline=None,
+               visits=1):
         """launch search from initital state value
 
+        Solutions are generated in order of cost (assuming an admissible
+        heuristic); after each one, `self.optimal` tells if it is known
+        to be the best remaining solution, ie. if the search was not cut
+        short by a beam or by its budget.
+
         :param: norepeat: there's no need for an "already seen states"
-                          datastructure
+                          datastructure (otherwise, states are not
+                          expanded again unless we find a cheaper way to
+                          reach them, see `State.signature`)
+
+        :param max_expansions: if set, once we have expanded this many
+                               states, stop the search and generate the
+                               first solution we can find by greedy
+                               completion of the states in the queue
+                               (see `complete_greedily`)
+        :type max_expansions: int or None
+
+        :param deadline: same as `max_expansions`, but once we get past
+                         this point in time (as in `time.time()`)
+        :type deadline: float or None
+
+        :param visits: number of times states with the same signature
+                       may be expanded (unless `norepeat`); to get the
+                       n best solutions, set it to at least n
+        :type visits: int
         """
         # TODO: should be able to change the queue_size here
         self.reset_queue()
-        if not norepeat:
-            self.reset_seen()
+        self.reset_seen()
+        self._closed = not norepeat
+        self._visits = visits
         self.add_queue([(init_state, 0)], 0.)
         self.iterations = 0
+        self.expanded = 0
+        self.optimal = True
 
         while not self.has_empty_queue():
+            if (max_expansions is not None and
+                    self.expanded >= max_expansions) or\
+               (deadline is not None and time.time() >= deadline):
+                soln = self._best_effort()
+                if soln is not None:
+                    self.optimal = False
+                    yield soln
+                break
             skip = False
             self.iterations += 1
             state = self.pop_best()
@@ -206,12 +296,13 @@ class Search(with_metaclass(ABCMeta, object)):
                     skip = False
             if not skip:
                 if state.is_solution():
+                    self.optimal = not self._pruned
                     yield state
                 else:
                     if not norepeat:
                         self.add_seen(state)
                     nxt = state.next_states()
-                    # print(next)
+                    self.expanded += 1
                     self.add_queue(nxt, state.cost())
             if verbose:
                 print('update:')
@@ -222,10 +313,49 @@ class Search(with_metaclass(ABCMeta, object)):
         raise StopIteration
 
 
+class _BeamEntry(object):
+    """
+    a state in the beam search queue, which may be dropped from
+    the queue (without being removed from the heaps) if it falls
+    off the beam
+    """
+    __slots__ = ('state', 'live')
+
+    def __init__(self, state):
+        self.state = state
+        self.live = True
+
+    def __lt__(self, other):
+        return self.state < other.state
+
+    def __repr__(self):
+        return repr(self.state)
+
+
+class _WorstFirst(object):
+    """
+    beam search queue entry, in reverse order (so that we can
+    use a heap to find the worst state on the beam)
+    """
+    __slots__ = ('entry',)
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __lt__(self, other):
+        return other.entry.state < self.entry.state
+
+
 class BeamSearch(Search):
     """
     search with heuristics but limited size waiting queue
     (restrict to p-best solutions at each iteration)
+
+    The queue is kept in two heaps, best first and worst first,
+    so that both popping the best state and dropping the worst
+    one off the beam take logarithmic time. States that leave
+    the queue are only marked as such, and swept out from the
+    heaps once they make up most of them.
     """
     def __init__(self,
                  heuristic=lambda x: 0.,
@@ -234,16 +364,68 @@ class BeamSearch(Search):
         super(BeamSearch, self).__init__(heuristic=heuristic,
                                          shared=shared,
                                          queue_size=queue_size)
+        self._worst = []
+        self._num_queued = 0
 
     def new_state(self, data):
         raise NotImplementedError
 
+    def reset_queue(self):
+        super(BeamSearch, self).reset_queue()
+        self._worst = []
+        self._num_queued = 0
+
+    def _worst_entry(self):
+        "the worst entry still on the beam"
+        while not self._worst[0].entry.live:
+            heapq.heappop(self._worst)
+        return self._worst[0].entry
+
+    def _push(self, state):
+        """
+        Add a state to the queue, dropping the worst state if the
+        beam is full (or not adding it at all if it is the worst)
+        """
+        if self._queue_size is not None and\
+           self._num_queued >= self._queue_size:
+            worst = self._worst_entry()
+            if not state < worst.state:
+                self._pruned = True
+                return
+            worst.live = False
+            heapq.heappop(self._worst)
+            self._num_queued -= 1
+            self._pruned = True
+        entry = _BeamEntry(state)
+        heapq.heappush(self._todo, entry)
+        heapq.heappush(self._worst, _WorstFirst(entry))
+        self._num_queued += 1
+
+    def _sweep(self):
+        "remove entries that have left the queue from the heaps"
+        if len(self._todo) + len(self._worst) > 4 * self._num_queued + 32:
+            self._todo = [x for x in self._todo if x.live]
+            self._worst = [x for x in self._worst if x.entry.live]
+            heapq.heapify(self._todo)
+            heapq.heapify(self._worst)
+
     def add_queue(self, items, ancestor_cost):
         # each item must be a successor and a cost
         for one, cost in items:
             succ = self.new_state(one)
             succ.update_cost(ancestor_cost + cost)
-            heapq.heappush(self._todo, succ)
-        if self._queue_size is not None:
-            new = heapq.nsmallest(self._queue_size, self._todo)
-            self._todo = new
+            if self._closed and self.is_already_seen(succ):
+                continue
+            self._push(succ)
+        self._sweep()
+
+    def pop_best(self):
+        while True:
+            entry = heapq.heappop(self._todo)
+            if entry.live:
+                entry.live = False
+                self._num_queued -= 1
+                return entry.state
+
+    def has_empty_queue(self):
+        return self._num_queued == 0
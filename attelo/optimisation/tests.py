@@ -53,6 +53,19 @@ class TestSearch(Search):
     def new_state(self, data):
         return TestState(data, self._h_func)
 
+class ValueState(TestState):
+    """same as TestState, but states with the same value are
+    considered as the same (whatever the operators that led to them)"""
+    def signature(self):
+        return self.data()[0]
+
+
+class ValueSearch(Search):
+    'Test instance of the A* search algorithm (merging same values)'
+    def new_state(self, data):
+        return ValueState(data, self._h_func)
+
+
 class TestBeamSearch(BeamSearch):
     'Test instance of the A* search algorithm (beam variant)'
     def new_state(self, data):
@@ -102,3 +115,30 @@ class AstarTest(unittest.TestCase):
                  ("Beam/h0/100", TestBeamSearch(h_zero, queue_size=100))]
         for name, search in tests:
             self._test_search(name, search)
+
+    def test_beam_queue(self):
+        'the beam search queue only keeps the best states'
+        costs = [5., 3., 8., 1., 4., 9., 2., 7., 6., 0.]
+        search = TestBeamSearch(queue_size=3)
+        search.reset_queue()
+        for i, cost in enumerate(costs):
+            search.add_queue([((i, ""), cost)], 0.)
+            self.assertTrue(search._num_queued <= 3)
+        popped = []
+        while not search.has_empty_queue():
+            popped.append(search.pop_best().cost())
+        self.assertEqual(sorted(costs)[:3], popped)
+
+    def test_closed_set(self):
+        'states reached again at no lower cost are not expanded again'
+        h_zero = lambda x: 0
+        search = ValueSearch(h_zero)
+        soln = search.launch((0, "")).next()
+        self.assertEqual(6, soln.cost())
+        # each value is expanded once
+        self.assertEqual(len(search._seen), search.expanded)
+        self.assertTrue(all(isinstance(x, int) for x in search._seen))
+        search2 = TestSearch(h_zero)
+        soln2 = search2.launch((0, "")).next()
+        self.assertEqual(6, soln2.cost())
+        self.assertTrue(search.expanded < search2.expanded)
@@ -179,3 +179,28 @@ class Parser(with_metaclass(ABCMeta, object)):
             (TODO: support n-best)
         """
         raise NotImplementedError
+
+    def transform_batch(self, dpacks, nonfixed_pairs=None):
+        """
+        Refine the parses for a sequence of documents (see `transform`).
+
+        This just transforms each document in turn, but parsers that
+        can share work across documents are free to override it.
+
+        Parameters
+        ----------
+        dpacks: [DataPack]
+
+        nonfixed_pairs: [array(int) or None], optional
+            The nonfixed pairs for each document, if any (passed on
+            to `transform`)
+
+        Returns
+        -------
+        predictions: [DataPack]
+            the best graph/prediction for each document
+        """
+        if nonfixed_pairs is None:
+            return [self.transform(dpack) for dpack in dpacks]
+        return [self.transform(dpack, nonfixed_pairs=nf_pairs)
+                for dpack, nf_pairs in zip(dpacks, nonfixed_pairs)]
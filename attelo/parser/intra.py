@@ -145,9 +145,8 @@ def partition_subgroupings(dpack):
 
     Returns
     -------
-    groups : dict from (string, string) to list of integers
-        Map each (grouping, subgrouping) to the list of indices of pairings
-        within the same subgrouping.
+    groups : list of arrays of integers
+        Indices of the pairings within each (grouping, subgrouping).
 
     Notes
     -----
@@ -156,7 +155,8 @@ def partition_subgroupings(dpack):
     * This function is a tiny wrapper around
         `attelo.table.grouped_intra_pairings`.
     """
-    return grouped_intra_pairings(dpack, include_fake_root=True).values()
+    return list(grouped_intra_pairings(dpack,
+                                       include_fake_root=True).values())
 
 
 class IntraInterParser(with_metaclass(ABCMeta, Parser)):
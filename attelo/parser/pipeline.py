@@ -78,3 +78,10 @@ class Pipeline(Parser):
         for name, parser in self.steps:
             dpack = parser.transform(dpack, nonfixed_pairs=nonfixed_pairs)
         return dpack
+
+    def transform_batch(self, dpacks, nonfixed_pairs=None):
+        """Transform a batch of documents, one step at a time."""
+        for name, parser in self.steps:
+            dpacks = parser.transform_batch(dpacks,
+                                            nonfixed_pairs=nonfixed_pairs)
+        return dpacks
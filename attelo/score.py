@@ -127,26 +127,25 @@ def score_edges(dpack, predictions):
     att_pack, _ = attached_only(dpack, dpack.target)
     dict_predicted = {(arg1, arg2): rel for arg1, arg2, rel in predictions
                       if rel != UNRELATED}
+    # label numbers for the predictions, aligned with the reference
+    ref_pairs = [(edu1.id, edu2.id) for edu1, edu2 in att_pack.pairings]
+    pred_labels = [dict_predicted.get(pair) for pair in ref_pairs]
+    pred_found = np.array([x is not None for x in pred_labels], dtype=bool)
+    pred_nums = att_pack.label_numbers([x for x in pred_labels
+                                        if x is not None])
 
     # undirected
     u_predicted = set(tuple(sorted((arg1, arg2)))
                       for arg1, arg2 in dict_predicted)
-    u_gold = set(tuple(sorted((edu1.id, edu2.id)))
-                 for edu1, edu2 in att_pack.pairings)
+    u_gold = set(tuple(sorted(pair)) for pair in ref_pairs)
     undirected = Count(tpos_attach=len(u_gold & u_predicted),
                        tpos_label=0,
                        tpos_fpos=len(u_predicted),
                        tpos_fneg=len(u_gold))
 
     # directed
-    tpos_attach = 0
-    tpos_label = 0
-    for (edu1, edu2), ref_label in zip(att_pack.pairings, att_pack.target):
-        pred_label = dict_predicted.get((edu1.id, edu2.id))
-        if pred_label is not None:
-            tpos_attach += 1
-            if att_pack.label_number(pred_label) == ref_label:
-                tpos_label += 1
+    tpos_attach = int(np.sum(pred_found))
+    tpos_label = int(np.sum(pred_nums == att_pack.target[pred_found]))
     directed = Count(tpos_attach=tpos_attach,
                      tpos_label=tpos_label,
                      tpos_fpos=len(dict_predicted.keys()),
@@ -285,11 +284,12 @@ def score_edus(dpack, predictions):
     :rtype: :py:class:`EduCount`
     """
 
+    predictions = [(parent, edu, rel) for parent, edu, rel in predictions
+                   if rel != UNRELATED]
+    pred_labels = dpack.label_numbers([rel for _, _, rel in predictions])
     e_predictions = defaultdict(list)
-    for parent, edu, rel in predictions:
-        if rel == UNRELATED:
-            continue
-        e_predictions[edu].append((parent, dpack.label_number(rel)))
+    for (parent, edu, _), rel in zip(predictions, pred_labels):
+        e_predictions[edu].append((parent, int(rel)))
 
     e_reference = defaultdict(list)
     unrelated = dpack.label_number(UNRELATED)
@@ -349,7 +349,7 @@ def build_confusion_matrix(dpack, predictions):
     lbl_dict_true = {(src.id, tgt.id): lbl for (src, tgt), lbl
                      in zip(dpack.pairings, dpack.target)}
     target_true = [lbl_dict_true[(src, tgt)] for src, tgt, _ in predictions]
-    target_pred = [dpack.label_number(label) for _, _, label in predictions]
+    target_pred = dpack.label_numbers([label for _, _, label in predictions])
     # we want the confusion matrices to have the same shape regardless
     # of what labels happen to be used in the particular fold
     # pylint: disable=no-member
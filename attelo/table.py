@@ -4,6 +4,8 @@ Manipulating data tables (taking slices, etc)
 
 from __future__ import print_function
 from collections import defaultdict, namedtuple
+from functools import wraps
+from operator import attrgetter
 import itertools
 
 import numpy as np
@@ -30,6 +32,99 @@ class DataPackException(Exception):
         super(DataPackException, self).__init__(msg)
 
 
+def _cached_property(func):
+    """
+    Decorator for read-only properties of (immutable) namedtuples
+    which are expensive to compute and should only be computed once.
+
+    The value is stored in the instance `__dict__`; note that it is
+    not kept when the tuple is pickled or copied
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def inner(self):
+        "look up the cached value or compute it"
+        cache = self.__dict__
+        if name not in cache:
+            cache[name] = func(self)
+        return cache[name]
+    return property(inner)
+
+
+class EduTable(namedtuple('EduTable',
+                          'edus index grouping grouping_names '
+                          'subgrouping fake_root')):
+    '''
+    Columnar view on a list of EDUs, so that operations on EDU
+    pairings can be expressed on integer arrays rather than on
+    EDU tuples.
+
+    Parameters
+    ----------
+    edus: [EDU]
+        the EDUs themselves (each EDU is identified by its row
+        number within this list)
+
+    index: dict(string, int)
+        row number for each EDU id
+
+    grouping: 1D array(int32)
+        grouping code for each EDU, or -1 for EDUs which do not
+        belong to any grouping (ie. the fake root)
+
+    grouping_names: [string]
+        grouping name for each grouping code
+
+    subgrouping: 1D array(int32)
+        code for each distinct (grouping, subgrouping) pair; two
+        EDUs have the same code iff they are in the same grouping
+        and subgrouping
+
+    fake_root: 1D array(bool)
+        which EDUs are the fake root
+    '''
+    @classmethod
+    def from_edus(cls, edus):
+        '''
+        Build a table from a list of EDUs. If the same EDU id occurs
+        more than once, only the first occurrence gets a row
+
+        :rtype: EduTable
+        '''
+        index = {}
+        table = []
+        grp_codes = {}
+        subgrp_codes = {}
+        grouping = []
+        subgrouping = []
+        for edu in edus:
+            if edu.id in index:
+                continue
+            index[edu.id] = len(table)
+            table.append(edu)
+            if edu.grouping is None:
+                grouping.append(-1)
+            else:
+                grouping.append(grp_codes.setdefault(edu.grouping,
+                                                     len(grp_codes)))
+            subgrouping.append(subgrp_codes.setdefault(
+                (edu.grouping, edu.subgrouping), len(subgrp_codes)))
+        grouping_names = [None] * len(grp_codes)
+        for grp, code in grp_codes.items():
+            grouping_names[code] = grp
+        return cls(edus=table,
+                   index=index,
+                   grouping=np.array(grouping, dtype=np.int32),
+                   grouping_names=grouping_names,
+                   subgrouping=np.array(subgrouping, dtype=np.int32),
+                   fake_root=np.array([e.id == FAKE_ROOT_ID for e in table],
+                                      dtype=bool))
+
+    def __len__(self):
+        return len(self.edus)
+
+
 class Graph(namedtuple('Graph',
                        'prediction attach label')):
     '''
@@ -119,6 +214,92 @@ class Graph(namedtuple('Graph',
                               label=label)
 
 
+class Candidates(namedtuple('Candidates',
+                            'edus src tgt attach label')):
+    '''
+    The weighted links of a datapack, in the form that most decoders
+    need: a struct of arrays with one cell per pairing, giving the
+    attachment score and the best label for each EDU pair.
+
+    Parameters
+    ----------
+    edus: [EDU]
+        the EDUs, as in the datapack EDU table
+
+    src: 1D array(int)
+        row in `edus` of the parent of each pairing
+
+    tgt: 1D array(int)
+        row in `edus` of the child of each pairing
+
+    attach: 1D array(float)
+        attachment score of each pairing
+
+    label: 1D array(int)
+        best label (number) for each pairing
+    '''
+    @classmethod
+    def from_dpack(cls, dpack):
+        '''
+        Extract the candidates from a weighted datapack (you probably
+        want to use the cached `DataPack.candidates` instead)
+
+        :rtype: Candidates
+        '''
+        if dpack.graph is None:
+            raise ValueError("Tried to extract weights from an "
+                             "unweighted datapack")
+        idxes = dpack.pairing_idxes
+        return cls(edus=dpack.edu_table.edus,
+                   src=idxes[:, 0],
+                   tgt=idxes[:, 1],
+                   attach=np.asarray(dpack.graph.attach),
+                   label=np.ravel(np.argmax(dpack.graph.label, axis=1)))
+
+    @_cached_property
+    def _sorted_keys(self):
+        '''
+        Sorted `src * n + tgt` keys of the EDU pairs, and the pairing
+        for each key (the last one for EDU pairs appearing more than
+        once)
+        '''
+        num_edus = len(self.edus)
+        keys = self.src.astype(np.int64) * num_edus + self.tgt
+        rev_keys, rev_pos = np.unique(keys[::-1], return_index=True)
+        return rev_keys, len(keys) - 1 - rev_pos
+
+    def lookup(self, srcs, tgts):
+        '''
+        Pairing for each of the given EDU pairs (as arrays of rows
+        into `self.edus`), or -1 if the pair is not a candidate
+
+        :rtype: 1D array(int)
+        '''
+        keys, pairings = self._sorted_keys
+        wanted = (np.asarray(srcs, dtype=np.int64) * len(self.edus) +
+                  np.asarray(tgts, dtype=np.int64))
+        res = np.empty(wanted.shape, dtype=np.int64)
+        res.fill(-1)
+        if len(keys):
+            pos = np.searchsorted(keys, wanted)
+            pos[pos == len(keys)] = 0
+            found = keys[pos] == wanted
+            res[found] = pairings[pos[found]]
+        return res
+
+    def sorted_edus(self):
+        '''
+        Rows of the EDUs which appear in some candidate, sorted by
+        span (and by row in case of ties)
+
+        :rtype: 1D array(int)
+        '''
+        rows = np.unique(np.concatenate([self.src, self.tgt]))
+        spans = np.array([self.edus[i].span() for i in rows],
+                         dtype=np.int64).reshape(-1, 2)
+        return rows[np.lexsort((rows, spans[:, 1], spans[:, 0]))]
+
+
 class DataPack(namedtuple('DataPack',
                           ['edus',
                            'pairings',
@@ -178,6 +359,57 @@ class DataPack(namedtuple('DataPack',
     def __len__(self):
         return len(self.pairings)
 
+    @classmethod
+    def _make(cls, iterable):
+        # the namedtuple version checks the length of the result,
+        # which for us is the number of pairings (NB: list() rather
+        # than *iterable, which would bypass any __iter__ override)
+        return cls(*list(iterable))
+
+    @_cached_property
+    def edu_table(self):
+        '''
+        Table of the EDUs in this datapack, with integer codes for
+        their groupings and subgroupings (see `EduTable`).
+
+        This contains the datapack EDUs in order, followed by any
+        EDUs that are mentioned in the pairings without being in
+        `self.edus` (for example the fake root).
+        '''
+        return EduTable.from_edus(itertools.chain(
+            self.edus, itertools.chain.from_iterable(self.pairings)))
+
+    @_cached_property
+    def num_listed_edus(self):
+        '''
+        Number of rows at the start of `self.edu_table` which
+        correspond to EDUs in `self.edus` (as opposed to EDUs which
+        are only mentioned in the pairings)
+        '''
+        return len(frozenset(e.id for e in self.edus))
+
+    @_cached_property
+    def pairing_idxes(self):
+        '''
+        The pairings, as an int32 array of shape (n_pairings, 2) of
+        row numbers into `self.edu_table` (parent, child)
+        '''
+        index = self.edu_table.index
+        num_pairings = len(self.pairings)
+        edu_ids = map(attrgetter('id'),
+                      itertools.chain.from_iterable(self.pairings))
+        flat = np.fromiter(map(index.__getitem__, edu_ids),
+                           dtype=np.int32, count=2 * num_pairings)
+        return flat.reshape((num_pairings, 2))
+
+    @_cached_property
+    def candidates(self):
+        '''
+        The weighted candidate links of this datapack (see
+        `Candidates`); raises ValueError if it has no graph
+        '''
+        return Candidates.from_dpack(self)
+
     # pylint: disable=too-many-arguments
     @classmethod
     def load(cls, edus, pairings, data, target, ctarget, labels, vocab):
@@ -205,25 +437,15 @@ class DataPack(namedtuple('DataPack',
         '''
         Combine several datapacks into one.
 
-        The labels and vocabulary for all packs must be the same
+        The labels and vocabulary for all packs must be the same.
+        The result is a `StackedDataPack`, which can be split back
+        into the original datapacks.
 
         :type dpacks: [DataPack]
         '''
         if not dpacks:
             raise ValueError('need non-empty list of datapacks')
-        dzero = dpacks[0]
-        return DataPack(edus=concat_l(d.edus for d in dpacks),
-                        pairings=concat_l(d.pairings for d in dpacks),
-                        data=scipy.sparse.vstack(d.data for d in dpacks),
-                        target=np.concatenate([d.target for d in dpacks]),
-                        ctarget={grp_name: list(itertools.chain.from_iterable(
-                            d.ctarget.get(grp_name, []) for d in dpacks))
-                                 for grp_name in
-                                 set(itertools.chain.from_iterable(
-                                     d.ctarget.keys() for d in dpacks))},
-                        labels=dzero.labels,
-                        vocab=dzero.vocab,
-                        graph=Graph.vstack(d.graph for d in dpacks))
+        return StackedDataPack(dpacks)
 
     def _check_target(self):
         '''
@@ -285,40 +507,20 @@ class DataPack(namedtuple('DataPack',
     def selected(self, indices):
         '''
         Return only the items in the specified rows
+
+        The result is a lazy view on this datapack (see
+        `DataPackView`); use `compact()` on it if you need a
+        standalone copy
         '''
-        sel_targets = np.take(self.target, indices)
-        if self.labels is None:
-            sel_labels = None
-        else:
-            sel_labels = self.labels
-        sel_pairings = [self.pairings[x] for x in indices]
-        sel_edus_ = set()
-        for edu1, edu2 in sel_pairings:
-            sel_edus_.add(edu1)
-            sel_edus_.add(edu2)
-        sel_edus = [e for e in self.edus if e in sel_edus_]
-        # NEW ctarget
-        sel_groupings = set(groupings(sel_pairings).keys())
-        sel_ctargets = {grp_name: ctgt
-                        for grp_name, ctgt in self.ctarget.items()
-                        if grp_name in sel_groupings}
-        # FIXME restrict further, break RSTTree into forest of RSTTrees
-        # that can be built using sel_pairings only (not sure this is
-        # well-defined)
-        # end NEW ctarget
-        sel_data = self.data[indices]
-        if self.graph is None:
-            graph = None
-        else:
-            graph = self.graph.selected(indices)
-        return DataPack(edus=sel_edus,
-                        pairings=sel_pairings,
-                        data=sel_data,
-                        target=sel_targets,
-                        ctarget=sel_ctargets,  # WIP
-                        labels=sel_labels,
-                        vocab=self.vocab,
-                        graph=graph)
+        return DataPackView(self, indices)
+
+    def compact(self):
+        '''
+        Return a datapack which does not depend on any other
+        datapack (see `DataPackView`); plain datapacks are
+        already compact, so this returns the datapack itself
+        '''
+        return self
 
     def set_graph(self, graph):
         '''
@@ -346,6 +548,12 @@ class DataPack(namedtuple('DataPack',
                     '').format(got=graph.label.shape,
                                want=want_shape_2d)
             raise ValueError(oops)
+        return self._with_graph(graph)
+
+    def _with_graph(self, graph):
+        '''
+        Return a copy of the datapack with weights set (no checks)
+        '''
         return DataPack(edus=self.edus,
                         pairings=self.pairings,
                         data=self.data,
@@ -371,6 +579,35 @@ class DataPack(namedtuple('DataPack',
         '''
         return get_label_string(self.labels, i)
 
+    def get_labels(self, idxes):
+        '''
+        Return the class labels for an array of target values.
+
+        Parameters
+        ----------
+        idxes: array(int)
+
+            target values
+
+        Returns
+        -------
+        labels: array(string)
+
+        See also
+        --------
+        `get_label`, `label_numbers`
+        '''
+        idxes = np.asarray(idxes, dtype=np.int64)
+        return np.asarray(self.labels, dtype=object)[idxes]
+
+    @_cached_property
+    def _label_index(self):
+        '''
+        Dictionary from label strings to their number
+        '''
+        # reversed so that the first occurrence wins, like list.index
+        return {lbl: i for i, lbl in reversed(list(enumerate(self.labels)))}
+
     def label_number(self, label):
         '''
         Return the numerical label that corresponnds to the given
@@ -388,7 +625,340 @@ class DataPack(namedtuple('DataPack',
         --------
         `get_label`
         '''
-        return self.labels.index(label)
+        try:
+            return self._label_index[label]
+        except KeyError:
+            raise ValueError('{!r} is not in the datapack labels'
+                             ''.format(label))
+
+    def label_numbers(self, labels):
+        '''
+        Return the numerical labels for an array of string labels.
+
+        Parameters
+        ----------
+        labels: array(string)
+
+            label strings, each in `self.labels`
+
+        Returns
+        -------
+        idxes: array(int)
+
+        See also
+        --------
+        `label_number`, `get_labels`
+        '''
+        labels = np.asarray(labels, dtype=object)
+        if not len(labels):
+            return np.zeros(labels.shape, dtype=np.int64)
+        # look up each distinct label once
+        uniq, inverse = np.unique(labels, return_inverse=True)
+        numbers = np.array([self.label_number(x) for x in uniq],
+                           dtype=np.int64)
+        return numbers[inverse].reshape(labels.shape)
+
+
+class _LazyDataPack(DataPack):
+    '''
+    A datapack some of whose fields are computed on demand (by
+    properties in the subclass) rather than stored in the tuple.
+
+    Indexing, iterating on or comparing them goes through the
+    properties, so they behave like ordinary datapacks in these
+    respects too. Pickling, copying or `_replace` on them gives a plain
+    (compacted) datapack.
+    '''
+    _lazy_fields = ()
+    "fields which are not stored in the tuple (None there)"
+
+    def __iter__(self):
+        return iter([getattr(self, f) for f in self._fields])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return tuple(self)[key]
+        name = self._fields[key]
+        if name in self._lazy_fields:
+            return getattr(self, name)
+        else:
+            return tuple.__getitem__(self, key)
+
+    def __getslice__(self, start, end):
+        # python 2 only
+        return tuple(self)[start:end]
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return (DataPack, tuple(self.compact()))
+
+    @classmethod
+    def _make(cls, iterable):
+        return DataPack._make(iterable)
+
+    def compact(self):
+        '''
+        Return a plain datapack with the same contents as this one
+        '''
+        pack = DataPack(edus=self.edus,
+                        pairings=self.pairings,
+                        data=self.data,
+                        target=self.target,
+                        ctarget=self.ctarget,
+                        labels=self.labels,
+                        vocab=self.vocab,
+                        graph=self.graph)
+        for key in ['edu_table', 'pairing_idxes']:
+            if key in self.__dict__:
+                pack.__dict__[key] = self.__dict__[key]
+        return pack
+
+
+class DataPackView(_LazyDataPack):
+    '''
+    A selection of rows from another ("base") datapack, as returned
+    by :py:meth:`DataPack.selected`.
+
+    Only the index array is recorded when the view is created (along
+    with the targets and graph, which are cheap to slice). The EDUs,
+    pairings, features and structured targets are only computed when
+    first accessed, and then cached on the view. Selecting from a view
+    gives a view on the original base datapack.
+    '''
+    _lazy_fields = ('edus', 'pairings', 'data', 'ctarget')
+
+    def __new__(cls, base, indices, graph=False):
+        indices = np.asarray(indices)
+        indices = np.where(indices)[0] if indices.dtype == bool\
+            else indices.astype(np.intp, copy=False)
+        if graph is False:
+            graph = None if base.graph is None\
+                else base.graph.selected(indices)
+        if isinstance(base, DataPackView):
+            indices = base.indices[indices]
+            base = base.base
+        pack = super(DataPackView, cls).__new__(
+            cls,
+            edus=None,
+            pairings=None,
+            data=None,
+            target=np.take(base.target, indices),
+            ctarget=None,
+            labels=base.labels,
+            vocab=base.vocab,
+            graph=graph)
+        pack.__dict__['base'] = base
+        pack.__dict__['indices'] = indices
+        return pack
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __repr__(self):
+        return '<DataPackView: {num} of {total} rows>'.format(
+            num=len(self), total=len(self.base))
+
+    @_cached_property
+    def _edu_rows(self):
+        "rows of the base EDU table involved in the selected pairings"
+        return np.unique(self.base.pairing_idxes[self.indices])
+
+    @_cached_property
+    def edus(self):
+        "the base datapack EDUs which are involved in the pairings"
+        base_table = self.base.edu_table
+        num_listed = self.base.num_listed_edus
+        return [base_table.edus[i] for i in self._edu_rows
+                if i < num_listed]
+
+    @_cached_property
+    def pairings(self):
+        "the selected pairings"
+        base_pairings = self.base.pairings
+        return [base_pairings[i] for i in self.indices.tolist()]
+
+    @_cached_property
+    def data(self):
+        "the selected feature rows"
+        return self.base.data[self.indices]
+
+    @_cached_property
+    def ctarget(self):
+        "the structured targets for the groupings in the selection"
+        if not self.base.ctarget:
+            return {}
+        # FIXME restrict further, break RSTTree into forest of RSTTrees
+        # that can be built using sel_pairings only (not sure this is
+        # well-defined)
+        table = self.edu_table
+        idxes = self.pairing_idxes
+        codes = np.where(table.grouping[idxes[:, 0]] < 0,
+                         table.grouping[idxes[:, 1]],
+                         table.grouping[idxes[:, 0]])
+        sel_groupings = set(table.grouping_names[c]
+                            for c in np.unique(codes) if c >= 0)
+        return {grp_name: ctgt
+                for grp_name, ctgt in self.base.ctarget.items()
+                if grp_name in sel_groupings}
+
+    @_cached_property
+    def edu_table(self):
+        "sub-table of the base datapack EDU table"
+        base_table = self.base.edu_table
+        rows = self._edu_rows
+        edus = [base_table.edus[i] for i in rows]
+        return EduTable(edus=edus,
+                        index={e.id: i for i, e in enumerate(edus)},
+                        grouping=base_table.grouping[rows],
+                        grouping_names=base_table.grouping_names,
+                        subgrouping=base_table.subgrouping[rows],
+                        fake_root=base_table.fake_root[rows])
+
+    @_cached_property
+    def pairing_idxes(self):
+        "selected pairings, as rows of `self.edu_table`"
+        remap = np.zeros(len(self.base.edu_table), dtype=np.int32)
+        remap[self._edu_rows] = np.arange(len(self._edu_rows))
+        return remap[self.base.pairing_idxes[self.indices]]
+
+    def _with_graph(self, graph):
+        return DataPackView(self.base, self.indices, graph=graph)
+
+
+class StackedDataPack(_LazyDataPack):
+    '''
+    Several datapacks combined into one, as returned by
+    :py:meth:`DataPack.vstack`.
+
+    The feature matrices are stacked up front (into a single CSR
+    matrix), as are the targets and graph; the EDU and
+    pairing lists and structured targets are only concatenated if they
+    are actually accessed.
+
+    Attributes
+    ----------
+    parts: [DataPack]
+        the datapacks that were stacked
+
+    offsets: 1D array(int)
+        row at which each part starts (with a final element for the
+        total number of rows); the rows for part `i` are
+        `offsets[i]:offsets[i+1]`
+    '''
+    _lazy_fields = ('edus', 'pairings', 'ctarget')
+
+    def __new__(cls, parts, graph=False):
+        parts = list(_chain_parts(parts))
+        if graph is False:
+            graph = Graph.vstack(d.graph for d in parts)
+        dzero = parts[0]
+        pack = super(StackedDataPack, cls).__new__(
+            cls,
+            edus=None,
+            pairings=None,
+            # with all blocks in CSR format, scipy copies them straight
+            # into preallocated arrays
+            data=scipy.sparse.vstack([d.data.tocsr() for d in parts],
+                                     format='csr'),
+            target=np.concatenate([d.target for d in parts]),
+            ctarget=None,
+            labels=dzero.labels,
+            vocab=dzero.vocab,
+            graph=graph)
+        pack.__dict__['parts'] = parts
+        pack.__dict__['offsets'] = np.cumsum([0] + [len(d) for d in parts])
+        return pack
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __repr__(self):
+        return '<StackedDataPack: {num} rows in {parts} parts>'.format(
+            num=len(self), parts=len(self.parts))
+
+    @_cached_property
+    def edus(self):
+        "the EDUs of all the parts"
+        return concat_l(d.edus for d in self.parts)
+
+    @_cached_property
+    def pairings(self):
+        "the pairings of all the parts"
+        return concat_l(d.pairings for d in self.parts)
+
+    @_cached_property
+    def ctarget(self):
+        "the structured targets of all the parts"
+        return {grp_name: list(itertools.chain.from_iterable(
+            d.ctarget.get(grp_name, []) for d in self.parts))
+                for grp_name in
+                set(itertools.chain.from_iterable(
+                    d.ctarget.keys() for d in self.parts))}
+
+    def split(self):
+        '''
+        Return the datapacks that were stacked, with the relevant
+        portion of the graph (if any) set on each
+
+        :rtype: [DataPack]
+        '''
+        if self.graph is None:
+            return list(self.parts)
+        offsets = self.offsets
+        return [part._with_graph(self.graph.selected(slice(start, end)))
+                for part, start, end in zip(self.parts,
+                                            offsets[:-1],
+                                            offsets[1:])]
+
+    def _with_graph(self, graph):
+        return StackedDataPack(self.parts, graph=graph)
+
+
+def _chain_parts(dpacks):
+    '''
+    Iterate on the datapacks, replacing any stacked datapacks
+    by their parts
+    '''
+    for dpack in dpacks:
+        if isinstance(dpack, StackedDataPack):
+            for part in dpack.split():
+                yield part
+        else:
+            yield dpack
+
+
+def _pairing_grouping(edu1, edu2):
+    """
+    Return the grouping that a pairing belongs to, ie. that of its
+    EDUs (ignoring the fake root which belongs to no grouping)
+
+    Raises DataPackException if the EDUs are in different groupings
+
+    :rtype: string
+    """
+    grp1 = edu1.grouping
+    grp2 = edu2.grouping
+    if grp1 is None:
+        return grp2
+    elif grp2 is None:
+        return grp1
+    elif grp1 != grp2:
+        oops = ('Grouping mismatch: {edu1} is in group {grp1}, '
+                'but {edu2} is in {grp2}')
+        raise(DataPackException(oops.format(edu1=edu1,
+                                            edu2=edu2,
+                                            grp1=grp1,
+                                            grp2=grp2)))
+    else:
+        return grp1
 
 
 def groupings(pairings):
@@ -400,22 +970,7 @@ def groupings(pairings):
     '''
     res = defaultdict(list)
     for i, (edu1, edu2) in enumerate(pairings):
-        grp1 = edu1.grouping
-        grp2 = edu2.grouping
-        if grp1 is None:
-            grp = grp2
-        elif grp2 is None:
-            grp = grp1
-        elif grp1 != grp2:
-            oops = ('Grouping mismatch: {edu1} is in group {grp1}, '
-                    'but {edu2} is in {grp2}')
-            raise(DataPackException(oops.format(edu1=edu1,
-                                                edu2=edu2,
-                                                grp1=grp1,
-                                                grp2=grp2)))
-        else:
-            grp = grp1
-        res[grp].append(i)
+        res[_pairing_grouping(edu1, edu2)].append(i)
     return res
 
 
@@ -538,12 +1093,28 @@ def for_labelling(dpack, target):
     return dpack, target
 
 
+def _intra_masks(dpack):
+    """Boolean masks over the pairings of a datapack: pairings whose
+    parent is the fake root, and pairings whose EDUs are in the same
+    (grouping, subgrouping)
+
+    :rtype: (1D array(bool), 1D array(bool))
+    """
+    table = dpack.edu_table
+    idxes = dpack.pairing_idxes
+    is_root = table.fake_root[idxes[:, 0]]
+    same = table.subgrouping[idxes[:, 0]] == table.subgrouping[idxes[:, 1]]
+    return is_root, same
+
+
 def idxes_fakeroot(dpack):
     """Return datapack indices only the pairings which involve the
     fakeroot node
+
+    :rtype: 1D array(int)
     """
-    return [i for i, (edu1, _) in enumerate(dpack.pairings)
-            if edu1.id == FAKE_ROOT_ID]
+    table = dpack.edu_table
+    return np.where(table.fake_root[dpack.pairing_idxes[:, 0]])[0]
 
 
 def grouped_intra_pairings(dpack, include_fake_root=False):
@@ -560,30 +1131,27 @@ def grouped_intra_pairings(dpack, include_fake_root=False):
 
     Returns
     -------
-    groups : dict from (string, string) to list of integers
-        Map each (grouping, subgrouping) to the list of pairing indices
-        within the same subgrouping.
+    groups : dict from (string, string) to array of integers
+        Map each (grouping, subgrouping) to the (sorted) array of
+        pairing indices within the same subgrouping.
 
     Notes
     -----
     The result roughly corresponds to a hypothetical
     `dpack.pairings['intra'].groupby(['grouping', 'subgrouping']).groups`.
     """
-    groups = defaultdict(list)
-
-    if include_fake_root:
-        for i, (edu1, edu2) in enumerate(dpack.pairings):
-            key1 = (edu1.grouping, edu1.subgrouping)
-            key2 = (edu2.grouping, edu2.subgrouping)
-            if edu1.id == FAKE_ROOT_ID or key1 == key2:
-                groups[key2].append(i)
-    else:
-        for i, (edu1, edu2) in enumerate(dpack.pairings):
-            key1 = (edu1.grouping, edu1.subgrouping)
-            key2 = (edu2.grouping, edu2.subgrouping)
-            if edu1.id != FAKE_ROOT_ID and key1 == key2:
-                groups[key2].append(i)
-
+    idxes = idxes_intra(dpack, include_fake_root=include_fake_root)
+    table = dpack.edu_table
+    codes = table.subgrouping[dpack.pairing_idxes[idxes, 1]]
+    order = np.argsort(codes, kind='mergesort')
+    uniq_codes, starts = np.unique(codes[order], return_index=True)
+    # any EDU with the code will do to recover the key
+    _, code_rows = np.unique(table.subgrouping, return_index=True)
+    groups = {}
+    for code, chunk in zip(uniq_codes,
+                           np.split(idxes[order], starts[1:])):
+        edu = table.edus[code_rows[code]]
+        groups[(edu.grouping, edu.subgrouping)] = chunk
     return groups
 
 
@@ -600,20 +1168,14 @@ def idxes_intra(dpack, include_fake_root=False):
 
     Returns
     -------
-    idxes : list of int
+    idxes : 1D array of int
         Indices of the intra pairings.
     """
+    is_root, same = _intra_masks(dpack)
     if include_fake_root:
-        idxes = [i for i, (edu1, edu2) in enumerate(dpack.pairings)
-                 if (edu1.id == FAKE_ROOT_ID or
-                     (edu1.grouping == edu2.grouping and
-                      edu1.subgrouping == edu2.subgrouping))]
+        return np.where(is_root | same)[0]
     else:
-        idxes = [i for i, (edu1, edu2) in enumerate(dpack.pairings)
-                 if (edu1.id != FAKE_ROOT_ID and
-                     edu1.grouping == edu2.grouping and
-                     edu1.subgrouping == edu2.subgrouping)]
-    return idxes
+        return np.where(~is_root & same)[0]
 
 
 def idxes_inter(dpack, include_fake_root=False):
@@ -629,20 +1191,14 @@ def idxes_inter(dpack, include_fake_root=False):
 
     Returns
     -------
-    idxes : list of int
+    idxes : 1D array of int
         Indices of the inter pairings.
     """
+    is_root, same = _intra_masks(dpack)
     if include_fake_root:
-        idxes = [i for i, (edu1, edu2) in enumerate(dpack.pairings)
-                 if (edu1.id == FAKE_ROOT_ID or
-                     edu1.grouping != edu2.grouping or
-                     edu1.subgrouping != edu2.subgrouping)]
+        return np.where(is_root | ~same)[0]
     else:
-        idxes = [i for i, (edu1, edu2) in enumerate(dpack.pairings)
-                 if (edu1.id != FAKE_ROOT_ID and
-                     (edu1.grouping != edu2.grouping or
-                      edu1.subgrouping != edu2.subgrouping))]
-    return idxes
+        return np.where(~is_root & ~same)[0]
 
 
 class Multipack(dict):
@@ -670,6 +1226,40 @@ def _edu_positions(dpack):
     return position
 
 
+def _edu_position_array(dpack):
+    """Array version of :py:func:`_edu_positions`, giving the position
+    of each EDU in `dpack.edu_table`. The fake root (and any EDU that
+    is not in `dpack.edus`) is at position 0.
+
+    Note that this will only work correctly on single-document
+    datapacks.
+
+    :rtype: 1D array(int)
+    """
+    table = dpack.edu_table
+    listed = np.unique(np.array([table.index[e.id] for e in dpack.edus],
+                                dtype=int))
+    starts = np.array([table.edus[i].span()[0] for i in listed], dtype=int)
+    res = np.zeros(len(table), dtype=int)
+    res[listed[np.argsort(starts, kind='mergesort')]] = np.arange(len(listed))
+    res[table.fake_root] = 0
+    return res
+
+
+def _pairing_gaps(dpack):
+    """Return for each pairing the (signed) distance from its
+    parent to its child, in number of EDUs.
+
+    Note that this will only work correctly on single-document
+    datapacks.
+
+    :rtype: 1D array(int)
+    """
+    position = _edu_position_array(dpack)
+    idxes = dpack.pairing_idxes
+    return position[idxes[:, 1]] - position[idxes[:, 0]]
+
+
 def select_window(dpack, window):
     '''Select only EDU pairs that are at most `window` EDUs apart
     from each other (adjacent EDUs would be considered `0` apart)
@@ -681,12 +1271,7 @@ def select_window(dpack, window):
     '''
     if window is None:
         return dpack
-    position = _edu_positions(dpack)
-    indices = []
-    for i, (edu1, edu2) in enumerate(dpack.pairings):
-        gap = abs(position[edu2.id] - position[edu1.id])
-        if gap <= window:
-            indices.append(i)
+    indices = np.where(np.abs(_pairing_gaps(dpack)) <= window)[0]
     return dpack.selected(indices)
 
 
@@ -701,18 +1286,16 @@ def pairing_distances(dpack):
 
     :rtype dict(int, (int, int))
     """
-    position = _edu_positions(dpack)
-    max_l = defaultdict(int)
-    max_r = defaultdict(int)
-    for i, (edu1, edu2) in enumerate(dpack.pairings):
-        gap = position[edu2.id] - position[edu1.id]
-        lbl = dpack.target[i]
-        if gap < 0:
-            max_l[lbl] = max(max_l[lbl], -gap)
-        else:
-            max_r[lbl] = max(max_r[lbl], gap)
-    keys = frozenset(max_l.keys() + max_r.keys())
-    return {k: (max_l[k], max_r[k]) for k in keys}
+    gaps = _pairing_gaps(dpack)
+    target = np.asarray(dpack.target)
+    res = {}
+    for lbl in np.unique(target):
+        lbl_gaps = gaps[target == lbl]
+        left = lbl_gaps[lbl_gaps < 0]
+        right = lbl_gaps[lbl_gaps >= 0]
+        res[lbl] = (int(-left.min()) if len(left) else 0,
+                    int(right.max()) if len(right) else 0)
+    return res
 
 
 def mpack_pairing_distances(mpack):
@@ -6,21 +6,43 @@ attelo tests
 # no-member: numpy
 
 from __future__ import print_function
+from argparse import Namespace
+from os import path as fp
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
 import unittest
 
+from sklearn.datasets import load_svmlight_file
 import scipy.sparse
 import numpy
 import numpy as np
 
 import attelo
+import attelo.cmd.compile_mpack
 import attelo.fold
 
 from .edu import EDU, FAKE_ROOT
 from .fold import select_training
+from .io import (COMPILED_FORMAT,
+                 IoException,
+                 _chunk_offsets,
+                 compile_multipack,
+                 iter_multipack,
+                 load_compiled_datapack,
+                 load_features,
+                 load_multipack,
+                 multipack_key)
 from .table import (DataPack,
                     DataPackException,
+                    Graph,
                     attached_only,
-                    groupings)
+                    groupings,
+                    pairing_distances,
+                    select_window)
 
 MAX_FOLDS = 2
 
@@ -135,6 +157,11 @@ class DataPackTest(unittest.TestCase):
                         vocab=None)
         labels = [pack.get_label(t) for t in pack.target]
         self.assertEqual(['y', 'x', 'x', 'UNRELATED'], labels)
+        self.assertEqual(labels, list(pack.get_labels(pack.target)))
+        self.assertEqual(3, pack.label_number('UNRELATED'))
+        self.assertEqual(list(pack.target),
+                         list(pack.label_numbers(labels)))
+        self.assertRaises(ValueError, pack.label_number, 'z')
 
 
     def test_select_classes(self):
@@ -170,6 +197,167 @@ class DataPackTest(unittest.TestCase):
         pack3 = pack.selected([1, 2])
         self.assertEqual(orig_classes, pack3.labels)
 
+    def test_selected_view(self):
+        'selections are lazy but behave like plain datapacks'
+        # pylint: disable=invalid-name
+        a1 = EDU('a1', 'hi', 0, 1, 'a', 's1')
+        a2 = EDU('a2', 'there', 3, 8, 'a', 's1')
+        b1 = EDU('b1', 'this', 0, 4, 'b', 's2')
+        b2 = EDU('b2', 'is', 6, 8, 'b', 's2')
+        # pylint: enable=invalid-name
+        pack = DataPack.load(edus=[FAKE_ROOT, a1, a2, b1, b2],
+                             pairings=[(a1, a2),
+                                       (b1, b2),
+                                       (FAKE_ROOT, b1),
+                                       (b2, b1)],
+                             data=scipy.sparse.csr_matrix([[6, 8],
+                                                           [7, 0],
+                                                           [3, 9],
+                                                           [1, 1]]),
+                             target=numpy.array([3, 1, 2, 3]),
+                             ctarget=dict(),  # DIRTY
+                             labels=['__UNK__', 'x', 'y', 'UNRELATED'],
+                             vocab=None)
+        view = pack.selected([1, 2, 3])
+        self.assertEqual(3, len(view))
+        self.assertEqual([FAKE_ROOT, b1, b2], view.edus)
+        self.assertEqual(pack.pairings[1:], view.pairings)
+        self.assertEqual([[7, 0], [3, 9], [1, 1]],
+                         view.data.todense().tolist())
+        # selecting from a selection
+        view2 = view.selected([2, 0])
+        self.assertEqual([(b2, b1), (b1, b2)], view2.pairings)
+        self.assertEqual([3, 1], view2.target.tolist())
+        for (edu1, edu2), (idx1, idx2) in zip(view2.pairings,
+                                              view2.pairing_idxes):
+            self.assertEqual(edu1, view2.edu_table.edus[idx1])
+            self.assertEqual(edu2, view2.edu_table.edus[idx2])
+        # compacting (or pickling) gives a plain datapack
+        compact = view2.compact()
+        self.assertTrue(type(compact) is DataPack)
+        self.assertEqualishDatapack(view2, compact)
+        self.assertEqualishDatapack(view2,
+                                    pickle.loads(pickle.dumps(view2)))
+        # the tuple slots go through the lazy fields
+        self.assertEqual(view2.edus, view2[0])
+        self.assertEqual(view2.pairings, view2[1])
+        self.assertTrue(view2.data is view2[2])
+        self.assertEqual(view2.pairings, view2[-7])
+        self.assertEqual((view2.edus, view2.pairings), view2[:2])
+        self.assertEqual(list(view2), list(DataPack._make(view2)))
+        self.assertEqual(view2, view2.compact())
+        # replacing fields gives a plain datapack
+        replaced = view2._replace(target=numpy.array([1, 1]))
+        self.assertTrue(type(replaced) is DataPack)
+        self.assertEqual([(b2, b1), (b1, b2)], replaced.pairings)
+        self.assertEqual([1, 1], replaced.target.tolist())
+        self.assertEqual([[1, 1], [7, 0]],
+                         replaced.data.todense().tolist())
+
+    def test_vstack(self):
+        'stacking datapacks and splitting them back'
+        pack1 = self.trivial_bidi
+        pack2 = self.trivial_bidi.selected([1])
+        stacked = DataPack.vstack([pack1, pack2])
+        self.assertEqual(3, len(stacked))
+        self.assertEqual(pack1.edus + pack2.edus, stacked.edus)
+        self.assertEqual(pack1.pairings + pack2.pairings, stacked.pairings)
+        self.assertEqual([1, 0, 0], stacked.target.tolist())
+        self.assertEqual([[6, 8], [7, 0], [7, 0]],
+                         stacked.data.todense().tolist())
+        self.assertEqual([0, 2, 3], stacked.offsets.tolist())
+        # graphs are split back along with the packs
+        graph = Graph(prediction=np.array([1, 2, 1]),
+                      attach=np.array([0.1, 0.2, 0.3]),
+                      label=np.zeros((3, 3)))
+        parts = stacked.set_graph(graph).split()
+        self.assertEqual(2, len(parts))
+        self.assertEqualishDatapack(pack1, parts[0])
+        self.assertEqualishDatapack(pack2, parts[1])
+        self.assertEqual([0.1, 0.2], parts[0].graph.attach.tolist())
+        self.assertEqual([0.3], parts[1].graph.attach.tolist())
+        # the lazy fields are visible through the tuple slots too
+        self.assertEqual(pack1.pairings + pack2.pairings, stacked[1])
+        replaced = stacked._replace(target=numpy.array([0, 1, 1]))
+        self.assertTrue(type(replaced) is DataPack)
+        self.assertEqual(stacked.pairings, replaced.pairings)
+        self.assertEqual(stacked.edus, replaced.edus)
+        self.assertEqual([0, 1, 1], replaced.target.tolist())
+        weighted = replaced.set_graph(graph)
+        self.assertEqual(stacked.pairings, weighted.pairings)
+        self.assertEqual([0.1, 0.2, 0.3], weighted.graph.attach.tolist())
+        # stacking stacked packs
+        restacked = DataPack.vstack([stacked, pack1])
+        self.assertEqual([0, 2, 3, 5], restacked.offsets.tolist())
+
+    def test_pairing_idxes(self):
+        'integer view on pairings agrees with the EDU tuples'
+        # pylint: disable=invalid-name
+        a1 = EDU('a1', 'hi', 0, 1, 'a', 's1')
+        a2 = EDU('a2', 'there', 3, 8, 'a', 's1')
+        a3 = EDU('a3', 'you', 9, 12, 'a', 's2')
+        # pylint: enable=invalid-name
+        pack = DataPack.load(edus=[a1, a2, a3],
+                             pairings=[(a1, a2),
+                                       (FAKE_ROOT, a3),
+                                       (a3, a1)],
+                             data=scipy.sparse.csr_matrix([[6], [7], [3]]),
+                             target=numpy.array([1, 2, 3]),
+                             ctarget=dict(),  # DIRTY
+                             labels=['__UNK__', 'x', 'y', 'UNRELATED'],
+                             vocab=None)
+        table = pack.edu_table
+        self.assertEqual([a1, a2, a3, FAKE_ROOT], table.edus)
+        self.assertEqual([[0, 1], [3, 2], [2, 0]],
+                         pack.pairing_idxes.tolist())
+        self.assertEqual(np.int32, pack.pairing_idxes.dtype)
+        for (edu1, edu2), (idx1, idx2) in zip(pack.pairings,
+                                              pack.pairing_idxes):
+            self.assertEqual(edu1, table.edus[idx1])
+            self.assertEqual(edu2, table.edus[idx2])
+        self.assertEqual([0, 0, 0, -1], table.grouping.tolist())
+        self.assertEqual(['a'], table.grouping_names)
+        subgrp = table.subgrouping
+        self.assertEqual(subgrp[0], subgrp[1])
+        self.assertNotEqual(subgrp[1], subgrp[2])
+        self.assertEqual([False, False, False, True],
+                         table.fake_root.tolist())
+        # distances are in EDUs (fake root and first EDU are both 0)
+        self.assertEqual({1: (0, 1), 2: (0, 2), 3: (2, 0)},
+                         pairing_distances(pack))
+        self.assertEqual([(a1, a2)], select_window(pack, 1).pairings)
+
+    def test_candidates(self):
+        'struct of arrays view on a weighted datapack'
+        # pylint: disable=invalid-name
+        a1 = EDU('a1', 'hi', 0, 1, 'a', 's1')
+        a2 = EDU('a2', 'there', 3, 8, 'a', 's1')
+        a3 = EDU('a3', 'you', 9, 12, 'a', 's2')
+        # pylint: enable=invalid-name
+        pack = DataPack.load(edus=[a1, a2, a3],
+                             pairings=[(a1, a2),
+                                       (FAKE_ROOT, a3),
+                                       (a3, a1)],
+                             data=scipy.sparse.csr_matrix([[6], [7], [3]]),
+                             target=numpy.array([1, 2, 3]),
+                             ctarget=dict(),  # DIRTY
+                             labels=['__UNK__', 'x', 'y', 'UNRELATED'],
+                             vocab=None)
+        self.assertRaises(ValueError, lambda: pack.candidates)
+        graph = Graph(prediction=np.array([3, 3, 3]),
+                      attach=np.array([0.2, 0.9, 0.4]),
+                      label=np.array([[0, 1, 0, 0],
+                                      [0, 0, 1, 0],
+                                      [0, 0, 0, 1]]))
+        cands = pack.set_graph(graph).candidates
+        self.assertEqual([0, 3, 2], cands.src.tolist())
+        self.assertEqual([1, 2, 0], cands.tgt.tolist())
+        self.assertEqual([0.2, 0.9, 0.4], cands.attach.tolist())
+        self.assertEqual([1, 2, 3], cands.label.tolist())
+        self.assertEqual([1, -1, 2],
+                         cands.lookup([3, 0, 2], [2, 3, 0]).tolist())
+        self.assertEqual([3, 0, 1, 2], cands.sorted_edus().tolist())
+
     def test_folds(self):
         'test that fold selection does something sensible'
 
@@ -229,3 +417,238 @@ class DataPackTest(unittest.TestCase):
                                ['a1', 'a2', 'c1', 'c2'])
         self.assertEqualEduIds(attelo.fold.select_testing(mpack, fold_dict, 1),
                                ['b1', 'b2', 'd1', 'd2'])
+
+
+class IoTest(unittest.TestCase):
+    '''
+    reading multipacks from (and compiling them into) files
+    '''
+    edus = [('d1_e1', 'hello', 'd1', 's1', 0, 5),
+            ('d1_e2', 'there', 'd1', 's1', 6, 11),
+            ('d2_e1', 'how', 'd2', 's1', 0, 3),
+            ('d2_e2', 'are', 'd2', 's1', 4, 7),
+            ('d2_e3', 'you', 'd2', 's2', 8, 11)]
+    pairings = [('ROOT', 'd1_e1'),
+                ('d1_e1', 'd1_e2'),
+                ('ROOT', 'd2_e1'),
+                ('d2_e1', 'd2_e2'),
+                ('d2_e2', 'd2_e3'),
+                ('d2_e1', 'd2_e3'),
+                ('d2_e3', 'd2_e1')]
+    # one-based, and the last vocabulary entry is never used
+    features = ['1 1:1 3:2',
+                '3 2:1',
+                '1 1:4',
+                '2 1:1 2:1 3:1',
+                '3 3:5',
+                '2',
+                '3 2:2']
+    labels = ['elaboration', 'narration', 'UNRELATED']
+    vocab = ['f1', 'f2', 'f3', 'f4']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = fp.join(self.tmp_dir, 'cache')
+        self.edu_file = fp.join(self.tmp_dir, 'tiny.edus')
+        self.pairings_file = fp.join(self.tmp_dir, 'tiny.pairings')
+        self.feature_file = fp.join(self.tmp_dir, 'tiny.features.sparse')
+        self.vocab_file = self.feature_file + '.vocab'
+        self.write_lines(self.edu_file,
+                         ['\t'.join(str(x) for x in edu)
+                          for edu in self.edus])
+        self.write_lines(self.pairings_file,
+                         ['\t'.join(pair) for pair in self.pairings])
+        self.write_features(self.features)
+        self.write_lines(self.vocab_file,
+                         ['{}\t{}'.format(feat, i + 1)
+                          for i, feat in enumerate(self.vocab)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def write_lines(filename, lines):
+        'write a text file, one line per item'
+        with open(filename, 'w') as stream:
+            for line in lines:
+                print(line, file=stream)
+
+    def write_features(self, lines):
+        'write the feature file (with a labels header)'
+        self.write_lines(self.feature_file,
+                         ['# labels: ' + ' '.join(self.labels)] + lines)
+
+    def load(self, **kwargs):
+        'load the multipack from the input files'
+        return load_multipack(self.edu_file,
+                              self.pairings_file,
+                              self.feature_file,
+                              self.vocab_file,
+                              **kwargs)
+
+    # pylint: disable=invalid-name
+    def assertEqualMultipack(self, mpack1, mpack2):
+        '''
+        the two multipacks have the same groupings, with the
+        same contents
+        '''
+        self.assertEqual(sorted(mpack1), sorted(mpack2))
+        for grouping in mpack1:
+            dpack1 = mpack1[grouping]
+            dpack2 = mpack2[grouping]
+            self.assertEqual(dpack1.edus, dpack2.edus)
+            self.assertEqual(dpack1.pairings, dpack2.pairings)
+            self.assertEqual(dpack1.labels, dpack2.labels)
+            self.assertEqual(dpack1.vocab, dpack2.vocab)
+            self.assertEqual(dpack1.target.tolist(), dpack2.target.tolist())
+            self.assertEqual(dpack1.data.shape, dpack2.data.shape)
+            self.assertEqual(squish(dpack1.data), squish(dpack2.data))
+            self.assertEqual(dpack1.pairing_idxes.tolist(),
+                             dpack2.pairing_idxes.tolist())
+            self.assertEqual(dpack1.edu_table.edus, dpack2.edu_table.edus)
+    # pylint: enable=invalid-name
+
+    def test_compiled_roundtrip(self):
+        'compiled multipacks read back the same as the input files'
+        mpack = self.load()
+        self.assertEqual(['d1', 'd2'], sorted(mpack))
+        self.assertEqual([[1, 0, 2, 0], [0, 1, 0, 0]],
+                         mpack['d1'].data.todense().tolist())
+        # compiling with the subcommand
+        args = Namespace(edus=self.edu_file,
+                         pairings=self.pairings_file,
+                         features=self.feature_file,
+                         vocab=self.vocab_file,
+                         output=None,
+                         cache_dir=self.cache_dir,
+                         quiet=True,
+                         load_jobs=1)
+        attelo.cmd.compile_mpack.main(args)
+        key = multipack_key(self.edu_file, self.pairings_file,
+                            self.feature_file, self.vocab_file)
+        self.assertEqual([key], os.listdir(self.cache_dir))
+        self.assertEqualMultipack(mpack, self.load(cache_dir=self.cache_dir))
+        # the compiled datapack has the same EDU table as a fresh one
+        dpack = load_compiled_datapack(fp.join(self.cache_dir, key))
+        self.assertEqual(len(self.pairings), len(dpack))
+        table = DataPack(**dict(dpack._asdict(),
+                                pairings=list(dpack.pairings))).edu_table
+        self.assertEqual(table.edus, dpack.edu_table.edus)
+        self.assertEqual(table.index, dpack.edu_table.index)
+        self.assertEqual(table.grouping_names,
+                         dpack.edu_table.grouping_names)
+        for field in ['grouping', 'subgrouping', 'fake_root']:
+            self.assertEqual(getattr(table, field).tolist(),
+                             getattr(dpack.edu_table, field).tolist())
+
+    def test_compiled_stale(self):
+        'rewriting an input file makes us compile it again'
+        compiled_dir = compile_multipack(self.edu_file,
+                                         self.pairings_file,
+                                         self.feature_file,
+                                         self.vocab_file,
+                                         self.cache_dir)
+        self.assertEqual(compiled_dir,
+                         compile_multipack(self.edu_file,
+                                           self.pairings_file,
+                                           self.feature_file,
+                                           self.vocab_file,
+                                           self.cache_dir))
+        features = list(self.features)
+        features[0] = '2 1:3 3:2'
+        self.write_features(features)
+        # make sure the modification time moves on too
+        stamp = time.time() + 10
+        os.utime(self.feature_file, (stamp, stamp))
+        mpack = self.load(cache_dir=self.cache_dir)
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+        self.assertNotEqual(compiled_dir,
+                            compile_multipack(self.edu_file,
+                                              self.pairings_file,
+                                              self.feature_file,
+                                              self.vocab_file,
+                                              self.cache_dir))
+        self.assertEqual([2, 3], mpack['d1'].target.tolist())
+        self.assertEqualMultipack(self.load(), mpack)
+
+    def test_compiled_format(self):
+        'we refuse to read compiled data in some other format'
+        compiled_dir = compile_multipack(self.edu_file,
+                                         self.pairings_file,
+                                         self.feature_file,
+                                         self.vocab_file,
+                                         self.cache_dir)
+        meta_file = fp.join(compiled_dir, 'meta.json')
+        with open(meta_file) as stream:
+            meta = json.load(stream)
+        meta['format'] = COMPILED_FORMAT - 1
+        with open(meta_file, 'w') as stream:
+            json.dump(meta, stream)
+        self.assertRaises(IoException,
+                          load_compiled_datapack, compiled_dir)
+
+    def test_iter_multipack(self):
+        'streaming the datapacks one grouping at a time'
+        def iterate():
+            'read the datapacks from the input files, one at a time'
+            return iter_multipack(self.edu_file,
+                                  self.pairings_file,
+                                  self.feature_file,
+                                  self.vocab_file)
+        groupings_read = [grp for grp, _ in iterate()]
+        self.assertEqual(['d1', 'd2'], groupings_read)
+        self.assertEqualMultipack(self.load(), dict(iterate()))
+        # zero-based indices are guessed from the features, as in
+        # load_multipack (here: the first column is now index 0)
+        self.write_features([line.replace(' ', ' 0:1 ', 1)
+                             if ' ' in line else line + ' 0:1'
+                             for line in self.features])
+        mpack = self.load()
+        self.assertEqual([[1, 1, 0, 2], [1, 0, 1, 0]],
+                         mpack['d1'].data.todense().tolist())
+        self.assertEqualMultipack(mpack, dict(iterate()))
+        # the rows for each grouping must be contiguous
+        self.write_lines(self.pairings_file,
+                         ['\t'.join(pair)
+                          for pair in self.pairings[1:] + self.pairings[:1]])
+        self.assertRaises(IoException, list, iterate())
+
+    def test_load_features(self):
+        'reading the features in parallel chunks'
+        def check(n_features=None):
+            'compare with reading the whole file in one go'
+            # pylint: disable=unbalanced-tuple-unpacking
+            want_data, want_target = load_svmlight_file(
+                self.feature_file, n_features=n_features)
+            # pylint: enable=unbalanced-tuple-unpacking
+            for n_jobs in [1, 2, 3]:
+                data, target = load_features(self.feature_file,
+                                             n_features=n_features,
+                                             n_jobs=n_jobs)
+                self.assertEqual(want_data.shape, data.shape)
+                self.assertEqual(squish(want_data), squish(data))
+                self.assertEqual(want_target.tolist(), target.tolist())
+
+        # (7 instances, so not divisible into 2 or 3 equal chunks)
+        self.assertEqual(3, len(_chunk_offsets(self.feature_file, 3)))
+        check()
+        check(n_features=len(self.vocab))
+        self.assertRaises(ValueError, load_features, self.feature_file,
+                          n_features=2, n_jobs=3)
+        # zero-based, but only the last chunk uses index 0
+        self.write_features(self.features[:-1] + ['3 0:2'])
+        check()
+        check(n_features=len(self.vocab))
+
+    def test_targets_only(self):
+        'reading the targets without the features'
+        full = self.load()
+        mpack = self.load(features=False, cache_dir=self.cache_dir)
+        self.assertFalse(fp.exists(self.cache_dir))
+        self.assertEqual(sorted(full), sorted(mpack))
+        for grouping, dpack in mpack.items():
+            self.assertEqual(full[grouping].pairings, dpack.pairings)
+            self.assertEqual(full[grouping].target.tolist(),
+                             dpack.target.tolist())
+            self.assertEqual(full[grouping].labels, dpack.labels)
+            self.assertEqual((len(dpack), 0), dpack.data.shape)
@@ -7,6 +7,8 @@ from collections import namedtuple
 import enum
 import itertools
 import random
+
+from joblib import cpu_count
 # pylint: disable=too-few-public-methods
 
 RNG_SEED = "just an illusion"
@@ -92,3 +94,18 @@ def mk_rng(shuffle=False, default_seed=None):
         rng = random.Random()
         rng.seed(default_seed or RNG_SEED)
         return rng
+
+
+def effective_n_jobs(n_jobs):
+    """
+    Number of processes that joblib would use for `n_jobs`
+    (which may be negative)
+
+    :rtype: int
+    """
+    if n_jobs is None:
+        return 1
+    elif n_jobs < 0:
+        return max(1, cpu_count() + 1 + n_jobs)
+    else:
+        return max(1, n_jobs)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+Time the native MST decoder against the original one going through
+`depparse`, on synthetic documents with all possible pairings
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+import argparse
+import timeit
+
+import numpy as np
+import scipy.sparse
+# pylint: disable=no-name-in-module
+from scipy.special import logit
+# pylint: enable=no-name-in-module
+
+from attelo.decoding.mst import MstDecoder, MstRootStrategy
+from attelo.decoding.util import (cap_score, convert_prediction,
+                                  simple_candidates)
+from attelo.edu import EDU, FAKE_ROOT, FAKE_ROOT_ID
+from attelo.table import DataPack, Graph, UNRELATED
+
+# ---------------------------------------------------------------------
+# original implementation, for reference
+# ---------------------------------------------------------------------
+
+
+def old_graph(instances):
+    """
+    depparse Digraph for the fake root strategy, as built by the
+    original `MstDecoder._graph`
+    """
+    # pylint: disable=import-error
+    from depparse.graph import Digraph
+    # pylint: enable=import-error
+    targets = defaultdict(list)
+    labels = dict()
+    scores = dict()
+    for source, target, prob, rel in instances:
+        src, tgt = source.id, target.id
+        # Ignore all edges directed to the root
+        if tgt == FAKE_ROOT_ID:
+            continue
+        scores[src, tgt] = cap_score(logit(prob))
+        labels[src, tgt] = rel
+        targets[src].append(tgt)
+    return Digraph(targets,
+                   lambda s, t: scores[s, t],
+                   lambda s, t: labels[s, t])
+
+
+def old_mst_decode(dpack):
+    "MST decoding with a depparse Digraph (needs depparse)"
+    graph = old_graph(simple_candidates(dpack))
+    subgraph = graph.mst()
+    predictions = [(src, tgt, subgraph.get_label(src, tgt))
+                   for src, tgt in subgraph.iteredges()]
+    return convert_prediction(dpack, predictions)
+
+# ---------------------------------------------------------------------
+# benchmark
+# ---------------------------------------------------------------------
+
+
+def mk_dpack(num_edus, seed=0):
+    """
+    A single document with `num_edus` EDUs and all pairings between
+    them (including from the fake root), with random scores
+    """
+    rng = np.random.RandomState(seed)
+    edus = [EDU('d1_e{}'.format(i), 'x', 2 * i + 1, 2 * i + 2, 'd1', 's1')
+            for i in range(num_edus)]
+    pairings = [(edu1, edu2)
+                for edu1 in [FAKE_ROOT] + edus
+                for edu2 in edus
+                if edu1 != edu2]
+    num_pairings = len(pairings)
+    labels = ['__UNK__', UNRELATED, 'elaboration', 'narration']
+    graph = Graph(prediction=np.zeros(num_pairings, dtype=np.int16),
+                  attach=rng.rand(num_pairings),
+                  label=rng.rand(num_pairings, len(labels)))
+    return DataPack.load(edus=[FAKE_ROOT] + edus,
+                         pairings=pairings,
+                         data=scipy.sparse.csr_matrix((num_pairings, 1)),
+                         target=np.ones(num_pairings),
+                         ctarget={},
+                         labels=labels,
+                         vocab=None).set_graph(graph)
+
+
+def tree_score(dpack):
+    "total logit score of the predicted attachments"
+    unrelated = dpack.label_number(UNRELATED)
+    attached = dpack.graph.prediction != unrelated
+    return np.sum(logit(dpack.graph.attach[attached]))
+
+
+def main():
+    "run the benchmark"
+    psr = argparse.ArgumentParser(description=__doc__)
+    psr.add_argument('--edus', type=int, nargs='+', default=[50, 200, 500],
+                     help='document sizes (default: 50 200 500)')
+    psr.add_argument('--repeat', type=int, default=3)
+    args = psr.parse_args()
+
+    try:
+        # pylint: disable=unused-variable
+        import depparse
+        # pylint: enable=unused-variable
+        has_depparse = True
+    except ImportError:
+        print('depparse not installed: only timing the native decoder')
+        has_depparse = False
+
+    decoder = MstDecoder(MstRootStrategy.fake_root)
+    row = '{:>6} {:>10} {:>12} {:>12}'
+    print(row.format('EDUs', 'pairings', 'native (ms)', 'depparse (ms)'))
+    for num_edus in args.edus:
+        dpack = mk_dpack(num_edus)
+        native_ms = 1000 * min(timeit.repeat(lambda: decoder.decode(dpack),
+                                             number=1, repeat=args.repeat))
+        if has_depparse:
+            old_ms = 1000 * min(timeit.repeat(
+                lambda: old_mst_decode(dpack),
+                number=1, repeat=args.repeat))
+            # both decoders should find trees with the same score
+            # (though not necessarily the same tree if there are ties)
+            assert np.isclose(tree_score(decoder.decode(dpack)),
+                              tree_score(old_mst_decode(dpack)))
+            old_ms = '{:.1f}'.format(old_ms)
+        else:
+            old_ms = '-'
+        print(row.format(num_edus, len(dpack),
+                         '{:.1f}'.format(native_ms), old_ms))
+
+
+if __name__ == '__main__':
+    main()
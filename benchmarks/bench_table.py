@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+Time the intra/inter pairing selection helpers in `attelo.table`
+against their original pure-Python versions, on a single synthetic
+document with all possible pairings (about 10k by default)
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+import argparse
+import timeit
+
+import numpy as np
+import scipy.sparse
+
+from attelo.edu import EDU, FAKE_ROOT, FAKE_ROOT_ID
+from attelo.table import (DataPack,
+                          grouped_intra_pairings,
+                          idxes_fakeroot,
+                          idxes_inter,
+                          idxes_intra)
+
+# ---------------------------------------------------------------------
+# original implementations, for reference
+# ---------------------------------------------------------------------
+
+
+def old_idxes_fakeroot(dpack):
+    "list comprehension version of idxes_fakeroot"
+    return [i for i, (edu1, _) in enumerate(dpack.pairings)
+            if edu1.id == FAKE_ROOT_ID]
+
+
+def old_idxes_intra(dpack):
+    "list comprehension version of idxes_intra"
+    return [i for i, (edu1, edu2) in enumerate(dpack.pairings)
+            if (edu1.id == FAKE_ROOT_ID or
+                (edu1.grouping == edu2.grouping and
+                 edu1.subgrouping == edu2.subgrouping))]
+
+
+def old_idxes_inter(dpack):
+    "list comprehension version of idxes_inter"
+    return [i for i, (edu1, edu2) in enumerate(dpack.pairings)
+            if (edu1.id == FAKE_ROOT_ID or
+                edu1.grouping != edu2.grouping or
+                edu1.subgrouping != edu2.subgrouping)]
+
+
+def old_grouped_intra_pairings(dpack):
+    "loop version of grouped_intra_pairings"
+    groups = defaultdict(list)
+    for i, (edu1, edu2) in enumerate(dpack.pairings):
+        key1 = (edu1.grouping, edu1.subgrouping)
+        key2 = (edu2.grouping, edu2.subgrouping)
+        if edu1.id == FAKE_ROOT_ID or key1 == key2:
+            groups[key2].append(i)
+    return groups
+
+# ---------------------------------------------------------------------
+# benchmark
+# ---------------------------------------------------------------------
+
+
+def mk_dpack(num_edus, sent_len):
+    """
+    A single document with `num_edus` EDUs, split into sentences of
+    `sent_len` EDUs, and all pairings between them (including from
+    the fake root)
+    """
+    edus = [EDU('d1_e{}'.format(i), 'x', 2 * i, 2 * i + 1,
+                'd1', 's{}'.format(i // sent_len))
+            for i in range(num_edus)]
+    pairings = [(edu1, edu2)
+                for edu1 in [FAKE_ROOT] + edus
+                for edu2 in edus
+                if edu1 != edu2]
+    num_pairings = len(pairings)
+    return DataPack.load(edus=[FAKE_ROOT] + edus,
+                         pairings=pairings,
+                         data=scipy.sparse.csr_matrix((num_pairings, 1)),
+                         target=np.ones(num_pairings),
+                         ctarget={},
+                         labels=['__UNK__', 'UNRELATED', 'elaboration'],
+                         vocab=None)
+
+
+def time_it(func, mk_arg, repeat):
+    "best time in ms over a few runs (on a fresh argument each time)"
+    times = []
+    for _ in range(repeat):
+        arg = mk_arg()
+        times.append(timeit.timeit(lambda: func(arg), number=1))
+    return 1000 * min(times)
+
+
+def main():
+    "run the benchmark"
+    psr = argparse.ArgumentParser(description=__doc__)
+    psr.add_argument('--edus', type=int, default=100,
+                     help='number of EDUs (default: 100 ~ 10k pairings)')
+    psr.add_argument('--sentence-length', type=int, default=10,
+                     help='EDUs per sentence')
+    psr.add_argument('--repeat', type=int, default=5)
+    args = psr.parse_args()
+
+    dpack = mk_dpack(args.edus, args.sentence_length)
+    print('{} EDUs, {} pairings'.format(args.edus, len(dpack)))
+
+    def fresh_pack():
+        "datapack without cached tables"
+        return DataPack(*dpack)
+
+    cases = [('idxes_fakeroot', old_idxes_fakeroot, idxes_fakeroot),
+             ('idxes_intra', old_idxes_intra,
+              lambda d: idxes_intra(d, include_fake_root=True)),
+             ('idxes_inter', old_idxes_inter,
+              lambda d: idxes_inter(d, include_fake_root=True)),
+             ('grouped_intra_pairings', old_grouped_intra_pairings,
+              lambda d: grouped_intra_pairings(d, include_fake_root=True))]
+    row = '{:<24} {:>10} {:>12} {:>12}'
+    print(row.format('', 'old (ms)', 'new (ms)', 'cached (ms)'))
+    for name, old, new in cases:
+        old_ms = time_it(old, fresh_pack, args.repeat)
+        new_ms = time_it(new, fresh_pack, args.repeat)
+        cached_ms = time_it(new, lambda: dpack, args.repeat)
+        print(row.format(name,
+                         '{:.2f}'.format(old_ms),
+                         '{:.2f}'.format(new_ms),
+                         '{:.2f}'.format(cached_ms)))
+
+
+if __name__ == '__main__':
+    main()
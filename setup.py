@@ -12,8 +12,7 @@ setup(name="attelo",
                                       "experiments",
                                       "tests"]),
       scripts=["scripts/attelo"],
-      install_requires=['depparse',
-                        'enum34',
+      install_requires=['enum34',
                         'joblib',
                         'mock',
                         'nltk',